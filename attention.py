@@ -0,0 +1,47 @@
+import numpy as np
+import theano.tensor as T
+import util
+
+# bilinear attention of a sequence of query states over a sequence of (masked) states;
+# the score of query q against state s is q . Wa . s and the attended state for q is
+# the softmax (over the unmasked states) weighted sum of states. sequences are batched,
+# time major, (time, batch, dim) and all queries are attended to at once as batched
+# matmuls over (batch, time, _) so there's no scan (nested or otherwise).
+class Attention(object):
+    def __init__(self, name, query_dim, state_dim, update_fn):
+        self.name_ = name
+        self.update_fn = update_fn
+        self.Wa = util.sharedMatrix(state_dim, query_dim, 'Wa', orthogonal_init=True)
+
+    def name(self):
+        return self.name_
+
+    def dense_params(self):
+        return [self.Wa]
+
+    def params_for_l2_penalty(self):
+        return self.dense_params()
+
+    def updates_wrt_cost(self, cost, learning_opts):
+        gradients = util.clipped(T.grad(cost=cost, wrt=self.dense_params()))
+        return self.update_fn(self.dense_params(), gradients, learning_opts)
+
+    # states projected into query space; (time, batch, query_dim). depends only on the
+    # states so can be computed once (eg per premise) and reused for any queries
+    def keys(self, states):
+        return T.dot(states, self.Wa)
+
+    # attended states, (query_time, batch, state_dim), for queries (query_time, batch,
+    # query_dim) over states (time, batch, state_dim) with keys (see keys()) & mask
+    # (time, batch)
+    def attended(self, queries, states, keys, mask):
+        scores = T.batched_dot(queries.dimshuffle(1, 0, 2),
+                               keys.dimshuffle(1, 2, 0))  # (batch, query_time, time)
+        # padding gets a score that exps to 0 (after the max for the softmax is taken
+        # out) so has no weight
+        mask = mask.T.dimshuffle(0, 'x', 1)
+        scores = T.switch(mask, scores, np.float32(-1e30))
+        weights = T.exp(scores - T.max(scores, axis=2, keepdims=True))
+        weights /= T.sum(weights, axis=2, keepdims=True)
+        attended = T.batched_dot(weights, states.dimshuffle(1, 0, 2))
+        return attended.dimshuffle(1, 0, 2)
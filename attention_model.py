@@ -0,0 +1,95 @@
+from attention import Attention
+from bidirectional_gru_rnn import BidirectionalGruRnn
+from concat_with_softmax import ConcatWithSoftmax
+from fused_gru_rnn import FusedGruRnn
+from gru_rnn import GruRnn
+import numpy as np
+import theano
+import theano.tensor as T
+
+NUM_LABELS = 3
+
+# the nn_seq2seq_attention graph; bidirectional grus over s1 (the premise) & s2 (the
+# hypothesis). each state over s2 attends over all the states over s1 (see Attention)
+# and a gru decoder runs over the s2 states concatenated with what they attended to.
+# the decoder's final state is fed to an MLP & softmax. used for training by
+# nn_seq2seq_attention.py and for inference (without updates) by predict_attention.py.
+#
+# everything over s1 (its states and their attention keys) is independent of s2 so, at
+# inference, a premise can be encoded once (see premise_fns) and then scored against
+# any number of hypotheses without rerunning the s1 rnns.
+class AttentionModel(object):
+    def __init__(self, opts, vocab_size, update_fn=None):
+        # input vars. sequences are batched; time major (time, batch) padded idxs with a
+        # mask (1.0 => token, 0.0 => padding) see util.pad_batch
+        self.s1_idxs = T.imatrix('s1')  # sequences for sentence one
+        self.s1_mask = T.fmatrix('s1_mask')
+        self.s2_idxs = T.imatrix('s2')  # sequences for sentence two
+        self.s2_mask = T.fmatrix('s2_mask')
+
+        # keep track of different "layers" that handle their own gradients.
+        self.layers = []
+
+        gru_cls = FusedGruRnn if opts.fused_gru else GruRnn
+        self.h0 = theano.shared(np.zeros(opts.hidden_dim, dtype='float32'), name='h0',
+                                borrow=True)
+
+        # bidirectional rnns over s1 & s2; all states of both are used
+        self.s1_bidir = BidirectionalGruRnn('s1_bidir', vocab_size, opts.embedding_dim,
+                                            opts.hidden_dim, opts, update_fn, self.h0,
+                                            self.s1_idxs, mask=self.s1_mask,
+                                            gru_cls=gru_cls)
+        self.layers.append(self.s1_bidir)
+        self.s2_bidir = BidirectionalGruRnn('s2_bidir', vocab_size, opts.embedding_dim,
+                                            opts.hidden_dim, opts, update_fn, self.h0,
+                                            self.s2_idxs, mask=self.s2_mask,
+                                            gru_cls=gru_cls)
+        self.layers.append(self.s2_bidir)
+
+        # each s2 state attends over all s1 states
+        self.attention = Attention('s2_attention', 2*opts.hidden_dim, 2*opts.hidden_dim,
+                                   update_fn)
+        self.layers.append(self.attention)
+        self.s1_states = self.s1_bidir.all_states()
+        self.s1_keys = self.attention.keys(self.s1_states)
+        s2_states = self.s2_bidir.all_states()
+        attended = self.attention.attended(s2_states, self.s1_states, self.s1_keys,
+                                           self.s1_mask)
+
+        # unidirectional gru over s2 states along with their attended s1 states
+        self.s2_decoder = gru_cls(name='s2_decoder',
+                                  input_dim=4*opts.hidden_dim, hidden_dim=opts.hidden_dim,
+                                  opts=opts, update_fn=update_fn, h0=self.h0,
+                                  inputs=T.concatenate([s2_states, attended], axis=2),
+                                  mask=self.s2_mask)
+        self.layers.append(self.s2_decoder)
+
+        # final state of the decoder into the final MLP
+        self.concat_with_softmax = ConcatWithSoftmax(self.s2_decoder.final_state(),
+                                                     NUM_LABELS, opts.hidden_dim,
+                                                     update_fn)
+        self.layers.append(self.concat_with_softmax)
+        self.prob_y, self.pred_y = self.concat_with_softmax.prob_pred()
+
+    def inputs(self):
+        return [self.s1_idxs, self.s1_mask, self.s2_idxs, self.s2_mask]
+
+    # (uncompiled) inputs & outputs for scoring a single encoded premise against a batch
+    # of hypotheses. returns (encode_inputs, encode_outputs, score_inputs, score_outputs)
+    # where encoding a premise, s1 (time, 1) & s1_mask, gives its states & keys and
+    # scoring takes these (for one premise, so (time, dim)) along with the premise mask
+    # (time,) and a batch of hypotheses. the premise is broadcast across the batch, by
+    # replacing the s1 subgraph in prob_y, so the s1 rnns aren't part of scoring.
+    def premise_fns(self):
+        states = T.fmatrix('s1_states')
+        keys = T.fmatrix('s1_keys')
+        mask = T.fvector('s1_mask_single')
+        batch_size = self.s2_idxs.shape[1]
+        def across_batch(x):
+            return T.repeat(x.dimshuffle(0, 'x', *range(1, x.ndim)), batch_size, axis=1)
+        prob_y = theano.clone(self.prob_y,
+                              replace={self.s1_states: across_batch(states),
+                                       self.s1_keys: across_batch(keys),
+                                       self.s1_mask: across_batch(mask)})
+        return ([self.s1_idxs, self.s1_mask], [self.s1_states[:, 0], self.s1_keys[:, 0]],
+                [states, keys, mask, self.s2_idxs, self.s2_mask], [prob_y])
@@ -0,0 +1,162 @@
+from concat_with_softmax import ConcatWithSoftmax
+from embeddings import Embeddings, TiedEmbeddings
+from fused_gru_rnn import FusedGruRnn
+from fused_simple_rnn import FusedSimpleRnn
+from gru_rnn import GruRnn
+import numpy as np
+from simple_rnn import SimpleRnn
+from stacked_rnns import StackedRnns
+import theano
+import theano.tensor as T
+import updates
+
+NUM_LABELS = 3
+
+# the nn_baseline graph; (uni or bidirectional) rnns over s1 & s2 with their final states
+# concatenated and fed to an MLP & softmax. used for training by nn_baseline.py and for
+# inference (without dropout or updates) by predict.py.
+class BaselineModel(object):
+    def __init__(self, opts, vocab_size, update_fn=None, apply_dropout=None,
+                 keep_prob=None, initial_embeddings_file=None):
+        # input vars. sequences are batched; time major (time, batch) padded idxs with a
+        # mask (1.0 => token, 0.0 => padding) see util.pad_batch
+        self.s1_idxs = T.imatrix('s1')  # sequences for sentence one
+        self.s1_mask = T.fmatrix('s1_mask')
+        self.s2_idxs = T.imatrix('s2')  # sequences for sentence two
+        self.s2_mask = T.fmatrix('s2_mask')
+
+        # keep track of different "layers" that handle their own gradients.
+        # includes rnns, final concat & softmax and, potentially, special handling for
+        # tied embeddings
+        self.layers = []
+
+        # decide set of sequence idxs we'll be processing. there will always the two
+        # for the forward passes over s1 and s2 and, optionally, two more for the
+        # reverse pass over s1 & s2 in the bidirectional case.
+        idxs = [self.s1_idxs, self.s2_idxs]
+        masks = [self.s1_mask, self.s2_mask]
+        if opts.bidirectional:
+            idxs.extend([self.s1_idxs[::-1], self.s2_idxs[::-1]])
+            masks.extend([self.s1_mask[::-1], self.s2_mask[::-1]])
+
+        # build embedding layers. we know we will build an rnn for each sequence idx but
+        # depending on whether we are using tied embeddings there will be either 1 global
+        # embedding matrix (whose gradients are managed by TiedEmbeddings) or there will
+        # be 1 embeddings matrix per rnn (whose gradients are managed by the rnn itself).
+        # we build one embedding obj per element in idxs
+        # untied embeddings can optionally use a sparse (row wise) optimiser; see
+        # updates.sparse_*
+        sparse_update_fn = None
+        embedding_update_fn = getattr(opts, 'embedding_update_fn', None)
+        if embedding_update_fn is not None:
+            if opts.tied_embeddings:
+                raise Exception("--embedding-update-fn not supported with"
+                                " --tied-embeddings")
+            sparse_update_fn = getattr(updates, "sparse_%s" % embedding_update_fn, None)
+            if sparse_update_fn is None:
+                raise Exception("unknown embedding update function [%s]" %
+                                embedding_update_fn)
+        def build_embedding(idxs=None, sequence_embeddings=None, mask=None):
+            return Embeddings(vocab_size, opts.embedding_dim, idxs=idxs,
+                              sequence_embeddings=sequence_embeddings, mask=mask,
+                              sparse_update_fn=sparse_update_fn)
+        self.tied_embeddings = None
+        if opts.tied_embeddings:
+            # make shared tied embeddings helper
+            self.tied_embeddings = TiedEmbeddings(vocab_size, opts.embedding_dim,
+                                                  initial_embeddings_file)
+            self.layers.append(self.tied_embeddings)
+            # embeddings rnn per idx slices. rnn don't maintain their own embeddings in
+            # this case.
+            slices = self.tied_embeddings.slices_for_idxs(idxs, masks)
+            self.embeddings = [build_embedding(sequence_embeddings=s) for s in slices]
+        else:
+            # no tied embeddings; each rnn handles it's own weights
+            self.embeddings = [build_embedding(idxs=i, mask=m)
+                               for i, m in zip(idxs, masks)]
+        self.layers.extend(self.embeddings)
+
+        # build rnns over these embedded sequences
+        self.h0 = theano.shared(np.zeros(opts.hidden_dim, dtype='float32'), name='h0',
+                                borrow=True)
+        rnn_fn = globals().get(opts.rnn_type)
+        if rnn_fn is None:
+            raise Exception("unknown rnn type [%s]" % opts.rnn_type)
+        self.rnns = [rnn_fn("", opts.embedding_dim, opts.hidden_dim, opts, update_fn,
+                            self.h0, inputs=e.embeddings(), mask=m)
+                     for e, m in zip(self.embeddings, masks)]
+
+        # final states of the rnns; either each run in its own scan or, with a shared
+        # encoder, groups of them run as one scan (see StackedRnns). 'directions' runs
+        # the forward & backward rnns over each of s1 & s2 together, 'all' runs every
+        # rnn together.
+        shared_encoder = getattr(opts, 'shared_encoder', 'none')
+        if shared_encoder == 'none':
+            groups = [[i] for i in xrange(len(self.rnns))]
+        elif shared_encoder == 'directions':
+            if not opts.bidirectional:
+                raise Exception("--shared-encoder=directions requires --bidirectional")
+            groups = [[0, 2], [1, 3]]
+        elif shared_encoder == 'all':
+            groups = [range(len(self.rnns))]
+        else:
+            raise Exception("unknown shared encoder [%s]" % shared_encoder)
+        final_rnn_states = [None] * len(self.rnns)
+        for group in groups:
+            if len(group) == 1:
+                states = [self.rnns[group[0]].final_state()]
+            else:
+                states = StackedRnns([self.rnns[i] for i in group]).final_states()
+            for i, state in zip(group, states):
+                final_rnn_states[i] = state
+
+        self.final_rnn_states = final_rnn_states
+
+        # concat final states of rnns, do a final linear combo and apply softmax for
+        # prediction.
+        self.concat_with_softmax = ConcatWithSoftmax(final_rnn_states, NUM_LABELS,
+                                                     opts.hidden_dim, update_fn,
+                                                     apply_dropout, keep_prob)
+        self.layers.append(self.concat_with_softmax)
+        self.prob_y, self.pred_y = self.concat_with_softmax.prob_pred()
+
+    def inputs(self):
+        return [self.s1_idxs, self.s1_mask, self.s2_idxs, self.s2_mask]
+
+    # (uncompiled) inputs & outputs for scoring every s1 against every s2 given their
+    # encodings; a sentence's encoding is the concatenated final states of the rnns over
+    # it, which depend only on that sentence. returns ([s1 encoding inputs, outputs], [s2
+    # encoding inputs, outputs], [product inputs, outputs]) where the product takes
+    # (n_s1, _) & (n_s2, _) encodings and gives prob_y as (n_s1, n_s2, NUM_LABELS).
+    def product_fns(self):
+        hidden_dim = self.h0.get_value().shape[0]
+        encoding_fns, encodings, encoding_rows = [], [], []
+        for sentence, (idxs, mask) in enumerate([(self.s1_idxs, self.s1_mask),
+                                                 (self.s2_idxs, self.s2_mask)]):
+            # rnns are over s1, s2 (then reversed s1, s2 if bidirectional)
+            rnn_idxs = range(sentence, len(self.rnns), 2)
+            states = [self.final_rnn_states[i] for i in rnn_idxs]
+            encoding_fns.append([[idxs, mask], [T.concatenate(states, axis=1)]])
+            encodings.append(T.fmatrix('s%d_encodings' % (sentence + 1)))
+            encoding_rows.append(np.concatenate([np.arange(i * hidden_dim,
+                                                           (i + 1) * hidden_dim)
+                                                 for i in rnn_idxs]))
+        prob_y = self.concat_with_softmax.product_prob(encodings[0], encoding_rows[0],
+                                                       encodings[1], encoding_rows[1])
+        return encoding_fns + [[encodings, [prob_y]]]
+
+    # current param values by name, for the numpy inference engine; see numpy_model.py
+    def weights(self):
+        weights = {"h0": self.h0.get_value()}
+        if self.tied_embeddings is not None:
+            weights["tied_embeddings"] = \
+                self.tied_embeddings.shared_embeddings.get_value()
+        else:
+            for i, e in enumerate(self.embeddings):
+                weights["embeddings_%d" % i] = e.Wx.get_value()
+        for i, rnn in enumerate(self.rnns):
+            for p in rnn.dense_params():
+                weights["rnn_%d.%s" % (i, p.name)] = p.get_value()
+        for p in self.concat_with_softmax.dense_params():
+            weights["mlp.%s" % p.name] = p.get_value()
+        return weights
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+# benchmarks for data loading, rnn cells, embedding updates and end to end training, all
+# run on synthetic SNLI shaped data (see write_synthetic_dataset) so nothing needs to be
+# downloaded. results, along with the git commit and library versions, are written as
+# json to --output so runs can be compared across commits. suites are
+#  loaders    : util.load_data egs/sec (and tokens/sec) per parse mode
+#  rnns       : forward and forward+backward time of a batch per rnn cell type, hidden
+#               dim and sequence length
+#  embeddings : cost of a step of embedding updates for tied vs untied embeddings (and
+#               untied with each of --embedding-update-fns), for 2 (unidirectional) and
+#               4 (bidirectional) sequences per eg
+#  end_to_end : egs/sec of training runs of nn_baseline.py & nn_seq2seq.py (see E2E_RUNS)
+#               as reported in their STATS
+# timings are the min (and median) over --repeats calls, after one warm up call.
+import argparse
+from bidirectional_gru_rnn import BidirectionalGruRnn
+from embeddings import Embeddings, TiedEmbeddings
+from fused_gru_rnn import FusedGruRnn
+from fused_simple_rnn import FusedSimpleRnn
+from gru_rnn import GruRnn
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import random
+import shutil
+from simple_rnn import SimpleRnn
+import subprocess
+import sys
+import tempfile
+import time
+import theano
+import theano.tensor as T
+import updates
+import util
+from vocab import Vocab
+
+SUITES = ["loaders", "rnns", "embeddings", "end_to_end"]
+PARSE_MODES = ["BINARY_WITHOUT_PARENTHESIS", "BINARY_WITH_PARENTHESIS",
+               "PARSE_WITH_OPEN_CLOSE_TAGS", "JUST_OPEN_CLOSE_TAGS"]
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (name, script, flags) for each end to end run. flags common to all runs (data,
+# dims, a single epoch with one dev evaluation at the end) are added by run_end_to_end.
+E2E_RUNS = [
+    ("nn_baseline_simple_rnn", "nn_baseline.py", ["--rnn-type=SimpleRnn"]),
+    ("nn_baseline_gru_bidir_tied_batch_32", "nn_baseline.py",
+     ["--rnn-type=GruRnn", "--bidirectional", "--tied-embeddings", "--batch-size=32"]),
+    ("nn_seq2seq", "nn_seq2seq.py", []),
+]
+
+# STATS fields kept per end to end run
+E2E_STATS = ["n_egs_trained", "egs_per_sec", "train_egs_per_sec", "train_tokens_per_sec",
+             "compile_time_sec", "time_sec", "peak_rss_mb"]
+
+def log(s):
+    print >>sys.stderr, util.dts(), s
+
+# synthetic data
+
+# samples token ids in [1, vocab_size) with a zipfian distribution (as for real text),
+# and sentence lengths around those of SNLI (premises ~14 tokens, hypotheses ~8)
+class SyntheticText(object):
+    def __init__(self, vocab_size, seed):
+        self.rnd = np.random.RandomState(seed)
+        p = 1. / np.arange(1, vocab_size)
+        self.token_cdf = np.cumsum(p / p.sum())
+
+    def ids(self, shape):
+        ids = np.searchsorted(self.token_cdf, self.rnd.random_sample(shape)) + 1
+        return np.minimum(ids, len(self.token_cdf)).astype('int32')
+
+    def sentence_len(self, sentence_idx):
+        mean_len = 13 if sentence_idx == 1 else 7
+        return self.rnd.poisson(mean_len) + 1
+
+# random binary tree over tokens; nested 2-tuples with tokens at the leaves
+def random_tree(tokens, rnd):
+    if len(tokens) == 1:
+        return tokens[0]
+    split = rnd.randint(1, len(tokens) - 1)
+    return (random_tree(tokens[:split], rnd), random_tree(tokens[split:], rnd))
+
+# eg "( ( a person ) ( by ( a car ) ) )"
+def binary_parse(tree):
+    if isinstance(tree, tuple):
+        return "( %s %s )" % (binary_parse(tree[0]), binary_parse(tree[1]))
+    return tree
+
+# eg "(ROOT (NP (NP (DT a) (NN person)) (PP (IN by) (NP (DT a) (NN car)))))"
+def parse(tree, rnd):
+    def subtree(tree):
+        if isinstance(tree, tuple):
+            return "(%s %s %s)" % (rnd.choice(["NP", "VP", "PP", "S"]),
+                                   subtree(tree[0]), subtree(tree[1]))
+        return "(%s %s)" % (rnd.choice(["NN", "DT", "JJ", "IN", "VBZ"]), tree)
+    return "(ROOT %s)" % subtree(tree)
+
+# writes n_egs synthetic egs, in the SNLI jsonl format, to path. tokens are "wN" for
+# token id N. about 1% of egs have no gold label (as in SNLI).
+def write_synthetic_dataset(path, n_egs, vocab_size, seed):
+    text = SyntheticText(vocab_size, seed)
+    rnd = random.Random(seed)
+    with open(path, "w") as f:
+        for _ in xrange(n_egs):
+            eg = {"gold_label": "-" if rnd.random() < 0.01 else rnd.choice(util.LABELS)}
+            for sentence_idx in [1, 2]:
+                tokens = ["w%d" % i for i in text.ids(text.sentence_len(sentence_idx))]
+                tree = random_tree(tokens, rnd)
+                eg["sentence%d_binary_parse" % sentence_idx] = binary_parse(tree)
+                eg["sentence%d_parse" % sentence_idx] = parse(tree, rnd)
+            print >>f, json.dumps(eg)
+
+# timing
+
+def timings(fn, repeats):
+    fn()  # warm up
+    times = []
+    for _ in xrange(repeats):
+        start_time = time.time()
+        fn()
+        times.append(time.time() - start_time)
+    return times
+
+# min & median of times, and egs (and tokens) per sec at the min
+def timing_summary(times, n_egs, n_tokens=None):
+    summary = {"min_sec": min(times), "median_sec": float(np.median(times)),
+               "egs_per_sec": n_egs / max(min(times), 1e-9)}
+    if n_tokens is not None:
+        summary["tokens_per_sec"] = n_tokens / max(min(times), 1e-9)
+    return summary
+
+def compiled(inputs, outputs, updates=None):
+    start_time = time.time()
+    fn = theano.function(inputs=inputs, outputs=outputs, updates=updates)
+    return fn, time.time() - start_time
+
+# suites
+
+def bench_loaders(opts, dataset):
+    results = []
+    for parse_mode in PARSE_MODES:
+        loaded = []
+        def load():
+            x, _y, _stats = util.load_data(dataset, Vocab(), parse_mode=parse_mode)
+            loaded[:] = [len(x), sum(len(s1) + len(s2) for s1, s2 in x)]
+        times = timings(load, opts.repeats)
+        n_egs, n_tokens = loaded
+        result = {"parse_mode": parse_mode, "n_egs": n_egs}
+        result.update(timing_summary(times, n_egs, n_tokens))
+        log("loaders %s" % result)
+        results.append(result)
+    return results
+
+# final state(s) and dense params of an rnn of type rnn_type over (time, batch) idxs
+def build_rnn(rnn_type, hidden_dim, opts, idxs, mask):
+    h0 = theano.shared(np.zeros(hidden_dim, dtype='float32'), name='h0', borrow=True)
+    if rnn_type == "BidirectionalGruRnn":
+        rnn = BidirectionalGruRnn("bench", opts.vocab_size, opts.embedding_dim,
+                                  hidden_dim, opts, None, h0, idxs, mask=mask)
+        return (rnn.final_states(),
+                rnn.forward_gru.dense_params() + rnn.backwards_gru.dense_params())
+    rnn_fn = globals().get(rnn_type)
+    if rnn_fn is None:
+        raise Exception("unknown rnn type [%s]" % rnn_type)
+    embeddings = Embeddings(opts.vocab_size, opts.embedding_dim, idxs=idxs, mask=mask)
+    rnn = rnn_fn("bench", opts.embedding_dim, hidden_dim, opts, None, h0,
+                 inputs=embeddings.embeddings(), mask=mask)
+    return rnn.final_state(), rnn.dense_params()
+
+def bench_rnns(opts, text):
+    results = []
+    idxs, mask = T.imatrix('idxs'), T.fmatrix('mask')
+    for rnn_type in opts.rnn_types.split(","):
+        for hidden_dim in map(int, opts.hidden_dims.split(",")):
+            for seq_len in map(int, opts.seq_lens.split(",")):
+                final_states, params = build_rnn(rnn_type, hidden_dim, opts, idxs, mask)
+                cost = T.mean(final_states)
+                forward_fn, forward_compile_sec = compiled([idxs, mask], cost)
+                backward_fn, backward_compile_sec = compiled(
+                    [idxs, mask], [cost] + T.grad(cost=cost, wrt=params))
+                args = [text.ids((seq_len, opts.batch_size)),
+                        np.ones((seq_len, opts.batch_size), dtype='float32')]
+                n_tokens = seq_len * opts.batch_size
+                result = {"rnn_type": rnn_type, "hidden_dim": hidden_dim,
+                          "seq_len": seq_len, "batch_size": opts.batch_size,
+                          "compile_sec": {"forward": forward_compile_sec,
+                                          "forward_backward": backward_compile_sec},
+                          "forward": timing_summary(
+                              timings(lambda: forward_fn(*args), opts.repeats),
+                              opts.batch_size, n_tokens),
+                          "forward_backward": timing_summary(
+                              timings(lambda: backward_fn(*args), opts.repeats),
+                              opts.batch_size, n_tokens)}
+                log("rnns %s" % result)
+                results.append(result)
+    return results
+
+# a cheap cost over (time, batch, dim) embedded sequences, so a step is dominated by the
+# embedding lookups & updates
+def masked_cost(sequence_embeddings, masks):
+    return sum(T.sum(T.tanh(e) * m.dimshuffle(0, 1, 'x'))
+               for e, m in zip(sequence_embeddings, masks))
+
+# embedding updates (and the updated embedding matrices) for variant over idxs
+def build_embeddings_step(variant, opts, idxs, masks):
+    learning_opts = argparse.Namespace(learning_rate=0.01, momentum=0.9,
+                                       l2_penalty=0.0001)
+    if variant == "tied":
+        tied = TiedEmbeddings(opts.vocab_size, opts.embedding_dim)
+        sequence_embeddings = tied.slices_for_idxs(idxs, masks)
+        cost = masked_cost(sequence_embeddings, masks)
+        return tied.updates_wrt_cost(cost, learning_opts), [tied.shared_embeddings]
+    sparse_update_fn = None
+    if variant != "untied":
+        sparse_update_fn = getattr(updates, variant[len("untied_"):], None)
+        if sparse_update_fn is None:
+            raise Exception("unknown embedding update function [%s]" % variant)
+    embeddings = [Embeddings(opts.vocab_size, opts.embedding_dim, idxs=i, mask=m,
+                             sparse_update_fn=sparse_update_fn)
+                  for i, m in zip(idxs, masks)]
+    cost = masked_cost([e.embeddings() for e in embeddings], masks)
+    step_updates = []
+    for e in embeddings:
+        step_updates.extend(e.updates_wrt_cost(cost, learning_opts))
+    return step_updates, [e.Wx for e in embeddings]
+
+def bench_embeddings(opts, text):
+    variants = ["tied", "untied"] + ["untied_sparse_%s" % fn for fn in
+                                     opts.embedding_update_fns.split(",") if fn]
+    results = []
+    s1, s1_mask = T.imatrix('s1'), T.fmatrix('s1_mask')
+    s2, s2_mask = T.imatrix('s2'), T.fmatrix('s2_mask')
+    for n_sequences in [2, 4]:
+        idxs, masks = [s1, s2], [s1_mask, s2_mask]
+        if n_sequences == 4:
+            idxs.extend([s1[::-1], s2[::-1]])
+            masks.extend([s1_mask[::-1], s2_mask[::-1]])
+        for variant in variants:
+            step_updates, matrices = build_embeddings_step(variant, opts, idxs, masks)
+            step_fn, compile_sec = compiled([s1, s1_mask, s2, s2_mask], [],
+                                            updates=step_updates)
+            s1s = [text.ids(text.sentence_len(1)) for _ in xrange(opts.batch_size)]
+            s2s = [text.ids(text.sentence_len(2)) for _ in xrange(opts.batch_size)]
+            args = list(util.pad_batch(s1s)) + list(util.pad_batch(s2s))
+            n_tokens = sum(len(s) for s in s1s + s2s)
+            result = {"variant": variant, "n_sequences": n_sequences,
+                      "vocab_size": opts.vocab_size, "embedding_dim": opts.embedding_dim,
+                      "batch_size": opts.batch_size, "compile_sec": compile_sec,
+                      "embedding_mb": sum(m.get_value(borrow=True).nbytes
+                                          for m in matrices) / 1024. / 1024}
+            result.update(timing_summary(timings(lambda: step_fn(*args), opts.repeats),
+                                         opts.batch_size, n_tokens))
+            log("embeddings %s" % result)
+            results.append(result)
+    return results
+
+def run_end_to_end(opts, train_set, dev_set, work_dir):
+    results = []
+    for name, script, flags in E2E_RUNS:
+        cmd = [sys.executable, os.path.join(SCRIPT_DIR, script),
+               "--train-set=%s" % train_set, "--num-from-train=%d" % opts.e2e_train_egs,
+               "--dev-set=%s" % dev_set, "--num-from-dev=%d" % opts.e2e_dev_egs,
+               "--dev-run-freq=%d" % opts.e2e_train_egs, "--num-epochs=1",
+               "--embedding-dim=%d" % opts.embedding_dim,
+               "--hidden-dim=%d" % opts.e2e_hidden_dim] + flags
+        log("end_to_end %s: %s" % (name, " ".join(cmd)))
+        err_file = os.path.join(work_dir, "%s.err" % name)
+        start_time = time.time()
+        with open(err_file, "w") as err:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+            out, _ = proc.communicate()
+        result = {"name": name, "script": script, "flags": flags,
+                  "wall_sec": time.time() - start_time,
+                  "status": "done" if proc.returncode == 0 else
+                            "failed(%s)" % proc.returncode}
+        stats_lines = [l for l in out.splitlines() if l.startswith("STATS")]
+        if stats_lines:
+            stats = json.loads(stats_lines[-1].split("\t")[1])
+            for field in E2E_STATS:
+                if field in stats:
+                    result[field] = stats[field]
+        if proc.returncode != 0:
+            print >>sys.stderr, open(err_file).read()[-2000:]
+        log("end_to_end %s" % result)
+        results.append(result)
+    return results
+
+# where & what the benchmarks were run on
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.check_output(["git"] + list(args), cwd=SCRIPT_DIR).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"),
+            "dirty": None if status is None else status != ""}
+
+def environment():
+    return {"host": platform.node(), "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "theano": theano.__version__, "floatX": theano.config.floatX,
+            "device": theano.config.device, "blas_ldflags": theano.config.blas.ldflags,
+            "blas_thread_env": dict((var, os.environ.get(var)) for var in
+                                    ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                                     "MKL_NUM_THREADS"])}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', required=True, help='json file to write results to')
+    parser.add_argument('--suites', default=",".join(SUITES),
+                        help='comma separated suites to run {%s}' % ",".join(SUITES))
+    parser.add_argument('--work-dir',
+                        help='where synthetic data (and end to end run logs) are'
+                             ' written. default => a temp dir, removed when done')
+    parser.add_argument('--seed', default=1234, type=int, help='seed for synthetic data')
+    parser.add_argument('--repeats', default=5, type=int,
+                        help='number of timed calls per benchmark')
+    parser.add_argument('--n-egs', default=20000, type=int,
+                        help='number of synthetic egs for loader benchmarks')
+    parser.add_argument('--vocab-size', default=20000, type=int,
+                        help='synthetic vocab size')
+    parser.add_argument('--embedding-dim', default=100, type=int,
+                        help='embedding dimensionality')
+    parser.add_argument('--batch-size', default=32, type=int,
+                        help='egs per batch for rnn & embedding benchmarks')
+    parser.add_argument('--rnn-types', default="SimpleRnn,GruRnn,BidirectionalGruRnn",
+                        help='rnn cells to benchmark; any of SimpleRnn, GruRnn,'
+                             ' FusedSimpleRnn, FusedGruRnn, BidirectionalGruRnn')
+    parser.add_argument('--hidden-dims', default="50,100,200",
+                        help='comma separated hidden dims for rnn benchmarks')
+    parser.add_argument('--seq-lens', default="10,25,50",
+                        help='comma separated sequence lengths for rnn benchmarks')
+    parser.add_argument('--gru-initial-bias', default=2, type=int,
+                        help='initial gru bias for r & z')
+    parser.add_argument('--embedding-update-fns', default="vanilla,adagrad",
+                        help='sparse embedding update fns to benchmark for untied'
+                             ' embeddings (see --embedding-update-fn)')
+    parser.add_argument('--e2e-train-egs', default=2000, type=int,
+                        help='number of egs trained per end to end run')
+    parser.add_argument('--e2e-dev-egs', default=500, type=int,
+                        help='number of dev egs per end to end run')
+    parser.add_argument('--e2e-hidden-dim', default=50, type=int,
+                        help='hidden dim for end to end runs')
+    opts = parser.parse_args()
+    print >>sys.stderr, opts
+
+    suites = opts.suites.split(",")
+    for suite in suites:
+        if suite not in SUITES:
+            raise Exception("unknown suite [%s]" % suite)
+    np.random.seed(opts.seed)  # param init
+    work_dir = opts.work_dir or tempfile.mkdtemp(prefix="snli_benchmark_")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    train_set = os.path.join(work_dir, "synthetic_train.jsonl")
+    dev_set = os.path.join(work_dir, "synthetic_dev.jsonl")
+    log("writing synthetic data to %s" % work_dir)
+    write_synthetic_dataset(train_set, max(opts.n_egs, opts.e2e_train_egs),
+                            opts.vocab_size, opts.seed)
+    write_synthetic_dataset(dev_set, opts.e2e_dev_egs, opts.vocab_size, opts.seed + 1)
+    text = SyntheticText(opts.vocab_size, opts.seed)
+
+    results = {"git": git_info(), "environment": environment(), "opts": vars(opts),
+               "start_time": int(time.time())}
+    try:
+        if "loaders" in suites:
+            results["loaders"] = bench_loaders(opts, train_set)
+        if "rnns" in suites:
+            results["rnns"] = bench_rnns(opts, text)
+        if "embeddings" in suites:
+            results["embeddings"] = bench_embeddings(opts, text)
+        if "end_to_end" in suites:
+            results["end_to_end"] = run_end_to_end(opts, train_set, dev_set, work_dir)
+    finally:
+        if opts.work_dir is None:
+            shutil.rmtree(work_dir)
+    results["elapsed_time"] = int(time.time()) - results["start_time"]
+
+    with open(opts.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        print >>f
+    log("results written to %s" % opts.output)
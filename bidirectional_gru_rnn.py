@@ -7,18 +7,25 @@ import theano.tensor as T
 from updates import vanilla, rmsprop
 
 class BidirectionalGruRnn(object):
+    # idxs is either a single sequence (vector) or a time major padded batch with mask.
+    # the backwards gru runs over the reversed (padded) batch; for a batch the (now
+    # leading) padding is masked so just carries h0 until each sequence's last token.
+    # gru_cls is GruRnn or FusedGruRnn.
     def __init__(self, name, vocab_size, embedding_dim, hidden_dim, opts, update_fn, h0,
-                 idxs):
+                 idxs, mask=None, gru_cls=GruRnn):
         self.name_ = name
 
-        def build_gru(name, idxs):
-            embeddings = Embeddings(vocab_size, embedding_dim, idxs=idxs)
-            return GruRnn(name, embedding_dim, hidden_dim, opts, update_fn, h0,
-                          embeddings.embeddings())
+        def build_gru(name, idxs, mask):
+            embeddings = Embeddings(vocab_size, embedding_dim, idxs=idxs, mask=mask)
+            return embeddings, gru_cls(name, embedding_dim, hidden_dim, opts, update_fn,
+                                       h0, embeddings.embeddings(), mask=mask)
 
         # TODO: support tied embeddings again
-        self.forward_gru = build_gru(name=("f_%s" % name), idxs=idxs)
-        self.backwards_gru = build_gru(name=("b_%s" % name), idxs=idxs[::-1])
+        self.forward_embeddings, self.forward_gru = \
+            build_gru(name=("f_%s" % name), idxs=idxs, mask=mask)
+        self.backwards_embeddings, self.backwards_gru = \
+            build_gru(name=("b_%s" % name), idxs=idxs[::-1],
+                      mask=None if mask is None else mask[::-1])
     
     def name(self):
         return self.name_
@@ -36,18 +43,30 @@ class BidirectionalGruRnn(object):
         return self.forward_gru.updates_wrt_cost(cost, learning_opts) + \
             self.backwards_gru.updates_wrt_cost(cost, learning_opts)
 
-    # return hidden activations for recurrent step (as a 2-tuple)
-    # [f_s1 ++ b_sn, f_s2 ++ b_sn-1, ...]
+    # hidden activations per timestep; [f_1 ++ b_1, f_2 ++ b_2, ...] where f_t has read
+    # s_1 .. s_t and b_t has read s_n .. s_t. the backwards states are in reversed time
+    # order so are flipped back; for a batch this lines each sequence's states up with
+    # its tokens, as the leading padding of the reversed batch becomes trailing padding
+    # (where b_t is just h0, and masked). (time, 2*hidden) or (time, batch, 2*hidden)
     def all_states(self):
         forwards_ht = self.forward_gru.all_states()
-        backwards_ht = self.backwards_gru.all_states()
-        all_states, _ = theano.scan(fn=lambda f, b: T.concatenate([f, b]),
-                                    sequences=[forwards_ht, backwards_ht],
-                                    outputs_info=[None])
-        return all_states
+        backwards_ht = self.backwards_gru.all_states()[::-1]
+        return T.concatenate([forwards_ht, backwards_ht], axis=forwards_ht.ndim-1)
+
+    # current param values by name, for the numpy inference engine; the embeddings (Wx)
+    # and gru params of each direction prefixed with the gru's name, eg f_s1_bidir.Uh
+    def weights(self):
+        weights = {}
+        for embeddings, gru in [(self.forward_embeddings, self.forward_gru),
+                                (self.backwards_embeddings, self.backwards_gru)]:
+            weights["%s.Wx" % gru.name()] = embeddings.Wx.get_value()
+            for p in gru.dense_params():
+                weights["%s.%s" % (gru.name(), p.name)] = p.get_value()
+        return weights
 
     # [final forward state, final backwards state]
     def final_states(self):
-        return T.concatenate([self.forward_gru.final_state(),
-                              self.backwards_gru.final_state()])
+        forward_final_state = self.forward_gru.final_state()
+        return T.concatenate([forward_final_state, self.backwards_gru.final_state()],
+                             axis=forward_final_state.ndim-1)
 
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+# build a vocab (with token counts) from a dataset, optionally pruned to the tokens seen
+# at least --min-count times and / or the --max-size most frequent. written as binary
+# (--output ending in .npz) or tsv; either works as nn_baseline.py --vocab-file or
+# precompute_embeddings.py --vocab. a pruned vocab is closed; tokens not in it are UNK.
+import argparse
+import sys
+import util
+from vocab import Vocab
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", default="data/snli_1.0_train.jsonl")
+parser.add_argument("--num-from-dataset", default=-1, type=int,
+                    help='number of egs to read from dataset. -1 => all')
+parser.add_argument('--parse-mode', default='BINARY_WITHOUT_PARENTHESIS',
+                    help='which parse mode to tokenise with; see tokenise_parse.py')
+parser.add_argument('--min-count', default=1, type=int,
+                    help='drop tokens seen fewer than this many times')
+parser.add_argument('--max-size', default=None, type=int,
+                    help='keep at most this many (most frequent) tokens, plus UNK')
+parser.add_argument('--output', required=True, help='vocab file to write; .npz or tsv')
+opts = parser.parse_args()
+print >>sys.stderr, opts
+
+vocab = Vocab()
+stats = util.build_vocab(opts.dataset, vocab, max_egs=opts.num_from_dataset,
+                         parse_mode=opts.parse_mode)
+print >>sys.stderr, "stats", stats, "vocab size", vocab.size()
+if opts.min_count > 1 or opts.max_size is not None:
+    vocab = vocab.pruned(opts.min_count, opts.max_size)
+    counts = vocab.counts()
+    print >>sys.stderr, "pruned vocab size", vocab.size(), \
+        "UNK rate %.4f" % (float(counts[0]) / counts.sum())
+vocab.save(opts.output)
@@ -0,0 +1,101 @@
+import argparse
+import dropout
+import json
+import numpy as np
+import os
+import random
+import util
+
+# a checkpoint is a single npz with one array per shared variable (in order of creation,
+# see util.SHARED_VARIABLES, which includes optimiser state such as momentum velocities)
+# along with the vocab, training progress and the state of all rngs (python, numpy and
+# the theano streams used for dropout). a model built with the same opts creates its
+# shared variables in the same order so they can be restored positionally.
+
+def _numpy_rng_state(rnd):
+    name, keys, pos, has_gauss, cached_gaussian = rnd.get_state()
+    return keys, [name, int(pos), int(has_gauss), float(cached_gaussian)]
+
+def _set_numpy_rng_state(rnd, keys, state):
+    name, pos, has_gauss, cached_gaussian = state
+    rnd.set_state((name, keys, pos, has_gauss, cached_gaussian))
+
+# progress is a json'able dict (eg epoch, n_egs_trained). epoch_batches, if set, is the
+# list of idx batches for the current epoch so it can be resumed mid way. opts are
+# recorded so the model can be rebuilt for inference (see predict.py)
+def save(path, vocab, opts, progress, epoch_batches=None):
+    arrays = {}
+    for i, p in enumerate(util.SHARED_VARIABLES):
+        arrays["shared_%d" % i] = p.get_value()
+    dropout_rng_states = []
+    for i, (rng, _update) in enumerate(dropout.RND_STREAM.state_updates):
+        keys, state = _numpy_rng_state(rng.get_value())
+        arrays["dropout_rng_keys_%d" % i] = keys
+        dropout_rng_states.append(state)
+    arrays["numpy_rng_keys"], numpy_rng_state = _numpy_rng_state(np.random)
+    if epoch_batches is not None:
+        arrays["epoch_order"] = np.concatenate(epoch_batches).astype('int32')
+        arrays["epoch_batch_sizes"] = np.asarray(map(len, epoch_batches), dtype='int32')
+    meta = {"opts": vars(opts),
+            "progress": progress,
+            "n_shared": len(util.SHARED_VARIABLES),
+            "vocab": vocab.items(),
+            "python_rng_state": random.getstate(),
+            "numpy_rng_state": numpy_rng_state,
+            "dropout_rng_states": dropout_rng_states}
+    arrays["meta"] = np.array(json.dumps(meta))
+    # write to tmp and rename so a preempted save never leaves a partial checkpoint
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.rename(tmp_path, path)
+
+class Checkpoint(object):
+    def __init__(self, path):
+        self.arrays = np.load(path)
+        self.meta = json.loads(self.arrays["meta"][()])
+        self.progress = self.meta["progress"]
+        self.opts = argparse.Namespace(**self.meta["opts"])
+
+    # populate vocab (before any data is loaded) so ids match those of the checkpoint
+    def restore_vocab(self, vocab):
+        for idx, token in self.meta["vocab"]:
+            assert vocab.id_for_token(token) == idx, \
+                "vocab mismatch for [%s]; expected id %s" % (token, idx)
+
+    # idx batches for the epoch that was in progress (or None if not saved)
+    def epoch_batches(self):
+        if "epoch_order" not in self.arrays.files:
+            return None
+        boundaries = np.cumsum(self.arrays["epoch_batch_sizes"])[:-1]
+        return np.split(self.arrays["epoch_order"], boundaries)
+
+    # restore shared variables (by default util.SHARED_VARIABLES) & rng states. must be
+    # called after the model (and so all shared variables) has been built. an inference
+    # only model (ie no updates) has no optimiser state, which is always created after
+    # the params, so restores just the prefix of the checkpoint's shared variables.
+    def restore_model(self, shared_variables=None, inference_only=False):
+        if shared_variables is None:
+            shared_variables = util.SHARED_VARIABLES
+        if inference_only:
+            assert len(shared_variables) <= self.meta["n_shared"]
+        else:
+            assert self.meta["n_shared"] == len(shared_variables), \
+                "checkpoint has %s shared variables but model has %s" % \
+                (self.meta["n_shared"], len(shared_variables))
+        for i, p in enumerate(shared_variables):
+            value = self.arrays["shared_%d" % i]
+            assert value.shape == p.get_value().shape, \
+                "shape mismatch for shared variable %s (%s)" % (i, p.name)
+            p.set_value(value)
+        if inference_only:
+            return
+        for i, (rng, _update) in enumerate(dropout.RND_STREAM.state_updates):
+            rnd = rng.get_value()
+            _set_numpy_rng_state(rnd, self.arrays["dropout_rng_keys_%d" % i],
+                                 self.meta["dropout_rng_states"][i])
+            rng.set_value(rnd)
+        _set_numpy_rng_state(np.random, self.arrays["numpy_rng_keys"],
+                             self.meta["numpy_rng_state"])
+        version, internal_state, gauss_next = self.meta["python_rng_state"]
+        random.setstate((version, tuple(internal_state), gauss_next))
@@ -1,5 +1,6 @@
 from dropout import dropout
 import math
+import sys
 import theano
 import theano.tensor as T
 import util
@@ -8,7 +9,9 @@ class ConcatWithSoftmax(object):
     def __init__(self, inp, n_labels, n_hidden_previous, update_fn,
                  training=None, keep_prob=None):
         if type(inp) == list:
-            self.input = T.concatenate(inp)
+            # concat along the last axis; ie the hidden dim for both a single
+            # example (hidden,) and a batch of examples (batch, hidden)
+            self.input = T.concatenate(inp, axis=inp[0].ndim-1)
             input_size = len(inp) * n_hidden_previous
         else:
             self.input = inp
@@ -22,7 +25,9 @@ class ConcatWithSoftmax(object):
 
         # input -> hidden (sized somwhere between size of input & softmax)
         n_hidden = int(math.sqrt(input_size * n_labels))
-        print "concat sizing %s -> %s -> %s" % (input_size, n_hidden, n_labels)
+        # stderr; stdout is the output of predict.py etc
+        print >>sys.stderr, "concat sizing %s -> %s -> %s" % (input_size, n_hidden,
+                                                              n_labels)
         self.Wih = util.sharedMatrix(input_size, n_hidden, 'Wih')
         self.bh = util.shared(util.zeros((1, n_hidden)), 'bh')
         # hidden -> softmax
@@ -44,8 +49,26 @@ class ConcatWithSoftmax(object):
         return self.update_fn(self.dense_params(), gradients, learning_opts)
 
     def prob_pred(self):
-        hidden = T.nnet.sigmoid(T.dot(self.input, self.Wih) + self.bh)
-        prob_y = T.nnet.softmax(T.dot(hidden, self.Whs) + self.bs)
+        # biases are (1, n) shared so need to be explicitly broadcast for batches
+        bh = T.addbroadcast(self.bh, 0)
+        bs = T.addbroadcast(self.bs, 0)
+        hidden = T.nnet.sigmoid(T.dot(self.input, self.Wih) + bh)
+        prob_y = T.nnet.softmax(T.dot(hidden, self.Whs) + bs)
         pred_y = T.argmax(prob_y, axis=1)
         return (prob_y, pred_y)
 
+    # prob_y, (n_x, n_y, n_labels), for the input of every pairing of a row of x with a
+    # row of y, where x & y are each some of the concatenated inputs; x_rows & y_rows are
+    # their rows in Wih. the input -> hidden projection is linear so is done once per x
+    # & y row (not per pair) with only the sigmoid & hidden -> softmax per pair, as one
+    # (n_x*n_y, n_hidden) GEMM. no dropout; for inference only.
+    def product_prob(self, x, x_rows, y, y_rows):
+        bh = T.addbroadcast(self.bh, 0)
+        bs = T.addbroadcast(self.bs, 0)
+        x_hidden = T.dot(x, self.Wih[x_rows])
+        y_hidden = T.dot(y, self.Wih[y_rows])
+        hidden = T.nnet.sigmoid(x_hidden.dimshuffle(0, 'x', 1) +
+                                y_hidden.dimshuffle('x', 0, 1) + bh)
+        n_x, n_y, n_hidden = hidden.shape
+        prob_y = T.nnet.softmax(T.dot(hidden.reshape((n_x * n_y, n_hidden)), self.Whs) + bs)
+        return prob_y.reshape((n_x, n_y, prob_y.shape[1]))
@@ -0,0 +1,156 @@
+import array
+import itertools
+import numpy as np
+import os
+import random
+
+# compact representation of a set of (s1, s2) -> label examples.
+# token ids for all sentences are kept in one flat int32 array with (CSR style)
+# offsets; s1 for eg i is tokens[offsets[2i]:offsets[2i+1]] and s2 is
+# tokens[offsets[2i+1]:offsets[2i+2]]. labels are int8. on disk it's a directory of
+# .npy files so it can be opened memory mapped; all access is via numpy views.
+class Corpus(object):
+    def __init__(self, tokens, offsets, labels):
+        assert len(offsets) == 2 * len(labels) + 1
+        self.tokens = tokens
+        self.offsets = offsets
+        self.labels = labels
+
+    @staticmethod
+    def from_lists(x, y):
+        builder = CorpusBuilder()
+        for (s1, s2), label in zip(x, y):
+            builder.append(s1, s2, label)
+        return builder.build()
+
+    @staticmethod
+    def load(directory, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        def load(name):
+            return np.load(os.path.join(directory, "%s.npy" % name), mmap_mode=mmap_mode)
+        return Corpus(load("tokens"), load("offsets"), load("labels"))
+
+    def save(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        np.save(os.path.join(directory, "tokens.npy"), self.tokens)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "labels.npy"), self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    # ((s1, s2), label) for eg i; s1 & s2 are views into tokens
+    def __getitem__(self, i):
+        o = self.offsets
+        return ((self.tokens[o[2*i]:o[2*i+1]], self.tokens[o[2*i+1]:o[2*i+2]]),
+                int(self.labels[i]))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    # s1s, s2s (lists of views) and labels for egs idxs
+    def batch(self, idxs):
+        s1s, s2s = [], []
+        for i in idxs:
+            (s1, s2), _y = self[i]
+            s1s.append(s1)
+            s2s.append(s2)
+        return s1s, s2s, self.labels[idxs]
+
+    def s1_lengths(self):
+        return np.diff(self.offsets)[0::2]
+
+    def s2_lengths(self):
+        return np.diff(self.offsets)[1::2]
+
+    def max_lengths(self):
+        return np.maximum(self.s1_lengths(), self.s2_lengths())
+
+    def shuffled_idxs(self):
+        return np.random.permutation(len(self))
+
+    def to_lists(self):
+        x = [(s1.tolist(), s2.tolist()) for (s1, s2), _y in self]
+        return x, self.labels.tolist()
+
+    # split idxs (eg a shuffled permutation) into batches of examples of similar length
+    # so padding waste stays small. idxs are grouped into buckets of
+    # batch_size * bucket_factor, sorted by length within bucket and sliced into
+    # batches. the batches themselves are then shuffled so there's no ordering by length
+    # across the epoch.
+    def bucketed_batches(self, idxs, batch_size, bucket_factor=20):
+        lengths = self.max_lengths()
+        batches = []
+        bucket_size = batch_size * bucket_factor
+        for bucket_start in xrange(0, len(idxs), bucket_size):
+            bucket = idxs[bucket_start : bucket_start + bucket_size]
+            bucket = bucket[np.argsort(lengths[bucket], kind='mergesort')]
+            for batch_start in xrange(0, len(bucket), batch_size):
+                batches.append(bucket[batch_start : batch_start + batch_size])
+        random.shuffle(batches)
+        return batches
+
+    # as bucketed_batches but batches are sized by a budget of max_tokens padded tokens
+    # rather than a number of egs (see token_budget_slices) so steps are of similar cost
+    # whatever the lengths of their egs. buckets are of about max_tokens * bucket_factor
+    # (unpadded) tokens.
+    def token_budget_batches(self, idxs, max_tokens, bucket_factor=20):
+        s1_lengths, s2_lengths = self.s1_lengths(), self.s2_lengths()
+        lengths = np.maximum(s1_lengths, s2_lengths)
+        n_tokens = np.cumsum(s1_lengths[idxs] + s2_lengths[idxs])
+        bucket_ids = n_tokens / (max_tokens * bucket_factor)
+        batches = []
+        for bucket in np.split(idxs, np.nonzero(np.diff(bucket_ids))[0] + 1):
+            bucket = bucket[np.argsort(lengths[bucket], kind='mergesort')]
+            for start, end in token_budget_slices(s1_lengths[bucket], s2_lengths[bucket],
+                                                  max_tokens):
+                batches.append(bucket[start:end])
+        random.shuffle(batches)
+        return batches
+
+    # all idxs, ordered by length, in batches. for when order doesn't matter (eg
+    # evaluation) so padding can be kept to a minimum.
+    def length_sorted_batches(self, batch_size):
+        idxs = np.argsort(self.max_lengths(), kind='mergesort')
+        return [idxs[i : i + batch_size] for i in xrange(0, len(idxs), batch_size)]
+
+# (start, end) slices of consecutive egs, with the given s1 & s2 lengths, such that each
+# slice is as many egs as fit in max_tokens padded tokens; ie padded to the longest s1
+# and s2 of the slice (as per util.pad_batch) n_egs * (max s1 len + max s2 len) tokens.
+# egs should be sorted by length for slices to have little padding. an eg that's over
+# max_tokens on its own is a slice of one.
+def token_budget_slices(s1_lengths, s2_lengths, max_tokens):
+    slices = []
+    start, max_s1_len, max_s2_len = 0, 0, 0
+    for i, (s1_len, s2_len) in enumerate(itertools.izip(s1_lengths, s2_lengths)):
+        max_s1_len, max_s2_len = max(max_s1_len, s1_len), max(max_s2_len, s2_len)
+        if i > start and (i + 1 - start) * (max_s1_len + max_s2_len) > max_tokens:
+            slices.append((start, i))
+            start, max_s1_len, max_s2_len = i, s1_len, s2_len
+    if start < len(s1_lengths):
+        slices.append((start, len(s1_lengths)))
+    return slices
+
+# accumulates examples without holding per example python lists
+class CorpusBuilder(object):
+    def __init__(self):
+        self.tokens = array.array('i')
+        self.offsets = array.array('l', [0])
+        self.labels = array.array('b')
+
+    def append(self, s1, s2, label):
+        self.tokens.extend(s1)
+        self.offsets.append(len(self.tokens))
+        self.tokens.extend(s2)
+        self.offsets.append(len(self.tokens))
+        self.labels.append(label)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def build(self):
+        return Corpus(np.frombuffer(self.tokens, dtype='int32'),
+                      np.asarray(self.offsets, dtype='int64'),
+                      np.frombuffer(self.labels, dtype='int8'))
@@ -0,0 +1,260 @@
+import dropout
+import multiprocessing
+import numpy as np
+import random
+import theano
+import theano.tensor as T
+import time
+import util
+
+# synchronous data parallel training across n_workers processes on one box. the calling
+# process is worker 0, the others are forked from it by start(). each step every worker
+# computes gradients for its own minibatch against its own replica of the params; dense
+# gradients (see dense_params) are written to shared memory, embedding gradients as the
+# distinct rows touched along with the gradient per row (see row_gradients). worker 0
+# averages them and then every worker applies the same averaged gradients, using the
+# layer's own update fn (from updates.py), to its replica. since replicas start out the
+# same (they're forked after params & optimiser state are initialised or restored) and
+# apply identical updates they stay in sync without params ever being sent between
+# processes.
+#
+# gradients are computed (and clipped) per worker exactly as for single process
+# training, so with N workers a step is equivalent to a single process step over
+# the N minibatches (bar clipping).
+#
+# embedding row buffers are sized by max_rows, a bound on the distinct rows a worker's
+# batch touches (at most its number of padded tokens), rather than by vocab size. a
+# batch that touches more rows than fit (or an average over more than fit) spills; its
+# rows & row gradients are sent through the pipe instead of shared memory.
+
+# max_rows when there's no bound from the batching opts; see DataParallelTrainer
+DEFAULT_MAX_ROWS = 8192
+
+# numpy view of a zeroed (lock free) shared memory array; inherited by forked workers
+def shared_array(shape, dtype):
+    typecode = {'float32': 'f', 'float64': 'd', 'int32': 'i'}[dtype]
+    raw = multiprocessing.RawArray(typecode, int(np.prod(shape)))
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+class DataParallelTrainer(object):
+    # layers as per BaselineModel.layers; dense layers (those with dense_params) have
+    # their params updated with layer.update_fn, embedding layers with their
+    # row_updates. fn_inputs are the inputs (including apply_dropout) each step is given
+    # args for. max_rows is the number of distinct rows per embedding a worker's batch is
+    # expected to touch at most.
+    def __init__(self, layers, cost, fn_inputs, opts, n_workers,
+                 max_rows=DEFAULT_MAX_ROWS):
+        assert n_workers >= 1
+        self.n_workers = n_workers
+        # gradients (and the inputs for their averages) for dense params and then for
+        # embedding rows. update fns are called in layer order so optimiser state is
+        # created in the same order as for single process training (see checkpoint.py)
+        dense_gradients, mean_dense_gradients, dense_shapes = [], [], []
+        row_gradients, mean_row_gradients = [], []
+        self.embedding_shapes = []  # (vocab_size, embedding_dim) per embedding layer
+        updates = []
+        for layer in layers:
+            if hasattr(layer, 'dense_params'):
+                params = layer.dense_params()
+                dense_gradients.extend(util.clipped(T.grad(cost=cost, wrt=params)))
+                layer_mean_gradients = [p.type() for p in params]
+                mean_dense_gradients.extend(layer_mean_gradients)
+                updates.extend(layer.update_fn(params, layer_mean_gradients, opts))
+                dense_shapes.extend(p.get_value().shape for p in params)
+            else:
+                layer_row_gradients = layer.row_gradients(cost, opts)
+                if layer_row_gradients is None:
+                    continue
+                row_gradients.extend(layer_row_gradients)
+                rows, row_gradient = T.ivector('rows'), T.fmatrix('row_gradient')
+                mean_row_gradients.extend([rows, row_gradient])
+                updates.extend(layer.row_updates(rows, row_gradient, opts))
+                self.embedding_shapes.append((layer.vocab_size, layer.embedding_dim))
+        self.n_dense = len(dense_shapes)
+        self.gradients_fn = theano.function(inputs=fn_inputs,
+                                            outputs=[cost] + dense_gradients +
+                                                    row_gradients)
+        self.apply_fn = theano.function(inputs=mean_dense_gradients + mean_row_gradients,
+                                        updates=updates)
+
+        # dense gradients are laid out end to end, one row per worker.
+        self.dense_slices = []
+        offset = 0
+        for shape in dense_shapes:
+            size = int(np.prod(shape))
+            self.dense_slices.append((offset, offset + size, shape))
+            offset += size
+        self.dense_gradients = shared_array((n_workers, offset), 'float32')
+        self.mean_dense_gradient = shared_array((offset,), 'float32')
+        # row slots per worker, and for the average, of each embedding matrix; never more
+        # than vocab_size.
+        self.row_capacities = [min(v, max_rows) for v, _d in self.embedding_shapes]
+        self.mean_row_capacities = [min(v, n_workers * max_rows)
+                                    for v, _d in self.embedding_shapes]
+        self.worker_rows = [shared_array((n_workers, c), 'int32')
+                            for c in self.row_capacities]
+        self.worker_row_gradients = [shared_array((n_workers, c, d), 'float32')
+                                     for c, (_v, d) in zip(self.row_capacities,
+                                                           self.embedding_shapes)]
+        self.mean_rows = [shared_array((c,), 'int32') for c in self.mean_row_capacities]
+        self.mean_row_gradients = [shared_array((c, d), 'float32')
+                                   for c, (_v, d) in zip(self.mean_row_capacities,
+                                                         self.embedding_shapes)]
+
+        self.conns = []
+        self.processes = []
+        self.pending_mean = None  # row slots per embedding of the last average
+        self.reset_throughput()
+
+    # fork workers 1 .. n_workers-1; must be called once params are initialised (or
+    # restored from a checkpoint) and before the first step.
+    def start(self):
+        for worker in xrange(1, self.n_workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            seed = np.random.randint(1 << 30)
+            process = multiprocessing.Process(target=self._worker_loop,
+                                              args=(worker, worker_conn, seed))
+            process.daemon = True
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.conns, self.processes = [], []
+
+    def _worker_loop(self, worker, conn, seed):
+        # distinct dropout masks & s1/s2 swaps per worker
+        dropout.RND_STREAM.seed(seed)
+        np.random.seed(seed)
+        random.seed(seed)
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                return
+            mean, args = msg
+            if mean is not None:
+                self._apply(mean)
+            conn.send(None if args is None else self._gradients(worker, args))
+
+    # runs gradients_fn for args and writes the results to worker's slots. returns the
+    # cost and, per embedding layer, the row slot; either the number of distinct rows
+    # written to worker's row buffer or, if they didn't fit, (rows, row_gradient) itself.
+    def _gradients(self, worker, args):
+        outputs = self.gradients_fn(*args)
+        cost = outputs[0]
+        dense, row_gradients = outputs[1:1 + self.n_dense], outputs[1 + self.n_dense:]
+        for (start, end, _shape), gradient in zip(self.dense_slices, dense):
+            self.dense_gradients[worker, start:end] = gradient.ravel()
+        n_rows = []
+        for i in xrange(len(self.embedding_shapes)):
+            rows, row_gradient = row_gradients[2 * i], row_gradients[2 * i + 1]
+            if len(rows) > self.row_capacities[i]:
+                n_rows.append((rows, row_gradient))
+                continue
+            self.worker_rows[i][worker, :len(rows)] = rows
+            self.worker_row_gradients[i][worker, :len(rows)] = row_gradient
+            n_rows.append(len(rows))
+        return cost, n_rows
+
+    # (rows, row_gradient) for a row slot as from _gradients
+    def _worker_row_gradients(self, i, worker, slot):
+        if isinstance(slot, tuple):
+            return slot
+        return (self.worker_rows[i][worker, :slot],
+                self.worker_row_gradients[i][worker, :slot])
+
+    # average the gradients of the first len(n_rows_per_worker) workers into the mean
+    # buffers. rows touched by more than one worker are summed (row_updates requires
+    # distinct rows). returns the row slot, as for _gradients, per embedding.
+    def _average(self, n_rows_per_worker):
+        n = len(n_rows_per_worker)
+        np.mean(self.dense_gradients[:n], axis=0, out=self.mean_dense_gradient)
+        mean = []
+        for i in xrange(len(self.embedding_shapes)):
+            worker_rows, worker_row_gradients = zip(*[
+                self._worker_row_gradients(i, w, n_rows[i])
+                for w, n_rows in enumerate(n_rows_per_worker)])
+            self.n_spills += sum(isinstance(n_rows[i], tuple)
+                                 for n_rows in n_rows_per_worker)
+            rows = np.concatenate(worker_rows)
+            row_gradients = np.concatenate(worker_row_gradients)
+            distinct_rows, row_idxs = np.unique(rows, return_inverse=True)
+            n_distinct = len(distinct_rows)
+            if n_distinct > self.mean_row_capacities[i]:
+                self.n_spills += 1
+                mean_row_gradient = np.zeros((n_distinct, row_gradients.shape[1]),
+                                             dtype='float32')
+                mean.append((distinct_rows.astype('int32'), mean_row_gradient))
+            else:
+                self.mean_rows[i][:n_distinct] = distinct_rows
+                mean_row_gradient = self.mean_row_gradients[i][:n_distinct]
+                mean_row_gradient.fill(0)
+                mean.append(n_distinct)
+            np.add.at(mean_row_gradient, row_idxs, row_gradients)
+            mean_row_gradient /= n
+        return mean
+
+    def _apply(self, mean):
+        args = [self.mean_dense_gradient[start:end].reshape(shape)
+                for start, end, shape in self.dense_slices]
+        for i, slot in enumerate(mean):
+            if isinstance(slot, tuple):
+                args.extend(slot)
+            else:
+                args.extend([self.mean_rows[i][:slot], self.mean_row_gradients[i][:slot]])
+        self.apply_fn(*args)
+
+    # one synchronous step over up to n_workers batches; batch_args is a list of args
+    # (as for fn_inputs) per batch, the last of which is the labels. when there are
+    # fewer batches than workers (ie at the end of an epoch) the remaining workers sit
+    # the step out. returns the mean cost across batches.
+    def step(self, batch_args):
+        assert 1 <= len(batch_args) <= self.n_workers
+        step_start_time = time.time()
+        # workers apply the previous step's average before computing their gradients
+        for worker, conn in enumerate(self.conns, 1):
+            args = batch_args[worker] if worker < len(batch_args) else None
+            conn.send((self.pending_mean, args))
+        start_time = time.time()
+        results = [self._gradients(0, batch_args[0])]
+        worker_0_time = time.time() - start_time
+        for conn in self.conns:
+            result = conn.recv()
+            if result is not None:
+                results.append(result)
+        self.pending_mean = self._average([n_rows for _cost, n_rows in results])
+        start_time = time.time()
+        self._apply(self.pending_mean)
+        worker_0_time += time.time() - start_time
+
+        self.n_egs += sum(len(args[-1]) for args in batch_args)
+        self.step_time += time.time() - step_start_time
+        self.worker_0_n_egs += len(batch_args[0][-1])
+        self.worker_0_time += worker_0_time
+        return float(np.mean([cost for cost, _n_rows in results]))
+
+    def reset_throughput(self):
+        self.n_egs = 0
+        self.step_time = 0.
+        self.worker_0_n_egs = 0
+        self.worker_0_time = 0.
+        self.n_spills = 0
+
+    # stats since the last reset_throughput(). scaling efficiency is the egs/sec of
+    # steps relative to n_workers times that of a single worker; where the single worker
+    # rate is estimated from the time worker 0 spent computing & applying gradients (ie
+    # excluding waiting on, and averaging, other workers' gradients). row buffer spills
+    # are the number of row gradients (per worker or averaged) sent through the pipes
+    # since they didn't fit in shared memory.
+    def throughput(self):
+        egs_per_sec = self.n_egs / max(self.step_time, 1e-6)
+        single_worker_egs_per_sec = self.worker_0_n_egs / max(self.worker_0_time, 1e-6)
+        return {"data_parallel_workers": self.n_workers,
+                "single_worker_egs_per_sec": single_worker_egs_per_sec,
+                "scaling_efficiency": egs_per_sec /
+                                      (self.n_workers * single_worker_egs_per_sec),
+                "row_buffer_spills": self.n_spills}
@@ -0,0 +1,165 @@
+import hashlib
+import itertools
+import json
+import numpy as np
+import os
+import shutil
+import sys
+
+# pretrained (eg glove) embeddings in a form that can be opened memory mapped and
+# gathered from for any vocab without reparsing text. on disk it's a directory of
+#  vectors.f32        : (n_tokens, dim) float32, raw (row major) since the number of
+#                       rows isn't known until a streamed conversion is done
+#  token_bytes.npy    : all tokens, end to end, as uint8 ...
+#  token_offsets.npy  : ... with (CSR style) offsets; token i is bytes[o[i]:o[i+1]]
+#  hash_index.npy     : sorted 64 bit hashes of the tokens ...
+#  hash_rows.npy      : ... and the row of vectors for each hash
+#  meta.json          : n_tokens, dim and where it was converted from
+# tokens are looked up by binary search of their hashes (see rows_for_tokens) then
+# checked against token_bytes, so a (very unlikely) hash collision is a miss rather than
+# the wrong vector.
+
+# tokens in the store are utf-8 bytes (as read from the glove text) whereas vocab
+# tokens may be unicode (eg from a binary vocab or parsed from json)
+def utf8(token):
+    return token.encode('utf-8') if isinstance(token, unicode) else token
+
+# 64 bit hash per token; first 8 bytes of md5, so stable across runs & python versions
+def token_hashes(tokens):
+    if not tokens:
+        return np.zeros(0, dtype='uint64')
+    return np.frombuffer("".join(hashlib.md5(utf8(t)).digest()[:8] for t in tokens),
+                         dtype='<u8').astype('uint64')
+
+# stream glove text (ssv; token, e_d1, e_d2, ...) in chunks of chunk_lines lines,
+# yielding (tokens, (n, dim) float32 vectors) per chunk. a chunk's values are parsed by a
+# single np.fromstring rather than per line. some glove releases have a few tokens
+# containing spaces; a chunk where the fast path doesn't give dim values per line is
+# reparsed splitting each line from the right.
+def glove_chunks(path, chunk_lines=10000):
+    dim = None
+    with open(path, "r") as f:
+        while True:
+            lines = [l for l in itertools.islice(f, chunk_lines) if l.strip()]
+            if not lines:
+                return
+            if dim is None:
+                dim = len(lines[0].rstrip().split(" ")) - 1
+            tokens, values = [], []
+            for line in lines:
+                token, token_values = line.rstrip().split(" ", 1)
+                tokens.append(token)
+                values.append(token_values)
+            vectors = np.fromstring(" ".join(values), dtype=np.float32, sep=" ")
+            if len(vectors) != len(lines) * dim:
+                tokens, vectors = _split_from_right(lines, dim)
+            yield tokens, vectors.reshape((len(lines), dim))
+
+def _split_from_right(lines, dim):
+    tokens = []
+    vectors = np.empty((len(lines), dim), dtype=np.float32)
+    for i, line in enumerate(lines):
+        cols = line.rstrip().rsplit(" ", dim)
+        if len(cols) != dim + 1:
+            raise Exception("expected %d values for token [%s]" % (dim, cols[0]))
+        tokens.append(cols[0])
+        vectors[i] = np.array(cols[1:], dtype=np.float32)
+    return tokens, vectors
+
+class EmbeddingStore(object):
+    def __init__(self, vectors, token_bytes, token_offsets, hash_index, hash_rows):
+        assert len(token_offsets) == len(vectors) + 1
+        assert len(hash_index) == len(hash_rows)
+        self.vectors = vectors
+        self.token_bytes = token_bytes
+        self.token_offsets = token_offsets
+        self.hash_index = hash_index
+        self.hash_rows = hash_rows
+
+    @staticmethod
+    def load(directory, mmap=True):
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        shape = (meta["n_tokens"], meta["dim"])
+        vectors_file = os.path.join(directory, "vectors.f32")
+        if mmap:
+            vectors = np.memmap(vectors_file, dtype='float32', mode='r', shape=shape)
+        else:
+            vectors = np.fromfile(vectors_file, dtype='float32').reshape(shape)
+        mmap_mode = 'r' if mmap else None
+        def load(name):
+            return np.load(os.path.join(directory, "%s.npy" % name), mmap_mode=mmap_mode)
+        return EmbeddingStore(vectors, load("token_bytes"), load("token_offsets"),
+                              load("hash_index"), load("hash_rows"))
+
+    # one off conversion of glove text at glove_path to a store in directory. the text
+    # is streamed (see glove_chunks) so memory is bounded by chunk_lines plus the token
+    # index. if a token appears more than once the first occurrence is indexed.
+    @staticmethod
+    def convert_glove(glove_path, directory, chunk_lines=10000):
+        # write to tmp dir and rename so a partial store is never seen
+        tmp_directory = "%s.tmp.%s" % (directory, os.getpid())
+        os.makedirs(tmp_directory)
+        dim = None
+        token_bytes, token_lengths, hashes = [], [], []
+        with open(os.path.join(tmp_directory, "vectors.f32"), "wb") as f:
+            for tokens, vectors in glove_chunks(glove_path, chunk_lines):
+                if dim is None:
+                    dim = vectors.shape[1]
+                assert vectors.shape[1] == dim, "differing dimensionality in glove data?"
+                f.write(vectors.tobytes())
+                token_bytes.append(np.frombuffer("".join(tokens), dtype='uint8'))
+                token_lengths.append(np.array(map(len, tokens), dtype='int64'))
+                hashes.append(token_hashes(tokens))
+                print >>sys.stderr, "converted", sum(map(len, hashes)), "tokens"
+        if dim is None:
+            shutil.rmtree(tmp_directory)
+            raise Exception("no embeddings in [%s]" % glove_path)
+        token_offsets = np.concatenate([[0], np.cumsum(np.concatenate(token_lengths))])
+        hashes = np.concatenate(hashes)
+        order = np.argsort(hashes, kind='mergesort')  # stable; first occurrence first
+        sorted_hashes = hashes[order]
+        first = np.concatenate([[True], sorted_hashes[1:] != sorted_hashes[:-1]])
+        np.save(os.path.join(tmp_directory, "token_bytes.npy"), np.concatenate(token_bytes))
+        np.save(os.path.join(tmp_directory, "token_offsets.npy"), token_offsets)
+        np.save(os.path.join(tmp_directory, "hash_index.npy"), sorted_hashes[first])
+        np.save(os.path.join(tmp_directory, "hash_rows.npy"), order[first])
+        meta = {"n_tokens": len(hashes), "dim": dim,
+                "n_duplicate_tokens": int(len(hashes) - first.sum()),
+                "source": os.path.abspath(glove_path),
+                "source_size": os.path.getsize(glove_path)}
+        with open(os.path.join(tmp_directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_directory, directory)
+        print >>sys.stderr, "glove store", meta
+        return EmbeddingStore.load(directory)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def token(self, row):
+        return self.token_bytes[self.token_offsets[row]:self.token_offsets[row+1]].tostring()
+
+    # row of vectors for each of tokens; -1 for tokens not in the store
+    def rows_for_tokens(self, tokens):
+        tokens = map(utf8, tokens)
+        hashes = token_hashes(tokens)
+        pos = np.minimum(np.searchsorted(self.hash_index, hashes), len(self.hash_index) - 1)
+        rows = np.where(self.hash_index[pos] == hashes, self.hash_rows[pos], -1)
+        for i in np.nonzero(rows >= 0)[0]:
+            if self.token(rows[i]) != tokens[i]:
+                rows[i] = -1  # hash collision with another token
+        return rows
+
+    # (len(tokens), dim) vectors for tokens, zeros for those not in the store, along
+    # with a bool mask of which were found. a single (sorted) gather from vectors.
+    def gather(self, tokens):
+        rows = self.rows_for_tokens(tokens)
+        found = rows >= 0
+        vectors = np.zeros((len(tokens), self.dim()), dtype=np.float32)
+        order = np.argsort(rows[found], kind='mergesort')
+        vectors[np.nonzero(found)[0][order]] = self.vectors[rows[found][order]]
+        return vectors, found
@@ -2,40 +2,107 @@ import math
 import numpy as np
 import theano
 import theano.tensor as T
+from theano.tensor.extra_ops import Unique
+import updates
 import util
 
+# idxs are either a vector (a single sequence) or a time major matrix (a padded batch of
+# sequences; one column per example). in both cases embedding lookups are done against
+# the flattened idxs so the lookup is a single AdvancedSubtensor1 that inc_subtensor can
+# update. this reshapes the flat (n, embedding_dim) lookup back to the shape of idxs.
+def reshape_to_idxs(flat_embeddings, idxs, embedding_dim):
+    if idxs.ndim == 1:
+        return flat_embeddings
+    return flat_embeddings.reshape((idxs.shape[0], idxs.shape[1], embedding_dim))
+
+# zero the rows of a flat embedding lookup that correspond to padding so they don't
+# contribute to the l2 penalty.
+def masked_rows(flat_embeddings, mask):
+    if mask is None:
+        return flat_embeddings
+    return flat_embeddings * mask.flatten().dimshuffle(0, 'x')
+
+# sum the rows of a flat gradient (one row per token) that are for the same idx. returns
+# the distinct idxs and the (len(distinct idxs), embedding_dim) summed gradient.
+def gradient_per_row(flat_idxs, gradient, embedding_dim):
+    rows, row_for_token = Unique(return_inverse=True)(flat_idxs)
+    summed = T.zeros((rows.shape[0], embedding_dim), dtype=gradient.dtype)
+    return rows, T.inc_subtensor(summed[row_for_token], gradient)
+
 class Embeddings(object):
+    # sparse_update_fn, if set, is one of the updates.sparse_* fns in which case the l2
+    # penalty isn't part of the cost; it's applied lazily as a decay of just the rows
+    # touched by (unpadded) tokens in each step.
     def __init__(self, vocab_size, embedding_dim,
-                 idxs=None, sequence_embeddings=None):
+                 idxs=None, sequence_embeddings=None, mask=None, sparse_update_fn=None):
         assert (idxs is None) ^ (sequence_embeddings is None)
         #self.name = name
+        self.vocab_size = vocab_size
+        self.embedding_dim = embedding_dim
+        self.sparse_update_fn = sparse_update_fn
 
         if idxs is not None:
             # not tying weights, build our own set of embeddings
             self.Wx = util.sharedMatrix(vocab_size, embedding_dim, 'Wx',
                                         orthogonal_init=True)
-            self.sequence_embeddings = self.Wx[idxs]
+            self.flat_idxs = idxs.flatten()
+            self.sequence_embeddings = self.Wx[self.flat_idxs]
+            self.shaped_embeddings = reshape_to_idxs(self.sequence_embeddings, idxs,
+                                                     embedding_dim)
+            self.mask = mask
             self.using_shared_embeddings = False
         else:
             # using tied weights, we won't be handling the update
             self.sequence_embeddings = sequence_embeddings
+            self.shaped_embeddings = sequence_embeddings
             self.using_shared_embeddings = True
 
     def params_for_l2_penalty(self):
-        if self.using_shared_embeddings:
+        if self.using_shared_embeddings or self.sparse_update_fn is not None:
             return []
-        return [self.sequence_embeddings]
+        return [masked_rows(self.sequence_embeddings, self.mask)]
 
     def updates_wrt_cost(self, cost, learning_opts):
         if self.using_shared_embeddings:
             return []
-        learning_rate = learning_opts.learning_rate
+        if self.sparse_update_fn is not None:
+            rows, row_gradient = self.row_gradients(cost, learning_opts)
+            return self.row_updates(rows, row_gradient, learning_opts)
         gradient = util.clipped(T.grad(cost=cost, wrt=self.sequence_embeddings))
+        learning_rate = learning_opts.learning_rate
         return [(self.Wx, T.inc_subtensor(self.sequence_embeddings,
                                           -learning_rate * gradient))]
 
+    # distinct rows touched by this step and the (clipped) gradient summed per row, or
+    # None if this layer doesn't update its embeddings. see row_updates.
+    def row_gradients(self, cost, learning_opts):
+        if self.using_shared_embeddings:
+            return None
+        gradient = util.clipped(T.grad(cost=cost, wrt=self.sequence_embeddings))
+        rows, row_gradient = gradient_per_row(self.flat_idxs, gradient,
+                                              self.embedding_dim)
+        if self.sparse_update_fn is None:
+            return rows, row_gradient
+        # lazy l2; d/dw of l2_penalty * w**2, only for rows used by a real token. (a
+        # row only used for padding, ie UNK, has a zero gradient and isn't decayed.)
+        if self.mask is None:
+            touched = T.ones_like(rows)
+        else:
+            _rows, n_tokens = gradient_per_row(self.flat_idxs,
+                                               self.mask.flatten().dimshuffle(0, 'x'), 1)
+            touched = T.gt(n_tokens[:, 0], 0)
+        l2_gradient = 2 * learning_opts.l2_penalty * self.Wx[rows] * \
+                      touched.dimshuffle(0, 'x')
+        return rows, row_gradient + l2_gradient
+
+    # updates for a (rows, row_gradient) pair as from row_gradients; rows must be
+    # distinct.
+    def row_updates(self, rows, row_gradient, learning_opts):
+        update_fn = self.sparse_update_fn or updates.sparse_vanilla
+        return update_fn(self.Wx, rows, row_gradient, learning_opts)
+
     def embeddings(self):
-        return self.sequence_embeddings
+        return self.shaped_embeddings
 
 class TiedEmbeddings(object):
     def __init__(self, vocab_size, embedding_dim, initial_embeddings_file=None, 
@@ -43,6 +110,9 @@ class TiedEmbeddings(object):
         if not train_embeddings and initial_embeddings_file is None:
             print >>sys.stderr, "WARNING: not training embedding without initial embeddings"
         self.train_embeddings = train_embeddings
+        self.vocab_size = vocab_size
+        self.embedding_dim = embedding_dim
+        self.concatenated_mask = None
         if initial_embeddings_file:
             e = np.load(initial_embeddings_file)
             assert e.shape[0] == vocab_size, "vocab mismatch size? loaded=%s expected=%s" % (e.shape[0], vocab_size)
@@ -56,12 +126,17 @@ class TiedEmbeddings(object):
                                                        'tied_embeddings',
                                                        orthogonal_init=True)
 
-    def slices_for_idxs(self, idxs):  # list of vectors (idxs)
+    def slices_for_idxs(self, idxs, masks=None):  # list of vectors (idxs) or time major matrices
         # concat all idx sequences into one sequence so we can slice into shared
         # embeddings with a _single_ operation. we need to do this only because
         # inc_subtensor only allows for one indexing :/
         concatenated_idxs = T.concatenate(idxs)
-        self.concatenated_sequence_embeddings = self.shared_embeddings[concatenated_idxs]
+        self.flat_idxs = concatenated_idxs.flatten()
+        self.concatenated_sequence_embeddings = self.shared_embeddings[self.flat_idxs]
+        if masks is not None:
+            self.concatenated_mask = T.concatenate(masks)
+        concatenated_embeddings = reshape_to_idxs(self.concatenated_sequence_embeddings,
+                                                  concatenated_idxs, self.embedding_dim)
 
         # but now we have to reslice back into this to pick up the embeddings per original
         # index sequence. each of these subslices is given to a seperate rnn to run over.
@@ -69,8 +144,7 @@ class TiedEmbeddings(object):
         offset = 0
         for idx in idxs:
             seq_len = idx.shape[0]
-            sub_slices.append(self.concatenated_sequence_embeddings[offset :
-                                                                    offset + seq_len])
+            sub_slices.append(concatenated_embeddings[offset : offset + seq_len])
             offset += seq_len
         return sub_slices
 
@@ -83,7 +157,7 @@ class TiedEmbeddings(object):
         # for l2 penalty only check the subset of the embeddings related to a specific
         # example. ie NOT the entire shared_embeddings, most of which has nothing to do
         # with each example.
-        return [self.concatenated_sequence_embeddings]
+        return [masked_rows(self.concatenated_sequence_embeddings, self.concatenated_mask)]
 
     def updates_wrt_cost(self, cost, learning_opts):
         if not self.train_embeddings:
@@ -96,3 +170,15 @@ class TiedEmbeddings(object):
         return [(self.shared_embeddings,
                  T.inc_subtensor(self.concatenated_sequence_embeddings,
                                  -learning_rate * gradient))]
+
+    # as Embeddings.row_gradients / row_updates
+    def row_gradients(self, cost, learning_opts):
+        if not self.train_embeddings:
+            return None
+        gradient = util.clipped(T.grad(cost=cost,
+                                       wrt=self.concatenated_sequence_embeddings))
+        return gradient_per_row(self.flat_idxs, gradient, self.embedding_dim)
+
+    def row_updates(self, rows, row_gradient, learning_opts):
+        return updates.sparse_vanilla(self.shared_embeddings, rows, row_gradient,
+                                      learning_opts)
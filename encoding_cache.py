@@ -0,0 +1,42 @@
+from collections import OrderedDict
+
+# least recently used cache of sentence encodings (numpy arrays) capped by the total
+# bytes of the arrays held. keys are anything hashable; eg (role, tuple(token ids)).
+class EncodingCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # least recently used first
+        self.n_bytes = 0
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # cached encoding for key (marking it most recently used) or None
+    def get(self, key):
+        encoding = self.entries.pop(key, None)
+        if encoding is None:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        self.entries[key] = encoding
+        return encoding
+
+    # add encoding, evicting least recently used entries while over max_bytes. an
+    # encoding bigger than max_bytes on its own isn't kept.
+    def put(self, key, encoding):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.n_bytes -= old.nbytes
+        if encoding.nbytes > self.max_bytes:
+            return
+        self.entries[key] = encoding
+        self.n_bytes += encoding.nbytes
+        while self.n_bytes > self.max_bytes:
+            _key, evicted = self.entries.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.n_bytes,
+                "hits": self.n_hits, "misses": self.n_misses}
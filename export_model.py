@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# export a model checkpointed by nn_baseline.py or nn_seq2seq.py (see --checkpoint-file)
+# to a npz of named weights, plus the vocab & opts needed to tokenise, for numpy_model.py
+# which scores without theano. --verify-with checks the numpy forward pass against the
+# compiled theano one on (some of) a jsonl file.
+import argparse
+from baseline_model import BaselineModel
+import checkpoint
+import json
+import numpy as np
+import numpy_model
+import predict
+from seq2seq_model import Seq2SeqModel
+import sys
+import theano
+import util
+from vocab import Vocab
+
+# theano graph class and the opts (besides parse_mode) numpy_model.py needs to rebuild it
+# per --model-type
+MODELS = {'baseline': (BaselineModel, predict.MODEL_OPTS),
+          'seq2seq': (Seq2SeqModel, [])}
+
+# label probabilities from the compiled theano graph of model, in length sorted batches;
+# as predict.Predictor.probs
+def compiled_probs(model, s1s, s2s, batch_size=128):
+    prob_fn = theano.function(inputs=model.inputs(), outputs=model.prob_y)
+    lengths = [max(len(s1), len(s2)) for s1, s2 in zip(s1s, s2s)]
+    order = np.argsort(lengths, kind='mergesort')
+    probs = np.empty((len(s1s), len(util.LABELS)), dtype='float32')
+    for start in xrange(0, len(order), batch_size):
+        idxs = order[start : start + batch_size]
+        s1, s1_mask = util.pad_batch([s1s[i] for i in idxs])
+        s2, s2_mask = util.pad_batch([s2s[i] for i in idxs])
+        probs[idxs] = prob_fn(s1, s1_mask, s2, s2_mask)
+    return probs
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', required=True,
+                    help='checkpoint npz from nn_baseline.py (or nn_seq2seq.py)'
+                         ' --checkpoint-file')
+parser.add_argument('--model-type', default='baseline',
+                    help='baseline (nn_baseline.py) or seq2seq (nn_seq2seq.py)')
+parser.add_argument('--output', required=True, help='npz to write for numpy_model.py')
+parser.add_argument('--verify-with',
+                    help='if set, compare numpy & theano label probabilities for egs'
+                         ' in this jsonl')
+parser.add_argument('--num-to-verify', default=1000, type=int,
+                    help='max number of egs from --verify-with to compare')
+parser.add_argument('--tolerance', default=1e-4, type=float,
+                    help='max abs difference in probabilities allowed when verifying')
+opts = parser.parse_args()
+print >>sys.stderr, opts
+if opts.model_type not in MODELS:
+    raise Exception("unknown model type [%s]" % opts.model_type)
+model_cls, model_opt_names = MODELS[opts.model_type]
+
+ckpt = checkpoint.Checkpoint(opts.checkpoint)
+vocab = Vocab()
+ckpt.restore_vocab(vocab)
+n_shared_before = len(util.SHARED_VARIABLES)
+model = model_cls(ckpt.opts, vocab.size())
+ckpt.restore_model(util.SHARED_VARIABLES[n_shared_before:], inference_only=True)
+model_opts = dict((opt, getattr(ckpt.opts, opt)) for opt in model_opt_names)
+model_opts['model_type'] = opts.model_type
+model_opts['parse_mode'] = getattr(ckpt.opts, 'parse_mode', 'BINARY_WITHOUT_PARENTHESIS')
+numpy_model.save(opts.output, model.weights(), model_opts, vocab)
+print >>sys.stderr, util.dts(), "wrote %s" % opts.output
+
+if opts.verify_with:
+    numpy_predictor = numpy_model.Predictor(opts.output)
+    s1s, s2s = [], []
+    for line in open(opts.verify_with, "r"):
+        if len(s1s) == opts.num_to_verify:
+            break
+        s1, s2 = numpy_predictor.ids_for(json.loads(line))
+        s1s.append(s1)
+        s2s.append(s2)
+    numpy_probs = numpy_predictor.probs(s1s, s2s)
+    theano_probs = compiled_probs(model, s1s, s2s)
+    max_diff = float(np.max(np.abs(numpy_probs - theano_probs)))
+    n_pred_diff = int(np.sum(np.argmax(numpy_probs, axis=1) !=
+                             np.argmax(theano_probs, axis=1)))
+    print >>sys.stderr, util.dts(), "verified %d egs; max prob diff %s, %d preds differ" \
+        % (len(s1s), max_diff, n_pred_diff)
+    if max_diff > opts.tolerance:
+        raise Exception("numpy model differs from theano model by %s (> %s)" %
+                        (max_diff, opts.tolerance))
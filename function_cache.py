@@ -0,0 +1,52 @@
+import cPickle
+import hashlib
+import json
+import os
+import sys
+import theano
+
+# compiling theano functions is slow so compiled functions can be pickled to disk and
+# reused by later runs with the same config (ie everything that affects the graph). an
+# entry is pickled along with the shared variables the functions use so they are the
+# same objects once unpickled; values can then be set (eg from a checkpoint) after
+# loading. theano skips re-optimising unpickled functions (see
+# theano.config.reoptimize_unpickled_function)
+
+def _path(cache_dir, config):
+    config = dict(config, theano_version=theano.__version__,
+                  floatX=theano.config.floatX)
+    key = hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+    return os.path.join(cache_dir, "%s.pkl" % key)
+
+# returns cached value for config, or None if there isn't one
+def load(cache_dir, config):
+    path = _path(cache_dir, config)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return cPickle.load(f)
+
+def save(cache_dir, config, value):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # scan graphs are deep; pickling them needs more than the default recursion limit
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 50000))
+    path = _path(cache_dir, config)
+    # write to tmp and rename so concurrent runs never see a partial entry
+    tmp_path = "%s.tmp.%s" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        cPickle.dump(value, f, protocol=cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+
+# unpickled functions use the (unpickled) shared variables they were cached with. this
+# points the equivalent shared variables of a freshly built graph at the same storage,
+# after moving their (eg freshly initialised) values into it, so getting or setting
+# either (eg by checkpoint.py) is seen by the cached fns. cached_shared_variables[i]
+# pairs with shared_variables[i] so both must have been created in the same order.
+def share_storage(cached_shared_variables, shared_variables):
+    assert len(cached_shared_variables) == len(shared_variables), \
+        "cached fns have %s shared variables but graph has %s" % \
+        (len(cached_shared_variables), len(shared_variables))
+    for cached, fresh in zip(cached_shared_variables, shared_variables):
+        cached.set_value(fresh.get_value(borrow=True), borrow=True)
+        fresh.container = cached.container
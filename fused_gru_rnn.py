@@ -0,0 +1,58 @@
+from gru_rnn import GruRnn
+import theano
+import theano.tensor as T
+import util
+
+# same params (and so same checkpoints & l2 penalty) as GruRnn but restructured so
+# everything that depends only on the inputs is done before the scan; the input
+# projections for the reset gate, carry gate and candidate state (Wr, Wz & Wh stacked)
+# for all timesteps are a single GEMM, as is the context projection. each step then
+# only has the recurrent matmuls; one for Ur & Uz stacked and one for Uh (which has to
+# follow the reset gate).
+class FusedGruRnn(GruRnn):
+    def hidden_dim(self):
+        return self.Uh.get_value().shape[0]
+
+    # projections of inputs (and context) for all timesteps; (time, 2*hidden) for the
+    # reset & carry gates and (time, hidden) for the candidate state (or (time, batch, _)
+    # if batched)
+    def input_projections(self):
+        hidden_dim = self.hidden_dim()
+        W = T.concatenate([self.Wr, self.Wz, self.Wh])
+        b = T.concatenate([self.br, self.bz, self.bh])
+        projections = T.dot(self.inputs, W.T) + b
+        rz_projections = util.last_axis_slice(projections, 0, 2*hidden_dim)
+        h_projections = util.last_axis_slice(projections, 2*hidden_dim, 3*hidden_dim)
+        if self.context:
+            # context is constant across time; (hidden,) or (batch, hidden) so it
+            # broadcasts across the time axis.
+            h_projections += T.dot(self.context, self.Wch.T)
+        return rz_projections, h_projections
+
+    def fused_step(self, rz_inp, h_inp, h_t_minus_1, U_rz):
+        hidden_dim = self.hidden_dim()
+        rz = T.nnet.sigmoid(T.dot(h_t_minus_1, U_rz.T) + rz_inp)
+        r = util.last_axis_slice(rz, 0, hidden_dim)
+        z = util.last_axis_slice(rz, hidden_dim, 2*hidden_dim)
+        h_t_candidate = T.tanh(r * T.dot(h_t_minus_1, self.Uh.T) + h_inp)
+        h_t = (1 - z) * h_t_minus_1 + z * h_t_candidate
+        return [h_t, h_t]
+
+    def masked_fused_step(self, rz_inp, h_inp, mask, h_t_minus_1, U_rz):
+        h_t, _ = self.fused_step(rz_inp, h_inp, h_t_minus_1, U_rz)
+        mask = mask.dimshuffle(0, 'x')
+        h_t = mask * h_t + (1 - mask) * h_t_minus_1
+        return [h_t, h_t]
+
+    def all_states(self):
+        sequences = list(self.input_projections())
+        if self.mask is None:
+            step_fn = self.fused_step
+        else:
+            step_fn = self.masked_fused_step
+            sequences.append(self.mask)
+        [_h_t, h_t], _ = theano.scan(fn=step_fn,
+                                     sequences=sequences,
+                                     outputs_info=[self.initial_state(), None],
+                                     non_sequences=[T.concatenate([self.Ur, self.Uz])])
+        return h_t
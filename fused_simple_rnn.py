@@ -0,0 +1,38 @@
+from simple_rnn import SimpleRnn
+import theano
+import theano.tensor as T
+
+# same params (and so same checkpoints & l2 penalty) as SimpleRnn but with the input
+# (and context) projections for all timesteps done as a single GEMM before the scan so
+# each step is just the recurrent matmul.
+class FusedSimpleRnn(SimpleRnn):
+    # (time, hidden) or (time, batch, hidden) projections of inputs (and context)
+    def input_projections(self):
+        projections = T.dot(self.inputs, self.Wh.T) + self.bh
+        if self.context:
+            # context is constant across time; (hidden,) or (batch, hidden) so it
+            # broadcasts across the time axis.
+            projections += T.dot(self.context, self.Whc.T)
+        return projections
+
+    def fused_step(self, inp, h_t_minus_1):
+        h_t = T.tanh(T.dot(h_t_minus_1, self.Uh.T) + inp)
+        return [h_t, h_t]
+
+    def masked_fused_step(self, inp, mask, h_t_minus_1):
+        h_t, _ = self.fused_step(inp, h_t_minus_1)
+        mask = mask.dimshuffle(0, 'x')
+        h_t = mask * h_t + (1 - mask) * h_t_minus_1
+        return [h_t, h_t]
+
+    def all_states(self):
+        sequences = [self.input_projections()]
+        if self.mask is None:
+            step_fn = self.fused_step
+        else:
+            step_fn = self.masked_fused_step
+            sequences.append(self.mask)
+        [_h_t, h_t], _ = theano.scan(fn=step_fn,
+                                     sequences=sequences,
+                                     outputs_info=[self.initial_state(), None])
+        return h_t
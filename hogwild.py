@@ -0,0 +1,126 @@
+from data_parallel import shared_array
+import dropout
+import multiprocessing
+import numpy as np
+import random
+
+# hogwild (niu et al, 2011) style asynchronous training. n_workers processes, forked
+# per epoch, each run train_fn over their own share of the epoch's batches concurrently,
+# and without any locking, against a single copy of the params in shared memory (see
+# SharedParams). since each step only touches the embedding rows of the tokens in its
+# batch, most concurrent updates don't overlap. the calling process is left free to
+# monitor progress, run the dev set & checkpoint.
+
+# how often the monitoring process checks on worker progress
+MONITOR_POLL_SEC = 1.0
+
+# moves the values of shared_variables (params & optimiser state) into shared memory so
+# processes forked afterwards all read & update the same arrays. theano does some updates
+# in place (eg the inc_subtensor of embedding rows) and these are left to work directly
+# on the shared arrays. others produce a new array, and may use the old one as scratch
+# space along the way, so call() runs fn against a private copy of these and then adds
+# the change made by the step to the shared array (so concurrent updates from other
+# processes aren't lost, or clobbered).
+class SharedParams(object):
+    def __init__(self, shared_variables):
+        self.shared_variables = shared_variables
+        self.arrays = []
+        for var in shared_variables:
+            value = var.get_value(borrow=True)
+            array = shared_array(value.shape, str(value.dtype))
+            array[...] = value
+            var.set_value(array, borrow=True)
+            self.arrays.append(array)
+        # whether each variable is updated in place; unknown until the first call (in
+        # each process) so that runs with private copies of all variables.
+        self.in_place = None
+
+    def call(self, fn, *args):
+        if self.in_place is None:
+            private = range(len(self.arrays))
+        else:
+            private = [i for i, in_place in enumerate(self.in_place) if not in_place]
+        snapshots = {}
+        for i in private:
+            snapshots[i] = self.arrays[i].copy()
+            self.shared_variables[i].set_value(snapshots[i].copy(), borrow=True)
+        private_data = dict((i, self.shared_variables[i].get_value(
+                                borrow=True, return_internal_type=True).ctypes.data)
+                            for i in private)
+        outputs = fn(*args)
+        in_place = list(self.in_place or [False] * len(self.arrays))
+        for i in private:
+            var = self.shared_variables[i]
+            value = var.get_value(borrow=True, return_internal_type=True)
+            self.arrays[i] += value - snapshots[i]
+            if self.in_place is None:
+                in_place[i] = value.ctypes.data == private_data[i]
+            if in_place[i]:
+                var.set_value(self.arrays[i], borrow=True)
+        self.in_place = in_place
+        return outputs
+
+class HogwildWorkers(object):
+    def __init__(self, n_workers):
+        self.n_workers = n_workers
+        # progress per worker through its share of the current epoch
+        self.n_batches = shared_array((n_workers,), 'int32')
+        self.n_egs = shared_array((n_workers,), 'int32')
+        self.n_tokens = shared_array((n_workers,), 'float64')
+        self.cost_sums = shared_array((n_workers,), 'float64')
+        self.processes = []
+
+    # fork workers to run step_fn(batch), which returns the cost and the number of
+    # tokens in the batch, for batches; worker i takes batches[i::n_workers]. must be
+    # called after SharedParams is set up.
+    def start(self, batches, step_fn):
+        self.n_batches.fill(0)
+        self.n_egs.fill(0)
+        self.n_tokens.fill(0)
+        self.cost_sums.fill(0)
+        self.processes = []
+        for worker in xrange(self.n_workers):
+            seed = np.random.randint(1 << 30)
+            process = multiprocessing.Process(
+                target=self._worker_loop,
+                args=(worker, batches[worker::self.n_workers], step_fn, seed))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def _worker_loop(self, worker, batches, step_fn, seed):
+        # distinct dropout masks & s1/s2 swaps per worker
+        dropout.RND_STREAM.seed(seed)
+        np.random.seed(seed)
+        random.seed(seed)
+        for batch in batches:
+            cost, n_tokens = step_fn(batch)
+            self.cost_sums[worker] += cost
+            self.n_egs[worker] += len(batch)
+            self.n_tokens[worker] += n_tokens
+            self.n_batches[worker] += 1
+
+    # wait up to timeout secs for workers to finish; returns True if they all have
+    def join(self, timeout):
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                return False
+        for process in self.processes:
+            if process.exitcode != 0:
+                raise Exception("hogwild worker failed (exit code %s)" % process.exitcode)
+        return True
+
+    def terminate(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+    # (n batches, n egs, n tokens, sum of batch costs) done over all workers for this
+    # epoch, along with the number of batches, from the start of the epoch's batches,
+    # that have all certainly been done (ie where to resume from).
+    def progress(self):
+        n_batches = self.n_batches.copy()
+        n_done_in_order = self.n_workers * int(n_batches.min())
+        return (int(n_batches.sum()), int(self.n_egs.sum()), int(self.n_tokens.sum()),
+                float(self.cost_sums.sum()), n_done_in_order)
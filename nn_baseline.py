@@ -1,16 +1,17 @@
 #!/usr/bin/env python
 import argparse
-from concat_with_softmax import ConcatWithSoftmax
+from baseline_model import BaselineModel, NUM_LABELS
+import checkpoint
+import data_parallel
+from data_parallel import DataParallelTrainer
+import dropout
 from dropout import APPLY_DROPOUT, NO_DROPOUT
-from embeddings import Embeddings, TiedEmbeddings
-from gru_rnn import GruRnn
-import itertools
+import function_cache
+import hogwild
 import json
 import numpy as np
 import os
 import random
-from simple_rnn import SimpleRnn
-from sklearn.metrics import confusion_matrix
 from stats import Stats
 import sys
 import time
@@ -39,6 +40,11 @@ parser.add_argument('--momentum', default=0., type=float,
                     help='momentum (when applicable)')
 parser.add_argument('--update-fn', default='vanilla',
                     help='vanilla (sgd), momentum or rmsprop. not applied to embeddings')
+parser.add_argument('--embedding-update-fn',
+                    help='if set, untied embeddings are trained with a sparse (row wise)'
+                         ' optimiser; vanilla, momentum, adagrad or rmsprop. l2 penalty'
+                         ' is then applied lazily to just the rows used in each batch.'
+                         ' if not set embeddings are trained with sgd')
 parser.add_argument('--hidden-dim', default=50, type=int,
                     help='hidden node dimensionality')
 parser.add_argument('--bidirectional', action='store_true',
@@ -51,12 +57,17 @@ parser.add_argument('--initial-embeddings',
                     help='initial embeddings npy file. for now only applicable if'
                          ' --tied-embeddings. requires --vocab-file')
 parser.add_argument('--vocab-file',
-                    help='vocab (token -> idx) for embeddings,'
-                         ' required if using --initial-embeddings')
+                    help='vocab (token -> idx) for embeddings; tsv or binary .npz (see'
+                         ' vocab.py). required if using --initial-embeddings')
 parser.add_argument('--l2-penalty', default=0.0001, type=float,
                     help='l2 penalty for params')
 parser.add_argument('--rnn-type', default="SimpleRnn",
-                    help='rnn cell type {SimpleRnn,GruRnn}')
+                    help='rnn cell type {SimpleRnn,GruRnn,FusedSimpleRnn,FusedGruRnn}.'
+                         ' Fused* are equivalent (same params) but faster')
+parser.add_argument('--shared-encoder', default='none',
+                    help='none, directions or all. directions runs the forward & backward'
+                         ' rnns (of --bidirectional) over each of s1 & s2 as one scan,'
+                         ' all runs every rnn as one scan; see stacked_rnns.py')
 parser.add_argument('--gru-initial-bias', default=2, type=int,
                     help='initial gru bias for r & z. higher => more like SimpleRnn')
 parser.add_argument('--swap-symmetric-examples', action='store_true',
@@ -68,6 +79,64 @@ parser.add_argument('--keep-prob', default=1.0, type=float,
 parser.add_argument('--parse-mode', default='BINARY_WITHOUT_PARENTHESIS',
                     help='what parse type to use; BINARY_WITHOUT_PARENTHESIS'
                          '| BINARY_WITH_PARENTHESIS | PARSE_WITH_OPEN_CLOSE_TAGS')
+parser.add_argument('--batch-size', default=1, type=int,
+                    help='number of egs per training step. egs are bucketed by length and'
+                         ' padded; cost (and so gradient) is the mean over the batch')
+parser.add_argument('--batch-tokens', default=None, type=int,
+                    help='if set, training batches are sized by this budget of (padded)'
+                         ' tokens, rather than by --batch-size egs, so steps take a'
+                         ' similar time whatever the lengths of their egs')
+parser.add_argument('--max-seq-len', default=None, type=int,
+                    help='if set, train sentences longer than this many tokens are handled'
+                         ' as per --max-seq-len-policy. dev sentences are truncated')
+parser.add_argument('--max-seq-len-policy', default='truncate',
+                    help='truncate, skip or split; see util.MAX_SEQ_LEN_POLICIES. split'
+                         ' gives window pairs the whole pair\'s label, which is often'
+                         ' wrong for fragments; not recommended')
+parser.add_argument('--stream-train', action='store_true',
+                    help='stream training egs from --train-set each epoch rather than'
+                         ' loading them all into memory. if no --vocab-file is given'
+                         ' the vocab is built with an initial pass over --train-set')
+parser.add_argument('--shuffle-buffer-size', default=100000, type=int,
+                    help='number of egs buffered for shuffling with --stream-train')
+parser.add_argument('--checkpoint-file',
+                    help='if set, periodically save params, optimiser & rng state and'
+                         ' training progress to this npz')
+parser.add_argument('--checkpoint-freq', default=100000, type=int,
+                    help='frequency (in num examples trained) to write --checkpoint-file')
+parser.add_argument('--resume-from',
+                    help='checkpoint npz to resume training from. other opts must match'
+                         ' those of the checkpointed run')
+parser.add_argument('--compiled-cache-dir',
+                    help='if set, cache compiled train & test fns here, keyed by the opts'
+                         ' that affect the graph (see GRAPH_OPTS), for reuse by later'
+                         ' runs')
+parser.add_argument('--load-data-only', action='store_true',
+                    help='exit after loading train & dev; eg to populate --data-cache-dir.'
+                         ' with --stream-train this writes the train cache that is then'
+                         ' streamed')
+parser.add_argument('--loader-workers', default=1, type=int,
+                    help='number of processes to use for tokenising train/dev data')
+parser.add_argument('--dev-batch-size', default=128, type=int,
+                    help='number of egs per batch when evaluating dev set')
+parser.add_argument('--bucket-factor', default=20, type=int,
+                    help='egs are sorted by length within buckets of batch_size *'
+                         ' bucket_factor egs (or batch_tokens * bucket_factor tokens)'
+                         ' before being sliced into batches')
+parser.add_argument('--data-cache-dir',
+                    help='if set, cache tokenised train/dev data here and reuse it'
+                         ' on subsequent runs')
+parser.add_argument('--data-parallel-workers', default=1, type=int,
+                    help='number of processes to train with; each step every process'
+                         ' computes gradients for its own batch and all apply the'
+                         ' average. 1 => single process training')
+parser.add_argument('--hogwild-workers', default=1, type=int,
+                    help='number of processes to train with asynchronously; all'
+                         ' processes update one copy of the params, in shared memory,'
+                         ' without locking. 1 => single process training')
+parser.add_argument('--metrics-file',
+                    help='if set, append the throughput, timing & memory stats of each'
+                         ' STATS line to this file, as json lines')
 opts = parser.parse_args()
 print >>sys.stderr, opts
 
@@ -80,8 +149,22 @@ if opts.vocab_file and not opts.tied_embeddings:
 
 # sanity check other opts
 assert opts.keep_prob >= 0.0 and opts.keep_prob <= 1.0
-
-NUM_LABELS = 3
+assert opts.batch_size >= 1
+assert opts.batch_tokens is None or opts.batch_tokens >= 1
+if opts.max_seq_len_policy not in util.MAX_SEQ_LEN_POLICIES:
+    raise Exception("unknown max seq len policy [%s]" % opts.max_seq_len_policy)
+if opts.max_seq_len is not None and opts.max_seq_len_policy == 'split':
+    print >>sys.stderr, "warning: --max-seq-len-policy=split labels sentence fragments" \
+        " with the label of the whole pair; expect noisy train egs"
+assert opts.data_parallel_workers >= 1
+assert opts.hogwild_workers >= 1
+if opts.data_parallel_workers > 1 and opts.compiled_cache_dir:
+    raise Exception("--compiled-cache-dir not supported with --data-parallel-workers")
+if opts.hogwild_workers > 1:
+    if opts.data_parallel_workers > 1:
+        raise Exception("can't set both --hogwild-workers & --data-parallel-workers")
+    if opts.stream_train:
+        raise Exception("--hogwild-workers not supported with --stream-train")
 
 def log(s):
     print >>sys.stderr, util.dts(), s
@@ -89,142 +172,357 @@ def log(s):
 # slurp training data, including converting of tokens -> ids
 # if opts.vocab_file set read from that file, otherwise populate lookups as used
 vocab = Vocab(opts.vocab_file)
-train_x, train_y, train_stats = util.load_data(opts.train_set, vocab,
-                                               update_vocab=True,
+resume_checkpoint = None
+if opts.resume_from:
+    # vocab has to be restored before loading data so ids match the checkpoint
+    resume_checkpoint = checkpoint.Checkpoint(opts.resume_from)
+    resume_checkpoint.restore_vocab(vocab)
+if opts.stream_train:
+    # when streaming, only the vocab is built up front
+    if opts.vocab_file is None:
+        train_stats = util.build_vocab(opts.train_set, vocab,
+                                       max_egs=int(opts.num_from_train),
+                                       parse_mode=opts.parse_mode)
+        log("train_stats (streaming) %s" % train_stats)
+    if opts.load_data_only and opts.data_cache_dir:
+        # populate the cache that training will stream from; see util.stream_examples
+        cache_stats = util.cache_for_streaming(opts.train_set, vocab, opts.data_cache_dir,
                                                max_egs=int(opts.num_from_train),
-                                               parse_mode=opts.parse_mode)
-log("train_stats %s %s" % (len(train_x), train_stats))
-dev_x, dev_y, dev_stats = util.load_data(opts.dev_set, vocab,
-                                         update_vocab=False,
-                                         max_egs=int(opts.num_from_dev),
-                                         parse_mode=opts.parse_mode)
-log("dev_stats %s %s" % (len(dev_x), dev_stats))
-
-# input/output example vars
-s1_idxs = T.ivector('s1')  # sequence for sentence one
-s2_idxs = T.ivector('s2')  # sequence for sentence two
-actual_y = T.ivector('y')  # single for sentence pair label; 0, 1 or 2
+                                               parse_mode=opts.parse_mode,
+                                               n_workers=opts.loader_workers,
+                                               max_seq_len=opts.max_seq_len,
+                                               max_seq_len_policy=opts.max_seq_len_policy)
+        log("cached train for streaming %s" % cache_stats)
+else:
+    train, train_stats = util.load_corpus(opts.train_set, vocab,
+                                        update_vocab=True,
+                                        max_egs=int(opts.num_from_train),
+                                        parse_mode=opts.parse_mode,
+                                        cache_dir=opts.data_cache_dir,
+                                        n_workers=opts.loader_workers,
+                                        max_seq_len=opts.max_seq_len,
+                                        max_seq_len_policy=opts.max_seq_len_policy)
+    log("train_stats %s %s" % (len(train), train_stats))
+    if len(train) == 0:
+        raise Exception("no train egs left in [%s]; --max-seq-len-policy=%s with"
+                        " --max-seq-len=%s?" % (opts.train_set, opts.max_seq_len_policy,
+                                                opts.max_seq_len))
+# dev is only ever truncated (whatever --max-seq-len-policy) so it keeps the same egs,
+# and labels, and dev_acc stays comparable across runs
+dev, dev_stats = util.load_corpus(opts.dev_set, vocab,
+                                update_vocab=False,
+                                max_egs=int(opts.num_from_dev),
+                                parse_mode=opts.parse_mode,
+                                cache_dir=opts.data_cache_dir,
+                                n_workers=opts.loader_workers,
+                                max_seq_len=opts.max_seq_len,
+                                max_seq_len_policy='truncate')
+log("dev_stats %s %s" % (len(dev), dev_stats))
+if len(dev) == 0:
+    raise Exception("no dev egs in [%s]" % opts.dev_set)
+if opts.load_data_only:
+    sys.exit(0)
+
+# input/output example vars. the model has inputs for the (padded, masked) batches of
+# sequences for s1 & s2; see BaselineModel
+actual_y = T.ivector('y')  # label per sentence pair; 0, 1 or 2
 
 # dropout keep prob for post concat, pre MLP
 apply_dropout = T.bscalar('apply_dropout')  # dropout.{APPLY_DROPOUT|NO_DROPOUT}
-keep_prob = theano.shared(opts.keep_prob)  # recall 1.0 => noop
-keep_prob = T.cast(keep_prob, 'float32')  # shared weirdity, how to set in init (?)
-
-# keep track of different "layers" that handle their own gradients.
-# includes rnns, final concat & softmax and, potentially, special handling for
-# tied embeddings
-layers = []
-
-# decide set of sequence idxs we'll be processing. there will always the two
-# for the forward passes over s1 and s2 and, optionally, two more for the
-# reverse pass over s1 & s2 in the bidirectional case.
-idxs = [s1_idxs, s2_idxs]
-names = ["s1f", "s2f"]
-if opts.bidirectional:
-    idxs.extend([s1_idxs[::-1], s2_idxs[::-1]])
-    names.extend(["s1b", "s2b"])
-
-# build embedding layers. we know we will build an rnn for each sequence idx but depending
-# on whether we are using tied embeddings there will be either 1 global embedding matrix
-# (whose gradients are managed by TiedEmbeddings) or there will be 1 embeddings matrix per
-# rnn (whose gradients are managed by the rnn itself). we build one embedding obj per
-# element in idxs
-embeddings = None
-def build_embedding(idxs=None, sequence_embeddings=None):
-    return Embeddings(vocab.size(), opts.embedding_dim, idxs=idxs,
-                      sequence_embeddings=sequence_embeddings)
-if opts.tied_embeddings:
-    # make shared tied embeddings helper
-    tied_embeddings = TiedEmbeddings(vocab.size(), opts.embedding_dim,
-                                     opts.initial_embeddings)
-    layers.append(tied_embeddings)
-    # embeddings rnn per idx slices. rnn don't maintain their own embeddings in this case.
-    slices = tied_embeddings.slices_for_idxs(idxs)
-    embeddings = [build_embedding(sequence_embeddings=s) for s in slices]
-else:
-    # no tied embeddings; each rnn handles it's own weights
-    embeddings = [build_embedding(idxs=i) for i in idxs]
-layers.extend(embeddings)
-
-# build rnns over these embedded sequences
-h0 = theano.shared(np.zeros(opts.hidden_dim, dtype='float32'), name='h0', borrow=True)
-rnn_fn = globals().get(opts.rnn_type)
-if rnn_fn is None:
-    raise Exception("unknown rnn type [%s]" % opts.rnn_type)
+keep_prob = theano.shared(np.float32(opts.keep_prob), name='keep_prob')  # 1.0 => noop
+
+# learning opts for the update fns (see updates.py) & l2 cost. these, and keep_prob, are
+# what sweeps vary so they're shared scalars, set from opts, rather than constants baked
+# into the compiled fns; a cached fn (see --compiled-cache-dir) is then reused whatever
+# their values.
+learning_opts = argparse.Namespace(**dict(
+    (opt, theano.shared(np.float32(getattr(opts, opt)), name=opt))
+    for opt in ['learning_rate', 'momentum', 'l2_penalty']))
+
 update_fn = globals().get(opts.update_fn)
 if update_fn is None:
     raise Exception("unknown update function [%s]" % opts.update_fn)
-rnns = [rnn_fn("", opts.embedding_dim, opts.hidden_dim, opts, update_fn, h0,
-               inputs=e.embeddings()) for e in embeddings]
-
-# concat final states of rnns, do a final linear combo and apply softmax for prediction.
-final_rnn_states = [rnn.final_state() for rnn in rnns]
-concat_with_softmax = ConcatWithSoftmax(final_rnn_states, NUM_LABELS, opts.hidden_dim,
-                                        update_fn, apply_dropout, keep_prob)
-layers.append(concat_with_softmax)
-prob_y, pred_y = concat_with_softmax.prob_pred()
-
-# calc l2_sum across all params
-params = [l.params_for_l2_penalty() for l in layers]
-l2_sum = sum([(p**2).sum() for p in itertools.chain(*params)])
-
-# calculate cost ; xent + l2 penalty
-cross_entropy_cost = T.mean(T.nnet.categorical_crossentropy(prob_y, actual_y))
-l2_cost = opts.l2_penalty * l2_sum
-total_cost = cross_entropy_cost + l2_cost
-
-# calculate updates
+
+# build rnns over s1 & s2, concat final states and MLP to softmax for prediction.
+model = BaselineModel(opts, vocab.size(), update_fn, apply_dropout, keep_prob,
+                      initial_embeddings_file=opts.initial_embeddings)
+layers = model.layers
+prob_y, pred_y = model.prob_y, model.pred_y
+
+# calc l2 sums; of the dense params and, per eg, of the embedding rows of its tokens
+dense_l2, per_eg_embedding_l2 = util.l2_sums(layers, actual_y.shape[0])
+
+# calculate cost ; xent + l2 penalty. each eg's cost has just its own embedding rows' l2
+# (as when training & dev were one eg at a time) so dev_cost doesn't depend on
+# --dev-batch-size. the training cost is the mean over the batch; so the embedding l2 is
+# divided by the batch size, and a row's decay relative to its data gradient is the same
+# whatever --batch-size, while the dense l2 is applied once per step.
+per_eg_cross_entropy_cost = T.nnet.categorical_crossentropy(prob_y, actual_y)
+per_eg_total_cost = per_eg_cross_entropy_cost + \
+    learning_opts.l2_penalty * (dense_l2 + per_eg_embedding_l2)
+total_cost = T.mean(per_eg_total_cost)
+
+# calculate updates. for data parallel training the gradient & update fns are built
+# (layer by layer, as here) by DataParallelTrainer instead.
 updates = []
-for layer in layers:
-    updates.extend(layer.updates_wrt_cost(total_cost, opts))
+if opts.data_parallel_workers == 1:
+    for layer in layers:
+        updates.extend(layer.updates_wrt_cost(total_cost, learning_opts))
+
+# opts that are baked into the compiled train_fn & test_fn. (others, eg
+# gru_initial_bias, only affect initial values of shared variables, and learning_opts &
+# keep_prob are shared scalars.)
+GRAPH_OPTS = ['rnn_type', 'bidirectional', 'shared_encoder', 'tied_embeddings',
+              'hidden_dim', 'embedding_dim', 'update_fn', 'embedding_update_fn']
+
+# all shared variables whose values change (run to run or step to step); params,
+# optimiser state, dropout rngs and the hyperparameters. a cached fn's shared variables
+# share storage with these (and so take their values); see function_cache.share_storage
+shared_variables = util.SHARED_VARIABLES + \
+    [rng for rng, _update in dropout.RND_STREAM.state_updates] + \
+    [keep_prob, learning_opts.learning_rate, learning_opts.momentum,
+     learning_opts.l2_penalty]
 
 log("compiling")
-train_fn = theano.function(inputs=[apply_dropout, s1_idxs, s2_idxs, actual_y],
-                           outputs=[total_cost],
-                           updates=updates)
-test_fn = theano.function(inputs=[apply_dropout, s1_idxs, s2_idxs, actual_y],
-                          outputs=[pred_y, total_cost])
+compile_start_time = time.time()
+fn_inputs = [apply_dropout] + model.inputs() + [actual_y]
+compile_cache = None
+cached = None
+if opts.compiled_cache_dir:
+    compiled_config = {"fn": "nn_baseline", "vocab_size": vocab.size()}
+    for opt in GRAPH_OPTS:
+        compiled_config[opt] = getattr(opts, opt)
+    cached = function_cache.load(opts.compiled_cache_dir, compiled_config)
+    compile_cache = "miss" if cached is None else "hit"
+trainer = None
+if opts.data_parallel_workers > 1:
+    train_fn = None
+    # distinct embedding rows a batch touches are at most its (padded) tokens
+    if opts.batch_tokens is not None:
+        max_rows = opts.batch_tokens
+    elif opts.max_seq_len is not None:
+        max_rows = opts.batch_size * 2 * opts.max_seq_len
+    else:
+        max_rows = data_parallel.DEFAULT_MAX_ROWS
+    trainer = DataParallelTrainer(layers, total_cost, fn_inputs, learning_opts,
+                                  opts.data_parallel_workers, max_rows)
+    test_fn = theano.function(inputs=fn_inputs,
+                              outputs=[pred_y, per_eg_total_cost])
+elif cached is None:
+    train_fn = theano.function(inputs=fn_inputs,
+                               outputs=[total_cost],
+                               updates=updates)
+    test_fn = theano.function(inputs=fn_inputs,
+                              outputs=[pred_y, per_eg_total_cost])
+    if opts.compiled_cache_dir:
+        function_cache.save(opts.compiled_cache_dir, compiled_config,
+                            (shared_variables, train_fn, test_fn))
+else:
+    cached_shared_variables, train_fn, test_fn = cached
+    function_cache.share_storage(cached_shared_variables, shared_variables)
+compile_time = time.time() - compile_start_time
+log("compiled in %.1f sec (cache %s)" % (compile_time, compile_cache))
+
+# padded, masked args (after apply_dropout) for train_fn / test_fn for a batch of egs
+def batch_args(s1s, s2s, ys):
+    s1, s1_m = util.pad_batch(s1s)
+    s2, s2_m = util.pad_batch(s2s)
+    return [s1, s1_m, s2, s2_m, np.asarray(ys, dtype='int32')]
+
+# dev set is fixed so pad it once, in length sorted batches, up front
+dev_batches = []
+for idxs in dev.length_sorted_batches(opts.dev_batch_size):
+    dev_batches.append(batch_args(*dev.batch(idxs)))
+dev_actuals = np.concatenate([args[-1] for args in dev_batches])
 
 def stats_from_dev_set(stats):
-    actuals = []
-    predicteds  = []
-    for (s1, s2), y in zip(dev_x, dev_y):
-        pred_y, cost = test_fn(NO_DROPOUT, s1, s2, [y])
-        actuals.append(y)
+    predicteds = []
+    costs = []
+    for args in dev_batches:
+        pred_y, cost = test_fn(NO_DROPOUT, *args)
         predicteds.append(pred_y)
-        stats.record_dev_cost(cost)
-    dev_c = confusion_matrix(actuals, predicteds)
+        costs.append(cost)
+    stats.record_dev_costs(np.concatenate(costs))
+    dev_c = util.confusion_matrix(dev_actuals, np.concatenate(predicteds), NUM_LABELS)
     dev_accuracy = util.accuracy(dev_c)
     stats.set_dev_accuracy(dev_accuracy)
     print "dev confusion\n %s (%s)" % (dev_c, dev_accuracy)
 
 
+# batches, as lists of ((s1, s2), y), for one epoch of training. when not streaming
+# the idx batches for the epoch are kept in epoch_idx_batches for checkpointing and,
+# on resume, the epoch is picked up from the checkpointed idx batches.
+epoch_idx_batches = None
+def training_batches(resumed_idx_batches=None, n_batches_done=0):
+    global epoch_idx_batches
+    if opts.stream_train:
+        # no resuming mid epoch when streaming; the epoch is restarted
+        egs = util.stream_examples(opts.train_set, vocab,
+                                   max_egs=int(opts.num_from_train),
+                                   parse_mode=opts.parse_mode,
+                                   cache_dir=opts.data_cache_dir,
+                                   max_seq_len=opts.max_seq_len,
+                                   max_seq_len_policy=opts.max_seq_len_policy)
+        egs = util.shuffled(egs, opts.shuffle_buffer_size)
+        if opts.batch_tokens is not None:
+            return util.token_budget_stream_batches(egs, opts.batch_tokens,
+                                                    opts.bucket_factor)
+        return util.bucketed_stream_batches(egs, opts.batch_size, opts.bucket_factor)
+    if resumed_idx_batches is not None:
+        epoch_idx_batches = resumed_idx_batches
+    elif opts.batch_tokens is not None:
+        epoch_idx_batches = train.token_budget_batches(train.shuffled_idxs(),
+                                                       opts.batch_tokens,
+                                                       opts.bucket_factor)
+    else:
+        epoch_idx_batches = train.bucketed_batches(train.shuffled_idxs(), opts.batch_size,
+                                                   opts.bucket_factor)
+    return ([train[i] for i in idxs] for idxs in epoch_idx_batches[n_batches_done:])
+
+def save_checkpoint(epoch, n_batches_done):
+    progress = {"epoch": epoch, "n_batches_done": n_batches_done,
+                "n_egs_trained": stats.n_egs_trained,
+                "next_dev_run": next_dev_run, "next_checkpoint": next_checkpoint}
+    checkpoint.save(opts.checkpoint_file, vocab, opts, progress, epoch_idx_batches)
+    log("saved checkpoint %s" % progress)
+
 log("training")
 epoch = 0
+n_batches_done = 0
+resumed_idx_batches = None
 training_early_stop_time = opts.max_run_time_sec + time.time()
-stats = Stats(os.path.basename(__file__), opts)
-egs = zip(train_x, train_y)
-while epoch != opts.num_epochs:
-    random.shuffle(egs)
-    for (s1, s2), y in egs:
+stats = Stats(os.path.basename(__file__), opts, metrics_file=opts.metrics_file)
+stats.set_compile_stats(compile_cache, compile_time)
+if opts.max_seq_len is not None:
+    if not opts.stream_train:
+        stats.set_tokens_dropped_frac("train", util.tokens_dropped_frac(train_stats))
+    stats.set_tokens_dropped_frac("dev", util.tokens_dropped_frac(dev_stats))
+next_dev_run = opts.dev_run_freq
+next_checkpoint = opts.checkpoint_freq
+if resume_checkpoint is not None:
+    resume_checkpoint.restore_model()
+    progress = resume_checkpoint.progress
+    epoch = progress["epoch"]
+    stats.n_egs_trained = progress["n_egs_trained"]
+    next_dev_run = progress["next_dev_run"]
+    next_checkpoint = progress["next_checkpoint"]
+    if not opts.stream_train:
+        n_batches_done = progress["n_batches_done"]
+        resumed_idx_batches = resume_checkpoint.epoch_batches()
+    log("resumed from %s %s" % (opts.resume_from, progress))
+if trainer is not None:
+    # workers are forked with the (possibly restored) params
+    trainer.start()
+
+# args for train_fn for a batch of training egs
+def training_batch_args(batch):
+    s1s, s2s, ys = [], [], []
+    for (s1, s2), y in batch:
         # we may choose to swap s1/s2 for symmetric examples; i.e. contradictions
         # and neutral statements.
         flip_s1_s2 = opts.swap_symmetric_examples and util.coin_flip() and \
             util.symmetric_example(y)
         if flip_s1_s2:
-            cost, = train_fn(APPLY_DROPOUT, s2, s1, [y])
+            s1, s2 = s2, s1
+        s1s.append(s1)
+        s2s.append(s2)
+        ys.append(y)
+    return [APPLY_DROPOUT] + batch_args(s1s, s2s, ys)
+
+# run dev set and/or checkpoint if they're due (or if training is to stop early).
+# returns True if training should stop.
+def evaluate_and_checkpoint(epoch, n_batches_done):
+    global next_dev_run, next_checkpoint
+    early_stop = False
+    if opts.max_run_time_sec != -1 and time.time() > training_early_stop_time:
+        early_stop = True
+    if stats.n_egs_trained >= next_dev_run or early_stop:
+        next_dev_run += opts.dev_run_freq
+        dev_start_time = time.time()
+        stats_from_dev_set(stats)
+        stats.record_time("dev_eval", time.time() - dev_start_time)
+        if trainer is not None:
+            stats.set_throughput(trainer.throughput())
+            trainer.reset_throughput()
+        if opts.dump_norms:
+            stats.set_param_norms(util.norms(layers))
+        stats.flush_to_stdout(epoch)
+    if opts.checkpoint_file and (stats.n_egs_trained >= next_checkpoint or early_stop):
+        next_checkpoint += opts.checkpoint_freq
+        checkpoint_start_time = time.time()
+        save_checkpoint(epoch, n_batches_done)
+        stats.record_time("checkpoint", time.time() - checkpoint_start_time)
+    return early_stop
+
+# n (real) tokens and longest sequence length for train_fn args
+def n_tokens_and_seq_len(args):
+    _apply_dropout, s1, s1_mask, s2, s2_mask, _ys = args
+    return int(s1_mask.sum() + s2_mask.sum()), max(s1.shape[0], s2.shape[0])
+
+if opts.hogwild_workers > 1:
+    # params & optimiser state are moved to shared memory (after any restore) and each
+    # epoch is trained by workers forked from here. this process just monitors them.
+    shared_params = hogwild.SharedParams(util.SHARED_VARIABLES)
+    workers = hogwild.HogwildWorkers(opts.hogwild_workers)
+    def hogwild_step(idxs):
+        args = training_batch_args([train[i] for i in idxs])
+        cost, = shared_params.call(train_fn, *args)
+        n_tokens, _seq_len = n_tokens_and_seq_len(args)
+        return cost, n_tokens
+    while epoch != opts.num_epochs:
+        training_batches(resumed_idx_batches, n_batches_done)  # sets epoch_idx_batches
+        epoch_start_batch = n_batches_done
+        workers.start(epoch_idx_batches[epoch_start_batch:], hogwild_step)
+        n_batches_seen, n_egs_seen, n_tokens_seen, cost_sum_seen = 0, 0, 0, 0.
+        finished = False
+        while not finished:
+            # workers keep training while this process runs the dev set, so for
+            # hogwild egs_per_sec (wall clock) is the throughput to go by. per step
+            # latencies aren't recorded.
+            wait_start_time = time.time()
+            finished = workers.join(timeout=hogwild.MONITOR_POLL_SEC)
+            n_batches, n_egs, n_tokens, cost_sum, n_done_in_order = workers.progress()
+            if n_batches > n_batches_seen:
+                stats.record_training_cost((cost_sum - cost_sum_seen) /
+                                           (n_batches - n_batches_seen),
+                                           n_egs=n_egs - n_egs_seen)
+                n_batches_seen, n_egs_seen, cost_sum_seen = n_batches, n_egs, cost_sum
+            stats.record_training_step(n_tokens - n_tokens_seen, None,
+                                       time.time() - wait_start_time)
+            n_tokens_seen = n_tokens
+            n_batches_done = epoch_start_batch + n_done_in_order
+            if finished:
+                n_batches_done = len(epoch_idx_batches)
+            if evaluate_and_checkpoint(epoch, n_batches_done):
+                workers.terminate()
+                exit(0)
+        epoch += 1
+        n_batches_done = 0
+        resumed_idx_batches = None
+
+while epoch != opts.num_epochs:
+    # one batch per data parallel worker per step
+    data_prep_start_time = time.time()
+    for batches in util.grouped(training_batches(resumed_idx_batches, n_batches_done),
+                                opts.data_parallel_workers):
+        args = [training_batch_args(batch) for batch in batches]
+        step_start_time = time.time()
+        stats.record_time("data_prep", step_start_time - data_prep_start_time)
+        if trainer is None:
+            cost, = train_fn(*args[0])
         else:
-            cost, = train_fn(APPLY_DROPOUT, s1, s2, [y])
-
-        stats.record_training_cost(cost)
-        early_stop = False
-        if opts.max_run_time_sec != -1 and time.time() > training_early_stop_time:
-            early_stop = True
-        if stats.n_egs_trained % opts.dev_run_freq == 0 or early_stop:
-            stats_from_dev_set(stats)
-            if opts.dump_norms:
-                stats.set_param_norms(util.norms(layers))
-            stats.flush_to_stdout(epoch)
-        if early_stop:
+            cost = trainer.step(args)
+        step_time = time.time() - step_start_time
+
+        tokens_and_seq_lens = [n_tokens_and_seq_len(a) for a in args]
+        stats.record_training_step(sum(n for n, _seq_len in tokens_and_seq_lens),
+                                   max(seq_len for _n, seq_len in tokens_and_seq_lens),
+                                   step_time)
+        stats.record_training_cost(cost, n_egs=sum(len(batch) for batch in batches))
+        n_batches_done += len(batches)
+        if evaluate_and_checkpoint(epoch, n_batches_done):
             exit(0)
+        data_prep_start_time = time.time()
     epoch += 1
+    n_batches_done = 0
+    resumed_idx_batches = None
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# see attention_model.AttentionModel for the graph & seq2seq_training for training
+from attention_model import AttentionModel
+import seq2seq_training
+import sys
+
+parser = seq2seq_training.argument_parser(
+    checkpoint_help='for scoring with predict_attention.py')
+opts = parser.parse_args()
+print >>sys.stderr, opts
+seq2seq_training.run(AttentionModel, opts, __file__)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# forward pass of the nn_baseline (see BaselineModel) or nn_seq2seq (see Seq2SeqModel)
+# model in plain numpy from weights exported by export_model.py; so scoring needs neither
+# theano nor a compile step. each
+# cell mirrors its theano counterpart and, like there, works on time major padded
+# batches, (time, batch) idxs with a mask, where padded steps carry the previous state.
+# usage as per predict.py but with --model (an export) instead of --checkpoint.
+import argparse
+import json
+import numpy as np
+import sys
+import time
+import tokenise_parse
+from vocab import Vocab
+
+# as util.LABELS; util isn't imported since it requires theano
+LABELS = ['contradiction', 'neutral', 'entailment']
+
+# as util.pad_batch
+def pad_batch(seqs):
+    max_len = max(len(s) for s in seqs)
+    idxs = np.zeros((max_len, len(seqs)), dtype='int32')
+    mask = np.zeros((max_len, len(seqs)), dtype='float32')
+    for i, s in enumerate(seqs):
+        idxs[:len(s), i] = s
+        mask[:len(s), i] = 1.0
+    return idxs, mask
+
+def sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))  # no overflow for large -ve x
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+# rnns take (time, batch, input_dim) inputs and a (time, batch) mask. the input
+# projections for all timesteps are done up front as one matmul so the loop over time
+# is just the recurrent matmuls. context, if given, is (batch, context_dim) and constant
+# across time (see GruRnn).
+class Rnn(object):
+    def all_states(self, inputs, mask, context=None):
+        projections = self.input_projections(inputs, context)
+        h_t = np.tile(self.h0, (inputs.shape[1], 1))
+        states = np.empty((inputs.shape[0],) + h_t.shape, dtype=h_t.dtype)
+        for t in xrange(inputs.shape[0]):
+            m = mask[t][:, None]
+            h_t = m * self.step(projections[t], h_t) + (1 - m) * h_t
+            states[t] = h_t
+        return states
+
+    def final_state(self, inputs, mask, context=None):
+        return self.all_states(inputs, mask, context)[-1]
+
+class SimpleRnn(Rnn):
+    def __init__(self, weights, prefix, h0):
+        self.Uh, self.Wh, self.bh = [weights[prefix + p] for p in ['Uh', 'Wh', 'bh']]
+        self.h0 = h0
+
+    def input_projections(self, inputs, context):
+        assert context is None, "SimpleRnn has no context"
+        return np.dot(inputs, self.Wh.T) + self.bh
+
+    def step(self, projection, h_t_minus_1):
+        return np.tanh(np.dot(h_t_minus_1, self.Uh.T) + projection)
+
+class GruRnn(Rnn):
+    def __init__(self, weights, prefix, h0):
+        Uh, Wh, bh, Ur, Wr, br, Uz, Wz, bz = \
+            [weights[prefix + p] for p in ['Uh', 'Wh', 'bh', 'Ur', 'Wr', 'br',
+                                           'Uz', 'Wz', 'bz']]
+        self.hidden_dim = Uh.shape[0]
+        self.Uh = Uh
+        self.U_rz = np.concatenate([Ur, Uz])
+        self.W = np.concatenate([Wr, Wz, Wh])
+        self.b = np.concatenate([br, bz, bh])
+        self.Wch = weights.get(prefix + 'Wch')  # only for a gru with context
+        self.h0 = h0
+
+    # [reset gate, carry gate, candidate state] projections. the context only feeds the
+    # candidate state
+    def input_projections(self, inputs, context):
+        projections = np.dot(inputs, self.W.T) + self.b
+        if context is not None:
+            projections[:, :, 2*self.hidden_dim:] += np.dot(context, self.Wch.T)
+        return projections
+
+    def step(self, projection, h_t_minus_1):
+        h = self.hidden_dim
+        rz = sigmoid(np.dot(h_t_minus_1, self.U_rz.T) + projection[:, :2*h])
+        r, z = rz[:, :h], rz[:, h:]
+        h_t_candidate = np.tanh(r * np.dot(h_t_minus_1, self.Uh.T) + projection[:, 2*h:])
+        return (1 - z) * h_t_minus_1 + z * h_t_candidate
+
+RNNS = {'SimpleRnn': SimpleRnn, 'FusedSimpleRnn': SimpleRnn,
+        'GruRnn': GruRnn, 'FusedGruRnn': GruRnn}
+
+# as BidirectionalGruRnn; the forward & backwards grus, and their embeddings (Wx), are
+# weights prefixed f_<name>. & b_<name>. takes (time, batch) idxs & mask.
+class BidirectionalGruRnn(object):
+    def __init__(self, weights, name, h0):
+        self.forward_gru = GruRnn(weights, "f_%s." % name, h0)
+        self.forward_embeddings = weights["f_%s.Wx" % name]
+        self.backwards_gru = GruRnn(weights, "b_%s." % name, h0)
+        self.backwards_embeddings = weights["b_%s.Wx" % name]
+
+    # (time, batch, 2*hidden); the backwards states are flipped back into time order
+    def all_states(self, idxs, mask):
+        forwards = self.forward_gru.all_states(self.forward_embeddings[idxs], mask)
+        backwards = self.backwards_gru.all_states(self.backwards_embeddings[idxs[::-1]],
+                                                  mask[::-1])
+        return np.concatenate([forwards, backwards[::-1]], axis=2)
+
+    # (batch, 2*hidden); [final forward state, final backwards state]
+    def final_states(self, idxs, mask):
+        return np.concatenate([
+            self.forward_gru.final_state(self.forward_embeddings[idxs], mask),
+            self.backwards_gru.final_state(self.backwards_embeddings[idxs[::-1]],
+                                           mask[::-1])], axis=1)
+
+class ConcatWithSoftmax(object):
+    def __init__(self, weights, prefix):
+        self.Wih, self.bh, self.Whs, self.bs = \
+            [weights[prefix + p] for p in ['Wih', 'bh', 'Whs', 'bs']]
+
+    def prob_pred(self, inp):
+        inp = np.concatenate(inp, axis=1)
+        hidden = sigmoid(np.dot(inp, self.Wih) + self.bh)
+        prob_y = softmax(np.dot(hidden, self.Whs) + self.bs)
+        return prob_y, np.argmax(prob_y, axis=1)
+
+class BaselineModel(object):
+    def __init__(self, weights, opts):
+        self.bidirectional = opts['bidirectional']
+        n_rnns = 4 if self.bidirectional else 2
+        if opts['tied_embeddings']:
+            self.embeddings = [weights["tied_embeddings"]] * n_rnns
+        else:
+            self.embeddings = [weights["embeddings_%d" % i] for i in xrange(n_rnns)]
+        if opts['rnn_type'] not in RNNS:
+            raise Exception("unknown rnn type [%s]" % opts['rnn_type'])
+        rnn_cls = RNNS[opts['rnn_type']]
+        self.rnns = [rnn_cls(weights, "rnn_%d." % i, weights["h0"])
+                     for i in xrange(n_rnns)]
+        self.concat_with_softmax = ConcatWithSoftmax(weights, "mlp.")
+
+    # label probabilities, (batch, NUM_LABELS), for padded batches; see pad_batch
+    def prob_y(self, s1, s1_mask, s2, s2_mask):
+        idxs = [s1, s2]
+        masks = [s1_mask, s2_mask]
+        if self.bidirectional:
+            idxs.extend([s1[::-1], s2[::-1]])
+            masks.extend([s1_mask[::-1], s2_mask[::-1]])
+        final_states = [rnn.final_state(embeddings[i], mask)
+                        for rnn, embeddings, i, mask
+                        in zip(self.rnns, self.embeddings, idxs, masks)]
+        prob_y, _pred_y = self.concat_with_softmax.prob_pred(final_states)
+        return prob_y
+
+class Seq2SeqModel(object):
+    def __init__(self, weights, opts):
+        self.s1_bidir = BidirectionalGruRnn(weights, "s1_bidir", weights["h0"])
+        self.s2_bidir = BidirectionalGruRnn(weights, "s2_bidir", weights["h0"])
+        self.s2_decoder = GruRnn(weights, "s2_decoder.", weights["h0"])
+        self.concat_with_softmax = ConcatWithSoftmax(weights, "mlp.")
+
+    # as BaselineModel.prob_y
+    def prob_y(self, s1, s1_mask, s2, s2_mask):
+        s2_states = self.s2_bidir.all_states(s2, s2_mask)
+        decoder_state = self.s2_decoder.final_state(
+            s2_states, s2_mask, context=self.s1_bidir.final_states(s1, s1_mask))
+        prob_y, _pred_y = self.concat_with_softmax.prob_pred([decoder_state])
+        return prob_y
+
+# model classes by the model_type opt of an export
+MODELS = {'baseline': BaselineModel, 'seq2seq': Seq2SeqModel}
+
+# write an export; weights as per BaselineModel.weights() (or Seq2SeqModel.weights())
+# along with the opts needed to rebuild the model and tokenise input, and the vocab.
+def save(path, weights, opts, vocab):
+    meta = {"opts": opts, "vocab": vocab.items()}
+    with open(path, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **weights)
+
+# same interface as predict.Predictor
+class Predictor(object):
+    def __init__(self, model_file, batch_size=128):
+        self.batch_size = batch_size
+        arrays = np.load(model_file)
+        meta = json.loads(arrays["meta"][()])
+        self.opts = meta["opts"]
+        self.vocab = Vocab()
+        for idx, token in meta["vocab"]:
+            assert self.vocab.id_for_token(token) == idx, \
+                "vocab mismatch for [%s]; expected id %s" % (token, idx)
+        weights = dict((k, arrays[k]) for k in arrays.files if k != "meta")
+        model_type = self.opts.get('model_type', 'baseline')
+        if model_type not in MODELS:
+            raise Exception("unknown model type [%s]" % model_type)
+        self.model = MODELS[model_type](weights, self.opts)
+
+    def ids_for(self, eg):
+        parse_mode = self.opts['parse_mode']
+        return [self.vocab.ids_for_tokens(tokenise_parse.tokens_for(eg, i, parse_mode),
+                                          update=False)
+                for i in [1, 2]]
+
+    def probs(self, s1s, s2s):
+        lengths = [max(len(s1), len(s2)) for s1, s2 in zip(s1s, s2s)]
+        order = np.argsort(lengths, kind='mergesort')
+        probs = np.empty((len(s1s), len(LABELS)), dtype='float32')
+        for start in xrange(0, len(order), self.batch_size):
+            idxs = order[start : start + self.batch_size]
+            s1, s1_mask = pad_batch([s1s[i] for i in idxs])
+            s2, s2_mask = pad_batch([s2s[i] for i in idxs])
+            probs[idxs] = self.model.prob_y(s1, s1_mask, s2, s2_mask)
+        return probs
+
+# as predict.chunks
+def chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='npz from export_model.py')
+    parser.add_argument('--input', default='-', help='jsonl to score. - => stdin')
+    parser.add_argument('--batch-size', default=128, type=int,
+                        help='number of pairs per forward pass')
+    opts = parser.parse_args()
+    print >>sys.stderr, opts
+
+    start_time = time.time()
+    predictor = Predictor(opts.model, opts.batch_size)
+    print >>sys.stderr, "ready in %.2f sec" % (time.time() - start_time)
+
+    n_scored = 0
+    scoring_start_time = time.time()
+    lines = sys.stdin if opts.input == '-' else open(opts.input, "r")
+    for chunk in chunks(lines, opts.batch_size * 20):
+        egs = [json.loads(line) for line in chunk]
+        s1s, s2s = zip(*[predictor.ids_for(eg) for eg in egs])
+        for eg, probs in zip(egs, predictor.probs(s1s, s2s)):
+            output = {"probs": dict(zip(LABELS, map(float, probs))),
+                      "pred": LABELS[np.argmax(probs)]}
+            if 'pairID' in eg:
+                output['pairID'] = eg['pairID']
+            print json.dumps(output)
+        n_scored += len(egs)
+    elapsed = time.time() - scoring_start_time
+    print >>sys.stderr, "scored %d pairs in %.1f sec (%.1f pairs/sec)" % \
+        (n_scored, elapsed, n_scored / max(elapsed, 1e-6))
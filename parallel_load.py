@@ -0,0 +1,83 @@
+from collections import Counter
+from corpus import Corpus
+import json
+import multiprocessing
+import numpy as np
+import os
+import util
+
+# parallel version of util.load_corpus. the dataset is split into byte ranges that are
+# json decoded & tokenised by a pool of workers. each worker maps tokens to shard local
+# ids (in order of first occurrence) so only distinct tokens are sent back. shards are
+# merged in file order, assigning vocab ids to each shard's local tokens in order, so
+# vocab ids (and so the corpus) are identical to the serial load.
+
+SHARDS_PER_WORKER = 4
+
+def _byte_ranges(dataset, n_shards):
+    size = os.path.getsize(dataset)
+    bounds = [size * i / n_shards for i in xrange(n_shards + 1)]
+    return zip(bounds[:-1], bounds[1:])
+
+# a line belongs to the shard whose byte range contains the line's first byte
+def _lines_in_range(dataset, start, end):
+    with open(dataset, "r") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # skip to the start of the first line starting in range
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+def _tokenise_shard(args):
+    dataset, start, end, parse_mode = args
+    local_token_id = {}
+    local_tokens = []  # local id -> token
+    ids, lengths, labels = [], [], []
+    n_ignored = 0
+    for line in _lines_in_range(dataset, start, end):
+        eg = json.loads(line)
+        l = util.label_for(eg)
+        if l is None:
+            n_ignored += 1
+            continue
+        for tokens in util.tokens_in_sentences(eg, parse_mode):
+            for token in tokens:
+                if token not in local_token_id:
+                    local_token_id[token] = len(local_tokens)
+                    local_tokens.append(token)
+                ids.append(local_token_id[token])
+            lengths.append(len(tokens))
+        labels.append(l)
+    return (local_tokens, np.asarray(ids, dtype='int32'),
+            np.asarray(lengths, dtype='int64'), np.asarray(labels, dtype='int8'),
+            n_ignored)
+
+def load_corpus(dataset, vocab, update_vocab, parse_mode, n_workers):
+    n_shards = n_workers * SHARDS_PER_WORKER
+    shards = [(dataset, start, end, parse_mode)
+              for start, end in _byte_ranges(dataset, n_shards)]
+    stats = Counter()
+    all_ids, all_lengths, all_labels = [], [], []
+    pool = multiprocessing.Pool(n_workers)
+    try:
+        # imap so merging overlaps with tokenising of later shards
+        for local_tokens, ids, lengths, labels, n_ignored in \
+                pool.imap(_tokenise_shard, shards):
+            local_to_vocab_id = np.asarray(vocab.ids_for_tokens(local_tokens,
+                                                                update_vocab),
+                                           dtype='int32')
+            all_ids.append(local_to_vocab_id[ids] if len(ids) else ids)
+            all_lengths.append(lengths)
+            all_labels.append(labels)
+            stats['n_ignored'] += n_ignored
+    finally:
+        pool.close()
+        pool.join()
+    tokens = np.concatenate(all_ids)
+    offsets = np.concatenate([[0], np.cumsum(np.concatenate(all_lengths))])
+    stats['n_tokens'] += len(tokens)
+    stats['n_unk'] += int(np.sum(tokens == vocab.UNK_ID))
+    return Corpus(tokens, offsets.astype('int64'), np.concatenate(all_labels)), stats
@@ -4,65 +4,92 @@
 # the provided 300d glove embeddings use the glove data. if it's not, generate a random
 # vector but scale it to the median length of the glove embeddings. "reserve" idx 0
 # in the matrix for UNK embedding.
+#
+# glove is either read from a --glove-store (see embedding_store.py), in which case the
+# glove vectors for the vocab are a single gather from the memory mapped store, or
+# streamed from the --glove-data text in chunks. if --glove-store is set but doesn't
+# exist yet it's converted from --glove-data first (a one off). without --vocab & --npy
+# just does the conversion.
 import argparse
+from embedding_store import EmbeddingStore, glove_chunks, utf8
 import numpy as np
+import os
 import sys
 from sklearn import random_projection
+from vocab import Vocab
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--vocab", required=True, help="reference vocab of non glove data; token \t idx")
-parser.add_argument("--glove-data", required=True, help="glove data. ssv, token, e_d1, e_d2, ...")
-parser.add_argument("--npy", required=True, help="npy output")
-parser.add_argument("--random-projection-dimensionality", default=None, type=float, 
+parser.add_argument("--vocab",
+                    help="reference vocab of non glove data; token \t idx tsv or binary .npz"
+                         " (see vocab.py)")
+parser.add_argument("--glove-data", help="glove data. ssv, token, e_d1, e_d2, ...")
+parser.add_argument("--glove-store",
+                    help="glove data converted by embedding_store.py. converted from"
+                         " --glove-data if it doesn't exist")
+parser.add_argument("--chunk-lines", default=10000, type=int,
+                    help="lines of --glove-data parsed at a time")
+parser.add_argument("--npy", help="npy output")
+parser.add_argument("--random-projection-dimensionality", default=None, type=float,
                     help="if set we randomly project the glove data to a smaller dimensionality")
 opts = parser.parse_args()
 
-# slurp vocab entries. assume idxs are valid, ie 1 < i < |v|, no dups, no gaps, etc
-# (recall reserving 0 for UNK)
-vocab = {}  # token => idx
-for line in open(opts.vocab, "r"):
-    token, idx = line.strip().split("\t")
-    assert idx != "0", "expecting to reserve 0 for UNK"
-    vocab[token] = int(idx)
-print "vocab has", len(vocab), "entries"
+if opts.glove_data is None and opts.glove_store is None:
+    raise Exception("need one of --glove-data or --glove-store")
+assert not ((opts.vocab is None) ^ (opts.npy is None)), "must set both --vocab & --npy"
 
-# alloc output after we see first glove embedding (so we know it's length)
-embeddings = None
-glove_dimensionality = None
+store = None
+if opts.glove_store is not None:
+    if os.path.exists(opts.glove_store):
+        store = EmbeddingStore.load(opts.glove_store)
+    elif opts.glove_data is not None:
+        store = EmbeddingStore.convert_glove(opts.glove_data, opts.glove_store,
+                                             opts.chunk_lines)
+    else:
+        raise Exception("no glove store at [%s] and no --glove-data to convert"
+                        % opts.glove_store)
+if opts.vocab is None:
+    exit(0)
 
-# pass over glove data copying data into embedddings array
-# for the cases where the token is in the reference vocab.
-tokens_requiring_random = set(vocab.keys())
-glove_embedding_norms = []
-for line in open(opts.glove_data, "r"):
-    cols = line.strip().split(" ")
-    token = cols[0]
-    if token in vocab:
-        glove_embedding = np.array(cols[1:], dtype=np.float32)
+# vocab entries; ids are 1 .. |v| (recall reserving 0 for UNK)
+vocab = Vocab(opts.vocab)
+tokens = vocab.tokens  # by idx
+print "vocab has", len(tokens) - 1, "entries"
+
+# glove embeddings (where there is one) for each idx
+if store is not None:
+    embeddings, in_glove = store.gather(tokens[1:])
+    embeddings = np.concatenate([np.zeros((1, store.dim()), dtype=np.float32),
+                                 embeddings])
+    in_glove = np.concatenate([[False], in_glove])
+else:
+    embeddings, in_glove = None, np.zeros(len(tokens), dtype=bool)
+    # glove tokens are utf-8 bytes; vocab tokens may be unicode
+    token_id = dict((utf8(token), idx) for idx, token in vocab.items())
+    for chunk_tokens, vectors in glove_chunks(opts.glove_data, opts.chunk_lines):
         if embeddings is None:
-            glove_dimensionality = len(glove_embedding)
-            embeddings = np.empty((len(vocab)+1, glove_dimensionality), dtype=np.float32)  # +1 for unk
-        assert len(glove_embedding) == glove_dimensionality, "differing dimensionality in glove data?"
-        embeddings[vocab[token]] = glove_embedding
-        tokens_requiring_random.remove(token)
-        glove_embedding_norms.append(np.linalg.norm(glove_embedding))
+            embeddings = np.zeros((len(tokens), vectors.shape[1]), dtype=np.float32)
+        assert vectors.shape[1] == embeddings.shape[1], "differing dimensionality in glove data?"
+        # (as for a store) the first occurrence of a token wins
+        idxs = np.asarray([token_id.get(token, Vocab.UNK_ID) for token in chunk_tokens],
+                          dtype='int64')
+        idxs, first = np.unique(idxs, return_index=True)
+        new = (idxs > 0) & ~in_glove[idxs]
+        embeddings[idxs[new]] = vectors[first[new]]
+        in_glove[idxs[new]] = True
+if not in_glove.any():
+    raise Exception("no vocab entries found in glove data")
 
 # given these embeddings we can calculate the median norm of the glove data
-median_glove_embedding_norm = np.median(glove_embedding_norms)
+median_glove_embedding_norm = np.median(np.linalg.norm(embeddings[in_glove], axis=1))
 
-print >>sys.stderr, "after passing over glove there are", len(tokens_requiring_random), \
+requiring_random = np.nonzero(~in_glove)[0]  # includes UNK
+print >>sys.stderr, "after passing over glove there are", len(requiring_random) - 1, \
     "tokens requiring a random alloc"
 
-# return a random embedding with the same norm as the glove data median norm
-def random_embedding():
-    random_embedding = np.random.randn(1, glove_dimensionality)
-    random_embedding /= np.linalg.norm(random_embedding)
-    random_embedding *= median_glove_embedding_norm
-    return random_embedding
-
-embeddings[0] = random_embedding()  # UNK
-for token in tokens_requiring_random:
-    embeddings[vocab[token]] = random_embedding()
+# random embeddings with the same norm as the glove data median norm
+random_embeddings = np.random.randn(len(requiring_random), embeddings.shape[1])
+random_embeddings /= np.linalg.norm(random_embeddings, axis=1, keepdims=True)
+embeddings[requiring_random] = random_embeddings * median_glove_embedding_norm
 
 # randomly project (if configured to do so)
 if opts.random_projection_dimensionality is not None:
@@ -71,6 +98,3 @@ if opts.random_projection_dimensionality is not None:
 
 # write embeddings npy to disk
 np.save(opts.npy, embeddings)
-
-
-
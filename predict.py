@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# score sentence pairs with a model checkpointed by nn_baseline.py (see
+# --checkpoint-file). input is snli style jsonl (gold_label not required), output is
+# jsonl of label probabilities & prediction per input line.
+import argparse
+from baseline_model import BaselineModel
+import checkpoint
+from encoding_cache import EncodingCache
+import function_cache
+import json
+import numpy as np
+import sys
+import time
+import theano
+import tokenise_parse
+import util
+from vocab import Vocab
+
+# opts that affect the inference graph; see BaselineModel
+MODEL_OPTS = ['bidirectional', 'tied_embeddings', 'embedding_dim', 'hidden_dim',
+              'rnn_type']
+
+class Predictor(object):
+    # if encoding_cache_mb is set product_probs can be used; sentence encodings are kept
+    # in an LRU cache (see EncodingCache) of at most that size.
+    def __init__(self, checkpoint_file, batch_size=128, compiled_cache_dir=None,
+                 encoding_cache_mb=None, product_batch_size=65536):
+        self.batch_size = batch_size
+        self.product_batch_size = product_batch_size
+        ckpt = checkpoint.Checkpoint(checkpoint_file)
+        self.opts = ckpt.opts
+        self.vocab = Vocab()
+        ckpt.restore_vocab(self.vocab)
+        product = encoding_cache_mb is not None
+
+        # compile forward graph only; or reuse a previously compiled one. with product
+        # also compile the per sentence encoding & product graphs.
+        config = {"fn": "predict_with_product" if product else "predict",
+                  "vocab_size": self.vocab.size()}
+        for opt in MODEL_OPTS:
+            config[opt] = getattr(self.opts, opt)
+        cached = None
+        if compiled_cache_dir is not None:
+            cached = function_cache.load(compiled_cache_dir, config)
+        if cached is None:
+            model_opts = self.opts
+            if product and getattr(self.opts, 'shared_encoder', 'none') == 'all':
+                # 'all' runs s1 & s2 in one scan so s1 can't be encoded on its own. the
+                # shared encoder doesn't change params (or results) so just don't use it
+                model_opts = argparse.Namespace(**dict(vars(self.opts),
+                                                       shared_encoder='none'))
+            n_shared_before = len(util.SHARED_VARIABLES)
+            model = BaselineModel(model_opts, self.vocab.size())
+            shared_variables = util.SHARED_VARIABLES[n_shared_before:]
+            cached = (shared_variables,
+                      theano.function(inputs=model.inputs(), outputs=model.prob_y))
+            if product:
+                cached += tuple(theano.function(inputs=inputs, outputs=outputs)
+                                for inputs, outputs in model.product_fns())
+            if compiled_cache_dir is not None:
+                function_cache.save(compiled_cache_dir, config, cached)
+        shared_variables, self.prob_fn = cached[:2]
+        ckpt.restore_model(shared_variables, inference_only=True)
+        if product:
+            self.s1_encoding_fn, self.s2_encoding_fn, self.product_fn = cached[2:]
+            self.encoding_cache = EncodingCache(int(encoding_cache_mb * 2**20))
+
+    def ids_for(self, eg):
+        return [self.vocab.ids_for_tokens(tokenise_parse.tokens_for(eg, i,
+                                                                    self.opts.parse_mode),
+                                          update=False)
+                for i in [1, 2]]
+
+    # label probabilities, (len(s1s), NUM_LABELS), for pairs of id sequences. pairs are
+    # scored in length sorted batches to minimise padding.
+    def probs(self, s1s, s2s):
+        lengths = [max(len(s1), len(s2)) for s1, s2 in zip(s1s, s2s)]
+        order = np.argsort(lengths, kind='mergesort')
+        probs = np.empty((len(s1s), len(util.LABELS)), dtype='float32')
+        for start in xrange(0, len(order), self.batch_size):
+            idxs = order[start : start + self.batch_size]
+            s1, s1_mask = util.pad_batch([s1s[i] for i in idxs])
+            s2, s2_mask = util.pad_batch([s2s[i] for i in idxs])
+            probs[idxs] = self.prob_fn(s1, s1_mask, s2, s2_mask)
+        return probs
+
+    # encodings, (len(seqs), _), of id sequences as s1s (sentence=1) or s2s (sentence=2).
+    # each distinct sequence not in the encoding cache is encoded once, in length sorted
+    # batches, and then cached.
+    def encodings(self, sentence, seqs):
+        encoding_fn = self.s1_encoding_fn if sentence == 1 else self.s2_encoding_fn
+        keys = [(sentence, tuple(s)) for s in seqs]
+        encodings = {}
+        missing = []
+        for key in set(keys):
+            encoding = self.encoding_cache.get(key)
+            if encoding is None:
+                missing.append(key)
+            else:
+                encodings[key] = encoding
+        missing.sort(key=lambda key: len(key[1]))
+        for start in xrange(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+            idxs, mask = util.pad_batch([key[1] for key in batch])
+            batch_encodings, = encoding_fn(idxs, mask)
+            for key, encoding in zip(batch, batch_encodings):
+                encoding = encoding.copy()  # so cache entries don't keep the whole batch
+                encodings[key] = encoding
+                self.encoding_cache.put(key, encoding)
+        return np.stack([encodings[key] for key in keys])
+
+    # label probabilities, (len(s1s), len(s2s), NUM_LABELS), for every s1 paired with
+    # every s2. each sentence is encoded once (see encodings) so it's len(s1s) + len(s2s)
+    # rnn runs, not one per pair; only the MLP & softmax is run per pair, over blocks of
+    # s1s of up to product_batch_size pairs. (matches probs for the same pairs)
+    def product_probs(self, s1s, s2s):
+        s1_encodings = self.encodings(1, s1s)
+        s2_encodings = self.encodings(2, s2s)
+        probs = np.empty((len(s1s), len(s2s), len(util.LABELS)), dtype='float32')
+        n_rows = max(1, self.product_batch_size // max(len(s2s), 1))
+        for start in xrange(0, len(s1s), n_rows):
+            probs[start : start + n_rows], = \
+                self.product_fn(s1_encodings[start : start + n_rows], s2_encodings)
+        return probs
+
+def chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True,
+                        help='checkpoint npz from nn_baseline.py --checkpoint-file')
+    parser.add_argument('--input', default='-', help='jsonl to score. - => stdin')
+    parser.add_argument('--batch-size', default=128, type=int,
+                        help='number of pairs per forward pass')
+    parser.add_argument('--compiled-cache-dir',
+                        help='if set, cache compiled forward function here for reuse')
+    opts = parser.parse_args()
+    print >>sys.stderr, opts
+
+    start_time = time.time()
+    predictor = Predictor(opts.checkpoint, opts.batch_size, opts.compiled_cache_dir)
+    print >>sys.stderr, util.dts(), "ready in %.1f sec" % (time.time() - start_time)
+
+    n_scored = 0
+    scoring_start_time = time.time()
+    lines = sys.stdin if opts.input == '-' else open(opts.input, "r")
+    # read in chunks of a number of batches so there's some freedom to sort by length
+    for chunk in chunks(lines, opts.batch_size * 20):
+        egs = [json.loads(line) for line in chunk]
+        s1s, s2s = zip(*[predictor.ids_for(eg) for eg in egs])
+        for eg, probs in zip(egs, predictor.probs(s1s, s2s)):
+            output = {"probs": dict(zip(util.LABELS, map(float, probs))),
+                      "pred": util.LABELS[np.argmax(probs)]}
+            if 'pairID' in eg:
+                output['pairID'] = eg['pairID']
+            print json.dumps(output)
+        n_scored += len(egs)
+    elapsed = time.time() - scoring_start_time
+    print >>sys.stderr, util.dts(), "scored %d pairs in %.1f sec (%.1f pairs/sec)" % \
+        (n_scored, elapsed, n_scored / max(elapsed, 1e-6))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# score sentence pairs with a model checkpointed by nn_seq2seq_attention.py (see
+# --checkpoint-file). input & output as for predict.py.
+#
+# pairs are grouped by premise; each distinct premise is encoded (s1 rnns & attention
+# keys) once and then scored against all its hypotheses, in batches, without rerunning
+# the s1 rnns. so one premise against many candidate hypotheses costs one premise
+# encoding rather than one per pair.
+import argparse
+from attention_model import AttentionModel
+import checkpoint
+from collections import OrderedDict
+import json
+import numpy as np
+from predict import chunks
+import sys
+import time
+import theano
+import tokenise_parse
+import util
+from vocab import Vocab
+
+class AttentionPredictor(object):
+    def __init__(self, checkpoint_file, batch_size=128):
+        self.batch_size = batch_size
+        ckpt = checkpoint.Checkpoint(checkpoint_file)
+        self.opts = ckpt.opts
+        self.vocab = Vocab()
+        ckpt.restore_vocab(self.vocab)
+
+        # compile premise encoding & hypothesis scoring graphs only
+        n_shared_before = len(util.SHARED_VARIABLES)
+        model = AttentionModel(self.opts, self.vocab.size())
+        shared_variables = util.SHARED_VARIABLES[n_shared_before:]
+        encode_inputs, encode_outputs, score_inputs, score_outputs = model.premise_fns()
+        self.encode_fn = theano.function(inputs=encode_inputs, outputs=encode_outputs)
+        self.score_fn = theano.function(inputs=score_inputs, outputs=score_outputs)
+        ckpt.restore_model(shared_variables, inference_only=True)
+
+    def ids_for(self, eg):
+        parse_mode = getattr(self.opts, 'parse_mode', 'BINARY_WITHOUT_PARENTHESIS')
+        return [self.vocab.ids_for_tokens(tokenise_parse.tokens_for(eg, i, parse_mode),
+                                          update=False)
+                for i in [1, 2]]
+
+    # encoding of a premise (a single id sequence); reusable for any hypotheses
+    def encode_premise(self, s1):
+        s1, s1_mask = util.pad_batch([s1])
+        states, keys = self.encode_fn(s1, s1_mask)
+        return states, keys, s1_mask[:, 0]
+
+    # label probabilities, (len(s2s), NUM_LABELS), for an encoded premise against each
+    # of s2s. hypotheses are scored in length sorted batches to minimise padding.
+    def probs_for_premise(self, premise, s2s):
+        states, keys, s1_mask = premise
+        order = np.argsort(map(len, s2s), kind='mergesort')
+        probs = np.empty((len(s2s), len(util.LABELS)), dtype='float32')
+        for start in xrange(0, len(order), self.batch_size):
+            idxs = order[start : start + self.batch_size]
+            s2, s2_mask = util.pad_batch([s2s[i] for i in idxs])
+            probs[idxs], = self.score_fn(states, keys, s1_mask, s2, s2_mask)
+        return probs
+
+    # label probabilities, (len(s1s), NUM_LABELS), for pairs of id sequences; each
+    # distinct premise is encoded once.
+    def probs(self, s1s, s2s):
+        pairs_for_premise = OrderedDict()
+        for i, s1 in enumerate(s1s):
+            pairs_for_premise.setdefault(tuple(s1), []).append(i)
+        probs = np.empty((len(s1s), len(util.LABELS)), dtype='float32')
+        for s1, idxs in pairs_for_premise.iteritems():
+            probs[idxs] = self.probs_for_premise(self.encode_premise(s1),
+                                                 [s2s[i] for i in idxs])
+        return probs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True,
+                        help='checkpoint npz from nn_seq2seq_attention.py --checkpoint-file')
+    parser.add_argument('--input', default='-', help='jsonl to score. - => stdin')
+    parser.add_argument('--batch-size', default=128, type=int,
+                        help='number of hypotheses per forward pass')
+    parser.add_argument('--chunk-size', default=10000, type=int,
+                        help='number of lines read at a time; pairs sharing a premise'
+                             ' within a chunk share its encoding')
+    opts = parser.parse_args()
+    print >>sys.stderr, opts
+
+    start_time = time.time()
+    predictor = AttentionPredictor(opts.checkpoint, opts.batch_size)
+    print >>sys.stderr, util.dts(), "ready in %.1f sec" % (time.time() - start_time)
+
+    n_scored = 0
+    n_premises = 0
+    scoring_start_time = time.time()
+    lines = sys.stdin if opts.input == '-' else open(opts.input, "r")
+    for chunk in chunks(lines, opts.chunk_size):
+        egs = [json.loads(line) for line in chunk]
+        s1s, s2s = zip(*[predictor.ids_for(eg) for eg in egs])
+        for eg, probs in zip(egs, predictor.probs(s1s, s2s)):
+            output = {"probs": dict(zip(util.LABELS, map(float, probs))),
+                      "pred": util.LABELS[np.argmax(probs)]}
+            if 'pairID' in eg:
+                output['pairID'] = eg['pairID']
+            print json.dumps(output)
+        n_scored += len(egs)
+        n_premises += len(set(map(tuple, s1s)))
+    elapsed = time.time() - scoring_start_time
+    print >>sys.stderr, util.dts(), "scored %d pairs (%d premise encodings) in %.1f sec" \
+        " (%.1f pairs/sec)" % (n_scored, n_premises, elapsed, n_scored / max(elapsed, 1e-6))
@@ -0,0 +1,73 @@
+from bidirectional_gru_rnn import BidirectionalGruRnn
+from concat_with_softmax import ConcatWithSoftmax
+from fused_gru_rnn import FusedGruRnn
+from gru_rnn import GruRnn
+import numpy as np
+import theano
+import theano.tensor as T
+
+NUM_LABELS = 3
+
+# the nn_seq2seq graph; a bidirectional gru over s1 (the premise) whose final states are
+# the context for a gru decoder running over the states of a bidirectional gru over s2
+# (the hypothesis). the decoder's final state is fed to an MLP & softmax. used for
+# training by nn_seq2seq.py and for export (see weights) by export_model.py.
+class Seq2SeqModel(object):
+    def __init__(self, opts, vocab_size, update_fn=None):
+        # input vars. sequences are batched; time major (time, batch) padded idxs with a
+        # mask (1.0 => token, 0.0 => padding) see util.pad_batch
+        self.s1_idxs = T.imatrix('s1')  # sequences for sentence one
+        self.s1_mask = T.fmatrix('s1_mask')
+        self.s2_idxs = T.imatrix('s2')  # sequences for sentence two
+        self.s2_mask = T.fmatrix('s2_mask')
+
+        # keep track of different "layers" that handle their own gradients.
+        self.layers = []
+
+        # build a bidirectional rnn of grus over s1
+        gru_cls = FusedGruRnn if opts.fused_gru else GruRnn
+        self.h0 = theano.shared(np.zeros(opts.hidden_dim, dtype='float32'), name='h0',
+                                borrow=True)
+        self.s1_bidir = BidirectionalGruRnn('s1_bidir', vocab_size, opts.embedding_dim,
+                                            opts.hidden_dim, opts, update_fn, self.h0,
+                                            self.s1_idxs, mask=self.s1_mask,
+                                            gru_cls=gru_cls)
+        self.layers.append(self.s1_bidir)
+
+        # build another pair of bidirectional rnn grus over s2
+        self.s2_bidir = BidirectionalGruRnn('s2_bidir', vocab_size, opts.embedding_dim,
+                                            opts.hidden_dim, opts, update_fn, self.h0,
+                                            self.s2_idxs, mask=self.s2_mask,
+                                            gru_cls=gru_cls)
+        self.layers.append(self.s2_bidir)
+
+        # build a unidirectional gru rnn over the bidirectional net over s2 and have it
+        # additionally conditioned on the context dervied from the networks over s1
+        self.s2_decoder = gru_cls(name='s2_decoder',
+                                  input_dim=2*opts.hidden_dim, hidden_dim=opts.hidden_dim,
+                                  opts=opts, update_fn=update_fn, h0=self.h0,
+                                  inputs=self.s2_bidir.all_states(), mask=self.s2_mask,
+                                  context=self.s1_bidir.final_states(),
+                                  context_dim=2*opts.hidden_dim)
+        self.layers.append(self.s2_decoder)
+
+        # use final state of this decoder to feed into the final MLP
+        self.concat_with_softmax = ConcatWithSoftmax(self.s2_decoder.final_state(),
+                                                     NUM_LABELS, opts.hidden_dim,
+                                                     update_fn)
+        self.layers.append(self.concat_with_softmax)
+        self.prob_y, self.pred_y = self.concat_with_softmax.prob_pred()
+
+    def inputs(self):
+        return [self.s1_idxs, self.s1_mask, self.s2_idxs, self.s2_mask]
+
+    # current param values by name, for the numpy inference engine; see numpy_model.py
+    def weights(self):
+        weights = {"h0": self.h0.get_value()}
+        weights.update(self.s1_bidir.weights())
+        weights.update(self.s2_bidir.weights())
+        for p in self.s2_decoder.dense_params():
+            weights["s2_decoder.%s" % p.name] = p.get_value()
+        for p in self.concat_with_softmax.dense_params():
+            weights["mlp.%s" % p.name] = p.get_value()
+        return weights
@@ -0,0 +1,180 @@
+# training shared by nn_seq2seq.py & nn_seq2seq_attention.py; they differ only in the
+# model (Seq2SeqModel vs AttentionModel) and what its checkpoint is for.
+import argparse
+import checkpoint
+import numpy as np
+import os
+from stats import Stats
+import sys
+import time
+import theano
+import theano.tensor as T
+import util
+from updates import *
+from vocab import Vocab
+
+def argument_parser(checkpoint_help):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train-set", default="data/snli_1.0_train.jsonl")
+    parser.add_argument("--num-from-train", default=-1, type=int,
+                        help='number of egs to read from train. -1 => all')
+    parser.add_argument("--dev-set", default="data/snli_1.0_dev.jsonl")
+    parser.add_argument("--num-from-dev", default=-1, type=int,
+                        help='number of egs to read from dev. -1 => all')
+    parser.add_argument("--dev-run-freq", default=100000, type=int,
+                        help='frequency (in num examples trained) to run against dev set')
+    parser.add_argument("--num-epochs", default=-1, type=int,
+                        help='number of epoches to run. -1 => forever')
+    parser.add_argument("--max-run-time-sec", default=-1, type=int,
+                        help='max secs to run before early stopping. -1 => dont early'
+                             ' stop')
+    parser.add_argument('--learning-rate', default=0.01, type=float,
+                        help='learning rate')
+    parser.add_argument('--momentum', default=0., type=float,
+                        help='momentum (when applicable)')
+    parser.add_argument('--update-fn', default='vanilla',
+                        help='vanilla (sgd) or rmsprop. not applied to embeddings')
+    parser.add_argument('--embedding-dim', default=100, type=int,
+                        help='embedding node dimensionality')
+    parser.add_argument('--hidden-dim', default=50, type=int,
+                        help='hidden node dimensionality')
+    parser.add_argument('--l2-penalty', default=0.0001, type=float,
+                        help='l2 penalty for params')
+    parser.add_argument('--gru-initial-bias', default=2, type=int,
+                        help='initial gru bias for r & z. higher => more like SimpleRnn')
+    parser.add_argument('--fused-gru', action='store_true',
+                        help='use FusedGruRnn (same params as GruRnn but input & context'
+                             ' projections are done before the scan)')
+    parser.add_argument('--batch-size', default=1, type=int,
+                        help='number of egs per training step. egs are bucketed by length'
+                             ' and padded; cost (and so gradient) is the mean over the'
+                             ' batch')
+    parser.add_argument('--bucket-factor', default=20, type=int,
+                        help='egs are sorted by length within buckets of batch_size *'
+                             ' bucket_factor egs before being sliced into batches')
+    parser.add_argument('--data-cache-dir',
+                        help='if set, cache tokenised train/dev data here and reuse it'
+                             ' on subsequent runs')
+    parser.add_argument('--loader-workers', default=1, type=int,
+                        help='number of processes to use for tokenising train/dev data')
+    parser.add_argument('--dev-batch-size', default=128, type=int,
+                        help='number of egs per batch when evaluating dev set')
+    parser.add_argument('--checkpoint-file',
+                        help='if set, checkpoint model here after each dev run; ' +
+                             checkpoint_help)
+    return parser
+
+def log(s):
+    print >>sys.stderr, util.dts(), s
+
+# padded, masked args for train_fn / test_fn for a batch of egs
+def batch_args(s1s, s2s, ys):
+    s1, s1_m = util.pad_batch(s1s)
+    s2, s2_m = util.pad_batch(s2s)
+    return [s1, s1_m, s2, s2_m, np.asarray(ys, dtype='int32')]
+
+# load data, build the model_cls graph (which has layers, prob_y, pred_y & inputs(), as
+# Seq2SeqModel) and train it as per opts (from argument_parser). script names the stats.
+def run(model_cls, opts, script):
+    assert opts.batch_size >= 1
+
+    # slurp training data, including converting of tokens -> ids
+    vocab = Vocab()
+    train, train_stats = util.load_corpus(opts.train_set, vocab,
+                                          update_vocab=True,
+                                          max_egs=int(opts.num_from_train),
+                                          cache_dir=opts.data_cache_dir,
+                                          n_workers=opts.loader_workers)
+    log("train_stats %s %s" % (len(train), train_stats))
+    dev, dev_stats = util.load_corpus(opts.dev_set, vocab,
+                                      update_vocab=False,
+                                      max_egs=int(opts.num_from_dev),
+                                      cache_dir=opts.data_cache_dir,
+                                      n_workers=opts.loader_workers)
+    log("dev_stats %s %s" % (len(dev), dev_stats))
+
+    # the graph
+    update_fn = globals().get(opts.update_fn)
+    if update_fn is None:
+        raise Exception("unknown update function [%s]" % opts.update_fn)
+    model = model_cls(opts, vocab.size(), update_fn)
+    layers = model.layers
+    prob_y, pred_y = model.prob_y, model.pred_y
+    actual_y = T.ivector('y')  # label per sentence pair; 0, 1 or 2
+
+    # calc l2 sums; of the dense params and, per eg, of the embedding rows of its tokens
+    log(">l2 params")
+    dense_l2, per_eg_embedding_l2 = util.l2_sums(layers, actual_y.shape[0])
+
+    # calculate cost ; xent + l2 penalty. as for nn_baseline.py each eg's cost has just
+    # its own embedding rows' l2, so dev_cost doesn't depend on --dev-batch-size, and the
+    # training cost is the mean over the batch.
+    log("calc cost")
+    per_eg_cross_entropy_cost = T.nnet.categorical_crossentropy(prob_y, actual_y)
+    per_eg_total_cost = per_eg_cross_entropy_cost + \
+        opts.l2_penalty * (dense_l2 + per_eg_embedding_l2)
+    total_cost = T.mean(per_eg_total_cost)
+
+    # calculate updates
+    log("calc updates")
+    updates = []
+    for layer in layers:
+        updates.extend(layer.updates_wrt_cost(total_cost, opts))
+
+    log("compiling")
+    fn_inputs = model.inputs() + [actual_y]
+    train_fn = theano.function(inputs=fn_inputs,
+                               outputs=[total_cost],
+                               updates=updates,
+                               on_unused_input='ignore')  # on unused for debugging
+    test_fn = theano.function(inputs=fn_inputs,
+                              outputs=[pred_y, per_eg_total_cost],
+                              on_unused_input='ignore')
+
+    # dev set is fixed so pad it once, in length sorted batches, up front
+    dev_batches = []
+    for idxs in dev.length_sorted_batches(opts.dev_batch_size):
+        dev_batches.append(batch_args(*dev.batch(idxs)))
+    dev_actuals = np.concatenate([args[-1] for args in dev_batches])
+
+    def stats_from_dev_set(stats):
+        predicteds = []
+        costs = []
+        for args in dev_batches:
+            pred_y, cost = test_fn(*args)
+            predicteds.append(pred_y)
+            costs.append(cost)
+        stats.record_dev_costs(np.concatenate(costs))
+        dev_c = util.confusion_matrix(dev_actuals, np.concatenate(predicteds),
+                                      len(util.LABELS))
+        dev_accuracy = util.accuracy(dev_c)
+        stats.set_dev_accuracy(dev_accuracy)
+        print "dev confusion\n %s (%s)" % (dev_c, dev_accuracy)
+
+    def save_checkpoint(epoch):
+        if opts.checkpoint_file:
+            checkpoint.save(opts.checkpoint_file, vocab, opts,
+                            {"epoch": epoch, "n_egs_trained": stats.n_egs_trained})
+
+    log("training")
+    epoch = 0
+    training_early_stop_time = opts.max_run_time_sec + time.time()
+    stats = Stats(os.path.basename(script), opts)
+    next_dev_run = opts.dev_run_freq
+    while epoch != opts.num_epochs:
+        for idxs in train.bucketed_batches(train.shuffled_idxs(), opts.batch_size,
+                                           opts.bucket_factor):
+            cost, = train_fn(*batch_args(*train.batch(idxs)))
+            stats.record_training_cost(cost, n_egs=len(idxs))
+            early_stop = False
+            if opts.max_run_time_sec != -1 and time.time() > training_early_stop_time:
+                early_stop = True
+            if stats.n_egs_trained >= next_dev_run or early_stop:
+                next_dev_run += opts.dev_run_freq
+                stats_from_dev_set(stats)
+                stats.flush_to_stdout(epoch)
+                save_checkpoint(epoch)
+            if early_stop:
+                exit(0)
+        epoch += 1
+    save_checkpoint(epoch)
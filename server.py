@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# long running local http server scoring sentence pairs with a model checkpointed by
+# nn_baseline.py. concurrent requests are coalesced into padded minibatches; a batch is
+# run when it's full or when the oldest request has waited --max-wait-ms.
+#
+# POST /score   body is a snli style eg (or a list of them); responds with a list of
+#               {"probs": {label: prob}, "pred": label}, one per eg.
+# GET /metrics  latency quantiles, throughput and batching stats.
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import deque
+import json
+import numpy as np
+from predict import Predictor
+import Queue
+from SocketServer import ThreadingMixIn
+import sys
+import threading
+import time
+import util
+
+class PendingRequest(object):
+    def __init__(self, s1s, s2s):
+        self.s1s = s1s
+        self.s2s = s2s
+        self.arrival_time = time.time()
+        self.done = threading.Event()
+        self.probs = None
+        self.error = None
+
+class MicroBatcher(object):
+    def __init__(self, predictor, max_batch_size, max_wait_sec, latency_window=10000):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_sec = max_wait_sec
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.latencies = deque(maxlen=latency_window)  # secs, most recent requests
+        self.n_requests = 0
+        self.n_pairs = 0
+        self.n_batches = 0
+        worker = threading.Thread(target=self._run)
+        worker.daemon = True
+        worker.start()
+
+    # blocks until request is scored; returns probs (n_pairs, n_labels)
+    def score(self, s1s, s2s):
+        request = PendingRequest(s1s, s2s)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.probs
+
+    def _next_batch(self):
+        requests = [self.queue.get()]
+        n_pairs = len(requests[0].s1s)
+        deadline = requests[0].arrival_time + self.max_wait_sec
+        while n_pairs < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                break
+            requests.append(request)
+            n_pairs += len(request.s1s)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._next_batch()
+            try:
+                self._score(requests)
+            except Exception:
+                # score the batch's requests one at a time so a single bad request only
+                # fails itself and not the others it was batched with
+                for request in requests:
+                    try:
+                        self._score([request])
+                    except Exception as e:
+                        request.error = e
+                        request.done.set()
+
+    def _score(self, requests):
+        s1s, s2s = [], []
+        for request in requests:
+            s1s.extend(request.s1s)
+            s2s.extend(request.s2s)
+        probs = self.predictor.probs(s1s, s2s)
+        now = time.time()
+        offset = 0
+        with self.lock:
+            for request in requests:
+                request.probs = probs[offset : offset + len(request.s1s)]
+                offset += len(request.s1s)
+                self.latencies.append(now - request.arrival_time)
+            self.n_requests += len(requests)
+            self.n_pairs += len(s1s)
+            self.n_batches += 1
+        for request in requests:
+            request.done.set()
+
+    def metrics(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            elapsed = time.time() - self.start_time
+            metrics = {"n_requests": self.n_requests, "n_pairs": self.n_pairs,
+                       "n_batches": self.n_batches,
+                       "requests_per_sec": self.n_requests / elapsed,
+                       "pairs_per_sec": self.n_pairs / elapsed,
+                       "mean_pairs_per_batch": self.n_pairs / max(self.n_batches, 1.0)}
+        if latencies:
+            p50, p99 = np.percentile(latencies, [50, 99])
+            metrics.update({"latency_ms_p50": 1000 * p50, "latency_ms_p99": 1000 * p99})
+        return metrics
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    def _respond(self, code, body):
+        content = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            return self._respond(404, {"error": "unknown path %s" % self.path})
+        self._respond(200, self.server.batcher.metrics())
+
+    def do_POST(self):
+        if self.path != "/score":
+            return self._respond(404, {"error": "unknown path %s" % self.path})
+        try:
+            egs = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if type(egs) != list:
+                egs = [egs]
+            s1s, s2s = [], []
+            for eg in egs:
+                s1, s2 = self.server.predictor.ids_for(eg)
+                s1s.append(s1)
+                s2s.append(s2)
+        except (ValueError, KeyError, AssertionError) as e:
+            return self._respond(400, {"error": "bad request: %s" % e})
+        try:
+            all_probs = self.server.batcher.score(s1s, s2s)
+        except Exception as e:
+            return self._respond(500, {"error": "scoring failed: %s" % e})
+        results = []
+        for probs in all_probs:
+            results.append({"probs": dict(zip(util.LABELS, map(float, probs))),
+                            "pred": util.LABELS[np.argmax(probs)]})
+        self._respond(200, results)
+
+    def log_message(self, format, *args):
+        pass  # no per request logging; see /metrics
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # pending connections; the default of 5 drops bursts
+
+    def __init__(self, address, predictor, batcher):
+        HTTPServer.__init__(self, address, ScoringHandler)
+        self.predictor = predictor
+        self.batcher = batcher
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True,
+                        help='checkpoint npz from nn_baseline.py --checkpoint-file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=8080, type=int)
+    parser.add_argument('--max-batch-size', default=128, type=int,
+                        help='max number of pairs per forward pass')
+    parser.add_argument('--max-wait-ms', default=5.0, type=float,
+                        help='max time a request waits for others to batch with')
+    parser.add_argument('--compiled-cache-dir',
+                        help='if set, cache compiled forward function here for reuse')
+    opts = parser.parse_args()
+    print >>sys.stderr, opts
+
+    predictor = Predictor(opts.checkpoint, opts.max_batch_size, opts.compiled_cache_dir)
+    batcher = MicroBatcher(predictor, opts.max_batch_size, opts.max_wait_ms / 1000)
+    server = ScoringServer((opts.host, opts.port), predictor, batcher)
+    print >>sys.stderr, util.dts(), "serving on %s:%s" % (opts.host, opts.port)
+    server.serve_forever()
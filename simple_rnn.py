@@ -6,12 +6,13 @@ import util
 
 class SimpleRnn(object):
     def __init__(self, name, input_dim, hidden_dim, opts, update_fn, h0, inputs,
-                 context=None, context_dim=None):
+                 context=None, context_dim=None, mask=None):
         self.name_ = name
         self.update_fn = update_fn
         self.h0 = h0
-        self.inputs = inputs    # input sequence
+        self.inputs = inputs    # input sequence; (time, dim) or batched (time, batch, dim)
         self.context = context  # additional context to add at each timestep of input
+        self.mask = mask        # (time, batch) 1.0 for tokens, 0.0 for padding (if batched)
 
         # hidden -> hidden
         self.Uh = util.sharedMatrix(hidden_dim, hidden_dim, 'Uh', orthogonal_init=True)
@@ -43,19 +44,40 @@ class SimpleRnn(object):
         gradients = util.clipped(T.grad(cost=cost, wrt=self.dense_params()))
         return self.update_fn(self.dense_params(), gradients, learning_opts)
 
+    # h_t_minus_1 is either a single (hidden,) state or a batch of (batch, hidden) states
+    # hence the x.W^T form of the dot products (which works for both)
     def recurrent_step(self, inp, h_t_minus_1):
-        h_t = (T.dot(self.Uh, h_t_minus_1) +
-               T.dot(self.Wh, inp) +
+        h_t = (T.dot(h_t_minus_1, self.Uh.T) +
+               T.dot(inp, self.Wh.T) +
                self.bh)
         if self.context:
-            h_t += T.dot(self.Whc, self.context)
+            h_t += T.dot(self.context, self.Whc.T)
         h_t = T.tanh(h_t)
         return [h_t, h_t]
 
+    # padded steps carry h_t_minus_1 through unchanged. since batches are right padded
+    # the last state is then the state after the last real token (and for a reversed
+    # sequence the leading padding just carries h0)
+    def masked_recurrent_step(self, inp, mask, h_t_minus_1):
+        h_t, _ = self.recurrent_step(inp, h_t_minus_1)
+        mask = mask.dimshuffle(0, 'x')
+        h_t = mask * h_t + (1 - mask) * h_t_minus_1
+        return [h_t, h_t]
+
+    def initial_state(self):
+        if self.inputs.ndim == 3:
+            # batched; one copy of h0 per example
+            return T.alloc(self.h0, self.inputs.shape[1], self.h0.shape[0])
+        return self.h0
+
     def all_states(self):
-        [_h_t, h_t], _ = theano.scan(fn=self.recurrent_step,
-                                     sequences=[self.inputs],
-                                     outputs_info=[self.h0, None])
+        if self.mask is None:
+            step_fn, sequences = self.recurrent_step, [self.inputs]
+        else:
+            step_fn, sequences = self.masked_recurrent_step, [self.inputs, self.mask]
+        [_h_t, h_t], _ = theano.scan(fn=step_fn,
+                                     sequences=sequences,
+                                     outputs_info=[self.initial_state(), None])
         return h_t
 
     def final_state(self):
@@ -0,0 +1,85 @@
+from gru_rnn import GruRnn
+import theano
+import theano.tensor as T
+import util
+
+# runs a set of independent rnns, each with its own params (eg the forward & backward
+# rnns over s1 & s2 of a bidirectional model), as a single scan over their stacked
+# states. as for the Fused* cells the input projections for all timesteps are done
+# before the scan. each step is then a batched matmul of the (n_rnns, batch, hidden)
+# state against the stacked recurrent params (Ur & Uz, then Uh, for grus) instead of
+# each rnn doing its own small matmuls in its own scan.
+#
+# rnns must be batched & masked (as built by BaselineModel), without context, all grus
+# (GruRnn or FusedGruRnn) or all simple rnns (SimpleRnn or FusedSimpleRnn) and of the
+# same hidden dim. sequences of different lengths (eg s1 & s2) are right padded to the
+# longest; padding is masked so just carries the final state through. params, and so
+# updates, checkpoints & exports, are those of the rnns themselves.
+class StackedRnns(object):
+    def __init__(self, rnns):
+        self.rnns = rnns
+        self.gru = isinstance(rnns[0], GruRnn)
+        for rnn in rnns:
+            assert isinstance(rnn, GruRnn) == self.gru, "can't stack grus with simple rnns"
+            assert rnn.inputs.ndim == 3 and rnn.mask is not None, "expecting batched rnns"
+            assert not rnn.context, "rnns with context not supported"
+        self.hidden_dim = rnns[0].Uh.get_value().shape[0]
+
+    # (time, batch, _) projections of rnn's inputs; for grus the reset gate, carry gate
+    # and candidate state projections, in that order, along the last axis
+    def input_projections(self, rnn):
+        if self.gru:
+            W = T.concatenate([rnn.Wr, rnn.Wz, rnn.Wh])
+            b = T.concatenate([rnn.br, rnn.bz, rnn.bh])
+            return T.dot(rnn.inputs, W.T) + b
+        return T.dot(rnn.inputs, rnn.Wh.T) + rnn.bh
+
+    def gru_step(self, projections, mask, h_t_minus_1, U_rz, U_h):
+        hidden_dim = self.hidden_dim
+        rz = T.nnet.sigmoid(T.batched_dot(h_t_minus_1, U_rz) +
+                            util.last_axis_slice(projections, 0, 2*hidden_dim))
+        r = util.last_axis_slice(rz, 0, hidden_dim)
+        z = util.last_axis_slice(rz, hidden_dim, 2*hidden_dim)
+        h_t_candidate = T.tanh(r * T.batched_dot(h_t_minus_1, U_h) +
+                               util.last_axis_slice(projections, 2*hidden_dim,
+                                                    3*hidden_dim))
+        h_t = (1 - z) * h_t_minus_1 + z * h_t_candidate
+        mask = mask.dimshuffle(0, 1, 'x')
+        return mask * h_t + (1 - mask) * h_t_minus_1
+
+    def simple_step(self, projections, mask, h_t_minus_1, U_h):
+        h_t = T.tanh(T.batched_dot(h_t_minus_1, U_h) + projections)
+        mask = mask.dimshuffle(0, 1, 'x')
+        return mask * h_t + (1 - mask) * h_t_minus_1
+
+    # (time, n_rnns, batch, hidden) states
+    def all_states(self):
+        n_steps = self.rnns[0].inputs.shape[0]
+        for rnn in self.rnns[1:]:
+            n_steps = T.maximum(n_steps, rnn.inputs.shape[0])
+        def right_padded(x):
+            shape = [n_steps - x.shape[0]] + [x.shape[i] for i in xrange(1, x.ndim)]
+            return T.concatenate([x, T.zeros(shape, dtype=x.dtype)])
+        projections = T.stack([right_padded(self.input_projections(rnn))
+                               for rnn in self.rnns], axis=1)
+        masks = T.stack([right_padded(rnn.mask) for rnn in self.rnns], axis=1)
+        # recurrent params, transposed, as (n_rnns, hidden, _) for batched_dot
+        U_h = T.stack([rnn.Uh.T for rnn in self.rnns])
+        if self.gru:
+            step_fn = self.gru_step
+            non_sequences = [T.stack([T.concatenate([rnn.Ur, rnn.Uz]).T
+                                      for rnn in self.rnns]), U_h]
+        else:
+            step_fn = self.simple_step
+            non_sequences = [U_h]
+        h0 = T.stack([rnn.initial_state() for rnn in self.rnns])
+        h_t, _ = theano.scan(fn=step_fn,
+                             sequences=[projections, masks],
+                             outputs_info=[h0],
+                             non_sequences=non_sequences)
+        return h_t
+
+    # final state of each rnn; (batch, hidden) each
+    def final_states(self):
+        final_states = self.all_states()[-1]
+        return [final_states[i] for i in xrange(len(self.rnns))]
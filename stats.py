@@ -1,12 +1,41 @@
 import json
 import numpy as np
 import os
+import resource
 import sys
 import time
 import util
 
+# training steps are grouped by the length of their longest sequence, in buckets of
+# this width, for step latency histograms.
+LENGTH_BUCKET_WIDTH = 10
+# upper edges (ms) of step latency histogram bins; the last bin is unbounded
+LATENCY_BINS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# time spent in each phase of the training loop (see record_time) is reported, along
+# with the time not covered by any phase, as time_sec.
+PHASES = ["data_prep", "train_fn", "dev_eval", "checkpoint"]
+
+def latency_summary(latencies_sec):
+    ms = np.asarray(latencies_sec) * 1000
+    counts, _edges = np.histogram(ms, [0] + LATENCY_BINS_MS + [np.inf])
+    return {"n": len(ms), "mean_ms": float(np.mean(ms)),
+            "p50_ms": float(np.percentile(ms, 50)), "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(np.max(ms)),
+            "hist": counts.tolist()}
+
+# peak resident set size, in MB, of this process and of the largest of its (finished)
+# child processes; eg hogwild workers, but also loader processes & compiler runs.
+# ru_maxrss is in KB on linux but bytes on osx.
+def peak_rss_mb():
+    scale = 1024. * 1024 if sys.platform == "darwin" else 1024.
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale}
+
 class Stats(object):
-    def __init__(self, model, opts):
+    # metrics_file, if set, is appended a json line of just the throughput, timing &
+    # memory stats (see metrics()) at each flush.
+    def __init__(self, model, opts, metrics_file=None):
         self.start_time = int(time.time())
         self.n_egs_trained = 0
         self.base_stats = {"model": model,
@@ -14,6 +43,7 @@ class Stats(object):
         for opt in dir(opts):
             if not opt.startswith("_"):
                 self.base_stats[opt] = getattr(opts, opt)
+        self.metrics_file = metrics_file
         self.reset()
 
     def reset(self):
@@ -21,14 +51,38 @@ class Stats(object):
         self.dev_costs = []
         self.dev_accuracy = None
         self.norms = None
+        self.throughput = None
+        self.flush_time = time.time()
+        self.n_egs_since_flush = 0
+        self.n_tokens_since_flush = 0
+        self.time_sec = dict((phase, 0.) for phase in PHASES)
+        self.step_latencies = {}  # length bucket -> [secs]
 
-    def record_training_cost(self, cost):
+    def record_training_cost(self, cost, n_egs=1):
+        # cost is the mean over n_egs when training in batches
         self.train_costs.append(cost)
-        self.n_egs_trained += 1
+        self.n_egs_trained += n_egs
+        self.n_egs_since_flush += n_egs
+
+    # time spent in one of PHASES
+    def record_time(self, phase, sec):
+        self.time_sec[phase] += sec
+
+    # a training step over n_tokens tokens, the longest sequence having seq_len tokens,
+    # that took sec secs (counted as train_fn time). seq_len None => no latency recorded
+    def record_training_step(self, n_tokens, seq_len, sec):
+        self.n_tokens_since_flush += n_tokens
+        self.record_time("train_fn", sec)
+        if seq_len is not None:
+            bucket = seq_len / LENGTH_BUCKET_WIDTH * LENGTH_BUCKET_WIDTH
+            self.step_latencies.setdefault(bucket, []).append(sec)
 
     def record_dev_cost(self, cost):
         self.dev_costs.append(cost)
 
+    def record_dev_costs(self, costs):
+        self.dev_costs.extend(costs)
+
     def set_dev_accuracy(self, dev_accuracy):
         assert self.dev_accuracy is None
         self.dev_accuracy = dev_accuracy
@@ -36,6 +90,44 @@ class Stats(object):
     def set_param_norms(self, norms):
         self.norms = norms
 
+    # additional throughput stats for this flush, eg scaling_efficiency for data
+    # parallel training; see DataParallelTrainer.throughput
+    def set_throughput(self, throughput):
+        self.throughput = throughput
+
+    # how train & test fns were obtained; compile_cache is "hit", "miss" or None (no
+    # cache) and compile_time_sec includes loading from the cache.
+    def set_compile_stats(self, compile_cache, compile_time_sec):
+        self.base_stats["compile_cache"] = compile_cache
+        self.base_stats["compile_time_sec"] = compile_time_sec
+
+    # fraction of the tokens of a dataset (eg "train") dropped on loading by
+    # --max-seq-len; see util.tokens_dropped_frac
+    def set_tokens_dropped_frac(self, dataset, frac):
+        self.base_stats["%s_tokens_dropped_frac" % dataset] = frac
+
+    # throughput, time split, step latencies & memory since the last flush.
+    # egs_per_sec is over wall clock time whereas train_{egs,tokens}_per_sec are over
+    # just data_prep & train_fn time (so are only included if those were recorded).
+    def metrics(self):
+        elapsed = time.time() - self.flush_time
+        time_sec = dict(self.time_sec)
+        time_sec["other"] = max(0., elapsed - sum(self.time_sec.values()))
+        metrics = {"egs_per_sec": self.n_egs_since_flush / max(elapsed, 1e-6),
+                   "time_sec": time_sec,
+                   "step_latency_ms": dict(
+                       ("len_%d_%d" % (bucket, bucket + LENGTH_BUCKET_WIDTH - 1),
+                        latency_summary(latencies))
+                       for bucket, latencies in self.step_latencies.items()),
+                   "peak_rss_mb": peak_rss_mb()}
+        train_time = self.time_sec["data_prep"] + self.time_sec["train_fn"]
+        if train_time > 0:
+            metrics["train_egs_per_sec"] = self.n_egs_since_flush / train_time
+            metrics["train_tokens_per_sec"] = self.n_tokens_since_flush / train_time
+        if self.throughput:
+            metrics.update(self.throughput)
+        return metrics
+
     def flush_to_stdout(self, epoch):
         stats = dict(self.base_stats)
         stats.update({"dts_h": util.dts(), "epoch": epoch,
@@ -46,7 +138,14 @@ class Stats(object):
                       "dev_acc": self.dev_accuracy})
         if self.norms:
             stats.update({"norms": self.norms})
+        metrics = self.metrics()
+        stats.update(metrics)
         print "STATS\t%s" % json.dumps(stats)
         sys.stdout.flush()
+        if self.metrics_file:
+            metrics.update({"run": self.base_stats["run"], "dts_h": stats["dts_h"],
+                            "epoch": epoch, "n_egs_trained": self.n_egs_trained,
+                            "step_latency_bins_ms": LATENCY_BINS_MS})
+            with open(self.metrics_file, "a") as f:
+                print >>f, json.dumps(metrics)
         self.reset()
-
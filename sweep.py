@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+# hyperparameter sweep over nn_baseline.py. trials are run as subprocesses across a local
+# pool with BLAS pinned to --blas-threads per trial. train & dev are tokenised once, up
+# front, into a --data-cache-dir that all trials then open (read only, memory mapped).
+# compiled train & test fns are shared through a --compiled-cache-dir; trials that only
+# differ in hyperparameters (learning rate, momentum, l2 penalty, keep prob) share an
+# entry, so trials started once it's written skip most of theano's compilation.
+# trials whose dev accuracy falls behind the others are stopped early (see
+# MedianStopping) and a results table, best first, is (re)written to
+# OUTPUT_DIR/results.tsv as trials finish. each trial's stdout (STATS lines, as read by
+# parse_out.py) and stderr are kept in OUTPUT_DIR/trial_NNN.{out,err}.
+#
+# the spec is json; base opts for every trial, a grid (every combo is run) and/or
+# random params (sampled n_trials times per grid point). opts are nn_baseline.py flags
+# without the leading --; true => flag set, false => not set. eg
+# {"base": {"train-set": "data/snli_1.0_train.jsonl", "num-epochs": 5,
+#           "bidirectional": true, "tied-embeddings": true},
+#  "grid": {"rnn-type": ["SimpleRnn", "GruRnn"]},
+#  "random": {"n_trials": 10,
+#             "params": {"learning-rate": {"log_uniform": [0.0001, 0.1]},
+#                        "hidden-dim": {"choice": [50, 100, 200]},
+#                        "keep-prob": {"uniform": [0.5, 1.0]}}}}
+import argparse
+from collections import defaultdict
+import itertools
+import json
+import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nn_baseline.py")
+BLAS_THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+def grid_points(grid):
+    keys = sorted(grid.keys())
+    return [dict(zip(keys, values))
+            for values in itertools.product(*[grid[key] for key in keys])]
+
+def sample(param_spec, rnd):
+    (kind, arg), = param_spec.items()
+    if kind == "choice":
+        return rnd.choice(arg)
+    low, high = arg
+    if kind == "uniform":
+        return rnd.uniform(low, high)
+    if kind == "log_uniform":
+        return math.exp(rnd.uniform(math.log(low), math.log(high)))
+    if kind == "int_uniform":
+        return rnd.randint(low, high)
+    raise Exception("unknown sampling [%s]" % kind)
+
+# list of {opt: value} per trial; excludes base opts
+def trials_for(spec, seed):
+    rnd = random.Random(seed)
+    random_spec = spec.get("random", {})
+    trials = []
+    for point in grid_points(spec.get("grid", {})):
+        for _ in xrange(random_spec.get("n_trials", 1)):
+            trial = dict(point)
+            for opt, param_spec in sorted(random_spec.get("params", {}).items()):
+                trial[opt] = sample(param_spec, rnd)
+            trials.append(trial)
+    return trials
+
+def args_for(trial_opts):
+    args = []
+    for opt, value in sorted(trial_opts.items()):
+        if value is True:
+            args.append("--%s" % opt)
+        elif value is not False and value is not None:
+            args.append("--%s=%s" % (opt, value))
+    return args
+
+# median stopping rule; after its nth dev evaluation (ie STATS line) a trial is stopped
+# if the best dev accuracy it's seen so far is below the median of the best dev
+# accuracies other trials had seen by their nth evaluation. never applied before
+# min_evals evaluations or before min_trials other trials have got as far.
+class MedianStopping(object):
+    def __init__(self, min_evals, min_trials):
+        self.min_evals = min_evals
+        self.min_trials = min_trials
+        self.lock = threading.Lock()
+        self.best_dev_accs = defaultdict(list)  # n_evals -> best dev acc, per trial
+
+    def should_stop(self, n_evals, best_dev_acc):
+        with self.lock:
+            others = list(self.best_dev_accs[n_evals])
+            self.best_dev_accs[n_evals].append(best_dev_acc)
+        if n_evals < self.min_evals or len(others) < self.min_trials:
+            return False
+        return best_dev_acc < np.median(others)
+
+class Sweep(object):
+    def __init__(self, base_opts, output_dir, blas_threads, early_stopping):
+        self.base_opts = base_opts
+        self.output_dir = output_dir
+        self.early_stopping = early_stopping
+        self.env = dict(os.environ)
+        for var in BLAS_THREAD_ENV_VARS:
+            self.env[var] = str(blas_threads)
+        self.lock = threading.Lock()
+        self.results = []
+
+    def run_trial(self, trial):
+        trial_id, trial_opts = trial
+        run_opts = dict(self.base_opts, **trial_opts)
+        if int(run_opts.get("data-parallel-workers", 1)) > 1:
+            run_opts.pop("compiled-cache-dir", None)  # not supported by nn_baseline.py
+        cmd = [sys.executable, SCRIPT] + args_for(run_opts)
+        out_prefix = os.path.join(self.output_dir, "trial_%03d" % trial_id)
+        result = {"trial": trial_id, "n_evals": 0, "best_dev_acc": None,
+                  "final_dev_acc": None, "n_egs_trained": 0, "elapsed_time": None}
+        result.update(trial_opts)
+        stopped = False
+        with open("%s.out" % out_prefix, "w") as out, open("%s.err" % out_prefix, "w") as err:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, env=self.env)
+            for line in iter(proc.stdout.readline, ''):
+                out.write(line)
+                if not line.startswith("STATS"):
+                    continue
+                stats = json.loads(line.split("\t")[1])
+                result["n_evals"] += 1
+                result["final_dev_acc"] = stats["dev_acc"]
+                result["best_dev_acc"] = max(result["best_dev_acc"], stats["dev_acc"])
+                result["n_egs_trained"] = stats["n_egs_trained"]
+                result["elapsed_time"] = stats["elapsed_time"]
+                if self.early_stopping.should_stop(result["n_evals"],
+                                                   result["best_dev_acc"]):
+                    stopped = True
+                    proc.terminate()
+                    break
+            out.write(proc.stdout.read())
+            returncode = proc.wait()
+        if stopped:
+            result["status"] = "stopped"
+        elif returncode == 0:
+            result["status"] = "done"
+        else:
+            result["status"] = "failed(%s)" % returncode
+        with self.lock:
+            self.results.append(result)
+            self.write_results()
+        return result
+
+    def write_results(self):
+        trial_opts = sorted(set(itertools.chain(*[r.keys() for r in self.results])) -
+                            set(RESULT_FIELDS))
+        fields = RESULT_FIELDS + trial_opts
+        results = sorted(self.results, key=lambda r: r["best_dev_acc"], reverse=True)
+        tmp_path = os.path.join(self.output_dir, "results.tsv.tmp")
+        with open(tmp_path, "w") as f:
+            print >>f, "\t".join(fields)
+            for result in results:
+                print >>f, "\t".join(str(result.get(field, "NA")) for field in fields)
+        os.rename(tmp_path, os.path.join(self.output_dir, "results.tsv"))
+
+RESULT_FIELDS = ["trial", "status", "best_dev_acc", "final_dev_acc", "n_evals",
+                 "n_egs_trained", "elapsed_time"]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spec', required=True, help='json sweep spec; see top of file')
+    parser.add_argument('--output-dir', required=True,
+                        help='where trial logs & results.tsv are written')
+    parser.add_argument('--blas-threads', default=1, type=int,
+                        help='BLAS threads per trial')
+    parser.add_argument('--workers', default=None, type=int,
+                        help='number of concurrent trials. default => cores / --blas-threads')
+    parser.add_argument('--seed', default=1234, type=int, help='seed for random params')
+    parser.add_argument('--early-stop-min-evals', default=3, type=int,
+                        help='number of dev evaluations before a trial can be stopped')
+    parser.add_argument('--early-stop-min-trials', default=4, type=int,
+                        help='number of other trials to compare to before stopping one.'
+                             ' -1 => never stop trials early')
+    opts = parser.parse_args()
+    print >>sys.stderr, opts
+
+    spec = json.load(open(opts.spec))
+    workers = opts.workers or max(1, multiprocessing.cpu_count() / opts.blas_threads)
+    if not os.path.exists(opts.output_dir):
+        os.makedirs(opts.output_dir)
+
+    # tokenise data once, up front, so trials all share the cached (mmap'd) copy.
+    base_opts = dict(spec.get("base", {}))
+    base_opts.setdefault("data-cache-dir", os.path.join(opts.output_dir, "data_cache"))
+    base_opts.setdefault("compiled-cache-dir", os.path.join(opts.output_dir, "fn_cache"))
+    print >>sys.stderr, time.strftime("%Y-%m-%d %H:%M:%S"), "caching data"
+    load_opts = dict(base_opts, **{"load-data-only": True})
+    load_opts.pop("compiled-cache-dir")
+    load_opts.setdefault("loader-workers", multiprocessing.cpu_count())
+    subprocess.check_call([sys.executable, SCRIPT] + args_for(load_opts))
+
+    trials = trials_for(spec, opts.seed)
+    print >>sys.stderr, time.strftime("%Y-%m-%d %H:%M:%S"), \
+        "running %d trials, %d at a time" % (len(trials), workers)
+    min_trials = opts.early_stop_min_trials
+    early_stopping = MedianStopping(opts.early_stop_min_evals,
+                                    min_trials if min_trials != -1 else len(trials))
+    sweep = Sweep(base_opts, opts.output_dir, opts.blas_threads, early_stopping)
+    pool = ThreadPool(workers)
+    for result in pool.imap_unordered(sweep.run_trial, enumerate(trials)):
+        print >>sys.stderr, time.strftime("%Y-%m-%d %H:%M:%S"), \
+            "trial %(trial)s %(status)s; best_dev_acc %(best_dev_acc)s" % result
+    pool.close()
+    pool.join()
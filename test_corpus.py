@@ -0,0 +1,51 @@
+from corpus import Corpus, token_budget_slices
+import numpy as np
+import unittest
+
+# s1 & s2 lengths of egs for a corpus; s1 of eg i is range(s1_len) etc
+LENGTHS = [(2, 1), (6, 3), (1, 1), (3, 2), (9, 4), (2, 2), (4, 1)]
+
+def corpus_with_lengths(lengths):
+    x = [(range(s1_len), range(s2_len)) for s1_len, s2_len in lengths]
+    return Corpus.from_lists(x, [i % 3 for i in xrange(len(lengths))])
+
+# padded tokens of a batch; n_egs * (max s1 len + max s2 len) as per util.pad_batch
+def padded_tokens(lengths):
+    s1_lengths, s2_lengths = zip(*lengths)
+    return len(lengths) * (max(s1_lengths) + max(s2_lengths))
+
+class TestTokenBudgetSlices(unittest.TestCase):
+    def test_slices_fit_budget(self):
+        s1_lengths, s2_lengths = [1, 1, 2, 2, 3, 3], [1, 2, 1, 2, 2, 3]
+        slices = token_budget_slices(s1_lengths, s2_lengths, 8)
+        self.assertEqual(slices, [(0, 2), (2, 4), (4, 5), (5, 6)])
+        for start, end in slices:
+            lengths = zip(s1_lengths[start:end], s2_lengths[start:end])
+            self.assertLessEqual(padded_tokens(lengths), 8)
+
+    # an eg over budget on its own is still a slice (of one); it isn't dropped
+    def test_over_budget_eg_is_slice_of_one(self):
+        self.assertEqual(token_budget_slices([1, 10, 1], [1, 10, 1], 4),
+                         [(0, 1), (1, 2), (2, 3)])
+
+    def test_empty(self):
+        self.assertEqual(token_budget_slices([], [], 4), [])
+
+class TestTokenBudgetBatches(unittest.TestCase):
+    def test_batches_cover_all_idxs_within_budget(self):
+        corpus = corpus_with_lengths(LENGTHS)
+        idxs = np.arange(len(corpus))
+        batches = corpus.token_budget_batches(idxs, 12, bucket_factor=2)
+        self.assertEqual(sorted(np.concatenate(batches)), range(len(corpus)))
+        for batch in batches:
+            lengths = [LENGTHS[i] for i in batch]
+            # over budget only as a batch of one eg that's over budget on its own
+            self.assertTrue(padded_tokens(lengths) <= 12 or len(batch) == 1)
+
+    def test_batches_are_of_given_idxs(self):
+        corpus = corpus_with_lengths(LENGTHS)
+        batches = corpus.token_budget_batches(np.array([1, 3, 5]), 100)
+        self.assertEqual(sorted(np.concatenate(batches)), [1, 3, 5])
+
+if __name__ == '__main__':
+    unittest.main()
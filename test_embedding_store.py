@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from embedding_store import EmbeddingStore
+from vocab import Vocab
+
+GLOVE = "the 0.1 0.2 0.3\ncaf\xc3\xa9 1.0 2.0 3.0\nna\xc3\xafve -1.0 0.5 0.25\n"
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.glove = os.path.join(self.tmp_dir, "glove.txt")
+        with open(self.glove, "w") as f:
+            f.write(GLOVE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    # non ascii tokens are found whether given as unicode or utf-8 bytes
+    def test_gather_non_ascii(self):
+        store = EmbeddingStore.convert_glove(self.glove, self.path("store"))
+        vectors, found = store.gather([u"caf\xe9", "na\xc3\xafve", u"missing", "the"])
+        self.assertEqual(found.tolist(), [True, True, False, True])
+        np.testing.assert_allclose(vectors[0], [1.0, 2.0, 3.0])
+        np.testing.assert_allclose(vectors[1], [-1.0, 0.5, 0.25])
+
+    # precompute_embeddings gives non ascii tokens of a binary (unicode) or tsv (bytes)
+    # vocab their glove vectors, both from a store & streamed from the text
+    def test_precompute_non_ascii(self):
+        vocab = Vocab()
+        vocab.ids_for_tokens([u"caf\xe9", u"the", u"na\xefve", u"unseen"])
+        vocab.save(self.path("v.npz"))
+        vocab.save(self.path("v.tsv"))
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "precompute_embeddings.py")
+        for vocab_file in ["v.npz", "v.tsv"]:
+            for glove_args in [["--glove-data", self.glove],
+                               ["--glove-store", self.path("store"),
+                                "--glove-data", self.glove]]:
+                npy = self.path("e.npy")
+                with open(os.devnull, "w") as devnull:
+                    subprocess.check_call([sys.executable, script,
+                                           "--vocab", self.path(vocab_file),
+                                           "--npy", npy] + glove_args,
+                                          stdout=devnull, stderr=devnull)
+                embeddings = np.load(npy)
+                np.testing.assert_allclose(embeddings[1], [1.0, 2.0, 3.0])
+                np.testing.assert_allclose(embeddings[2], [0.1, 0.2, 0.3])
+                np.testing.assert_allclose(embeddings[3], [-1.0, 0.5, 0.25])
+
+if __name__ == '__main__':
+    unittest.main()
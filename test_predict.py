@@ -0,0 +1,70 @@
+import argparse
+from attention_model import AttentionModel
+from baseline_model import BaselineModel
+import checkpoint
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import util
+from vocab import Vocab
+
+EGS = [("( a ( dog runs ) )", "( a cat ( sits down ) )"),
+       ("( the ( man ( is tall ) ) )", "( a man )"),
+       ("( a ( woman ( reads ( a book ) ) ) )", "( she ( is happy ) )")]
+
+OPTS = {"bidirectional": False, "tied_embeddings": False, "embedding_dim": 4,
+        "hidden_dim": 3, "rnn_type": "GruRnn", "gru_initial_bias": 2,
+        "shared_encoder": "none", "fused_gru": False,
+        "parse_mode": "BINARY_WITHOUT_PARENTHESIS"}
+
+class TestPredict(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmp_dir, "input.jsonl")
+        self.vocab = Vocab()
+        with open(self.input, "w") as f:
+            for i, (s1, s2) in enumerate(EGS):
+                self.vocab.ids_for_tokens(s1.split() + s2.split())
+                print >>f, json.dumps({"sentence1_binary_parse": s1,
+                                       "sentence2_binary_parse": s2, "pairID": str(i)})
+        # checkpoints hold all of util.SHARED_VARIABLES; just those of the model built
+        del util.SHARED_VARIABLES[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def checkpoint_for(self, model_cls):
+        opts = argparse.Namespace(**OPTS)
+        model_cls(opts, self.vocab.size())
+        path = os.path.join(self.tmp_dir, "ckpt.npz")
+        checkpoint.save(path, self.vocab, opts, {})
+        return path
+
+    # every line of stdout is a json prediction; nothing logged while building the model
+    # leaks into it
+    def assert_json_output(self, script, checkpoint_file):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+        with open(os.devnull, "w") as devnull:
+            output = subprocess.check_output([sys.executable, script,
+                                              "--checkpoint", checkpoint_file,
+                                              "--input", self.input], stderr=devnull)
+        lines = output.splitlines()
+        self.assertEqual(len(lines), len(EGS))
+        for i, line in enumerate(lines):
+            prediction = json.loads(line)
+            self.assertEqual(prediction["pairID"], str(i))
+            self.assertIn(prediction["pred"], util.LABELS)
+
+    def test_predict_output_is_jsonl(self):
+        self.assert_json_output("predict.py", self.checkpoint_for(BaselineModel))
+
+    def test_predict_attention_output_is_jsonl(self):
+        self.assert_json_output("predict_attention.py",
+                                self.checkpoint_for(AttentionModel))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import argparse
+from baseline_model import BaselineModel
+import numpy as np
+import theano
+import theano.tensor as T
+import unittest
+import util
+
+# a padded batch; s1 & s2 of different (max & per eg) lengths so the stacked scan has to
+# right pad the shorter of them and carry states through masked steps
+S1S = [[1, 2, 3, 4, 5], [6, 7], [8, 9, 1]]
+S2S = [[2, 3], [4, 5, 6], [7]]
+YS = [0, 2, 1]
+
+VOCAB_SIZE = 10
+
+def opts_for(rnn_type, shared_encoder):
+    return argparse.Namespace(bidirectional=True, tied_embeddings=False,
+                              embedding_dim=4, hidden_dim=3, rnn_type=rnn_type,
+                              gru_initial_bias=2, shared_encoder=shared_encoder,
+                              fused_gru=False)
+
+class TestStackedRnns(unittest.TestCase):
+    # prob_y and gradients of the cost wrt all params for a model with the params of the
+    # first model built (positionally; see util.SHARED_VARIABLES)
+    def prob_y_and_gradients(self, rnn_type, shared_encoder, param_values=None):
+        del util.SHARED_VARIABLES[:]
+        model = BaselineModel(opts_for(rnn_type, shared_encoder), VOCAB_SIZE)
+        params = list(util.SHARED_VARIABLES)
+        if param_values is not None:
+            for param, value in zip(params, param_values):
+                param.set_value(value)
+        actual_y = T.ivector('y')
+        cost = T.mean(T.nnet.categorical_crossentropy(model.prob_y, actual_y))
+        fn = theano.function(model.inputs() + [actual_y],
+                             [model.prob_y] + T.grad(cost, params))
+        s1, s1_mask = util.pad_batch(S1S)
+        s2, s2_mask = util.pad_batch(S2S)
+        outputs = fn(s1, s1_mask, s2, s2_mask, np.asarray(YS, dtype='int32'))
+        return outputs[0], outputs[1:], [p.get_value() for p in params]
+
+    def assert_matches_unstacked(self, rnn_type, shared_encoder):
+        prob_y, gradients, param_values = self.prob_y_and_gradients(rnn_type, 'none')
+        stacked_prob_y, stacked_gradients, _ = \
+            self.prob_y_and_gradients(rnn_type, shared_encoder, param_values)
+        np.testing.assert_allclose(stacked_prob_y, prob_y, rtol=1e-5, atol=1e-6)
+        self.assertEqual(len(stacked_gradients), len(gradients))
+        for stacked_gradient, gradient in zip(stacked_gradients, gradients):
+            np.testing.assert_allclose(stacked_gradient, gradient, rtol=1e-4, atol=1e-6)
+
+    def test_gru_directions(self):
+        self.assert_matches_unstacked('GruRnn', 'directions')
+
+    def test_gru_all(self):
+        self.assert_matches_unstacked('GruRnn', 'all')
+
+    def test_simple_rnn_directions(self):
+        self.assert_matches_unstacked('SimpleRnn', 'directions')
+
+    def test_simple_rnn_all(self):
+        self.assert_matches_unstacked('SimpleRnn', 'all')
+
+if __name__ == '__main__':
+    unittest.main()
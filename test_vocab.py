@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+from vocab import Vocab
+
+class TestVocab(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def pruned_vocab(self):
+        vocab = Vocab()
+        ids = vocab.ids_for_tokens("a b a c a b d".split())
+        vocab.add_counts(ids)
+        return vocab.pruned(min_count=2)
+
+    # a pruned (closed) vocab reloads closed from either format; missing tokens are UNK
+    def test_pruned_round_trip(self):
+        pruned = self.pruned_vocab()
+        for name in ["pv.tsv", "pv.npz"]:
+            path = os.path.join(self.tmp_dir, name)
+            pruned.save(path)
+            loaded = Vocab(path)
+            self.assertTrue(loaded.closed, name)
+            self.assertEqual(loaded.items(), pruned.items())
+            self.assertEqual(loaded.signature(), pruned.signature())
+            self.assertEqual(loaded.ids_for_tokens(["a", "zzz", "b"], update=True),
+                             [1, Vocab.UNK_ID, 2])
+
+    # an open vocab from a file still rejects missing tokens when updating
+    def test_open_round_trip(self):
+        vocab = Vocab()
+        vocab.ids_for_tokens(["x", "y"])
+        for name in ["v.tsv", "v.npz"]:
+            path = os.path.join(self.tmp_dir, name)
+            vocab.save(path)
+            loaded = Vocab(path)
+            self.assertFalse(loaded.closed, name)
+            self.assertEqual(loaded.items(), vocab.items())
+            self.assertRaises(Exception, loaded.ids_for_tokens, ["zzz"], True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,12 +3,18 @@ import theano
 import theano.tensor as T
 import util
 
+# opts are the learning opts; learning_rate & momentum (& l2_penalty, see embeddings.py)
+# are either floats or theano shared scalars (so a compiled fn can be reused with other
+# values; see nn_baseline.py). value() is for checks on them at graph build time.
+def value(opt):
+    return opt.get_value() if hasattr(opt, 'get_value') else opt
+
 def vanilla(params, gradients, opts):
     return [(param, param - opts.learning_rate * gradient) 
             for param, gradient in zip(params, gradients)]
 
 def momentum(params, gradients, opts):
-    assert opts.momentum >= 0.0 and opts.momentum <= 1.0
+    assert value(opts.momentum) >= 0.0 and value(opts.momentum) <= 1.0
     updates = []
     for param, gradient in zip(params, gradients):
         velocity_t0 = util.zeros_in_the_shape_of(param)
@@ -18,8 +24,8 @@ def momentum(params, gradients, opts):
     return updates
 
 def rmsprop(params, gradients, opts):
-    assert opts.momentum
-    assert opts.momentum >= 0.0 and opts.momentum <= 1.0
+    assert value(opts.momentum)
+    assert value(opts.momentum) >= 0.0 and value(opts.momentum) <= 1.0
     updates = []
     for param_t0, gradient in zip(params, gradients):
         # rmsprop see slide 29 of http://www.cs.toronto.edu/~tijmen/csc321/slides/lecture_slides_lec6.pdf
@@ -31,3 +37,40 @@ def rmsprop(params, gradients, opts):
         param_t1 = param_t0 - opts.learning_rate * (gradient / T.sqrt(mean_sqr_t1 + 1e-10))
         updates.append((param_t0, param_t1))
     return updates
+
+# sparse variants for (untied) embedding matrices. rather than a gradient for the whole
+# param these take the distinct rows touched by a step and the gradient summed per row
+# (see embeddings.Embeddings). optimiser state is only read & written for those rows, and
+# decays lazily (ie only when a row is touched), so per step cost scales with the number
+# of tokens in the batch rather than the vocab size. adagrad & rmsprop keep a single
+# accumulator per row (the mean squared gradient across the row).
+
+def sparse_vanilla(param, rows, gradient, opts):
+    return [(param, T.inc_subtensor(param[rows], -opts.learning_rate * gradient))]
+
+def sparse_momentum(param, rows, gradient, opts):
+    assert value(opts.momentum) >= 0.0 and value(opts.momentum) <= 1.0
+    velocity_t0 = util.zeros_in_the_shape_of(param)
+    velocity_t1 = opts.momentum * velocity_t0[rows] - opts.learning_rate * gradient
+    return [(velocity_t0, T.set_subtensor(velocity_t0[rows], velocity_t1)),
+            (param, T.inc_subtensor(param[rows], velocity_t1))]
+
+def _row_accumulator(param, name):
+    return util.shared(np.zeros(param.get_value().shape[0]), name)
+
+def sparse_adagrad(param, rows, gradient, opts):
+    sum_sqr_t0 = _row_accumulator(param, 'adagrad_sum_sqr')
+    sum_sqr_t1 = sum_sqr_t0[rows] + T.mean(gradient**2, axis=1)
+    step = gradient / T.sqrt(sum_sqr_t1 + 1e-10).dimshuffle(0, 'x')
+    return [(sum_sqr_t0, T.set_subtensor(sum_sqr_t0[rows], sum_sqr_t1)),
+            (param, T.inc_subtensor(param[rows], -opts.learning_rate * step))]
+
+def sparse_rmsprop(param, rows, gradient, opts):
+    assert value(opts.momentum)
+    assert value(opts.momentum) >= 0.0 and value(opts.momentum) <= 1.0
+    mean_sqr_t0 = _row_accumulator(param, 'rmsprop_mean_sqr')
+    mean_sqr_t1 = (opts.momentum * mean_sqr_t0[rows]) + \
+                  ((1.0-opts.momentum) * T.mean(gradient**2, axis=1))
+    step = gradient / T.sqrt(mean_sqr_t1 + 1e-10).dimshuffle(0, 'x')
+    return [(mean_sqr_t0, T.set_subtensor(mean_sqr_t0[rows], mean_sqr_t1)),
+            (param, T.inc_subtensor(param[rows], -opts.learning_rate * step))]
@@ -1,7 +1,14 @@
+import array
 from collections import Counter, defaultdict
+from corpus import Corpus, CorpusBuilder, token_budget_slices
+import hashlib
+import itertools
 import json
 import numpy as np
+import os
+import parallel_load
 import random
+import shutil
 import sys
 import theano
 import theano.tensor as T
@@ -23,10 +30,199 @@ def label_for(eg):
 def symmetric_example(label):
     return LABELS[label] != 'entailment'
 
+# policies for sentences longer than max_seq_len tokens (see load_data)
+#  truncate : keep just the first max_seq_len tokens
+#  skip     : drop the eg
+#  split    : split the sentences into consecutive windows of (at most) max_seq_len
+#             tokens; the eg becomes one eg, with the same label, per window of the
+#             sentence with more windows, each paired with the window at the same
+#             relative position of the other sentence. no tokens are dropped but it's
+#             lossy in a worse way; the eg's label is for the whole sentences and
+#             rarely holds for fragments (eg an entailment of half a hypothesis) so
+#             split egs are noisy. not recommended; prefer truncate or skip.
+MAX_SEQ_LEN_POLICIES = ['truncate', 'skip', 'split']
+
+# if max_seq_len is set sentences longer than it are handled as per max_seq_len_policy.
+# stats then also has the number of egs truncated, skipped or split and the number of
+# tokens dropped (n_tokens counts all tokens read); see tokens_dropped_frac.
+# max_egs is the number of egs read, before any are skipped or split.
 def load_data(dataset, vocab, max_egs=None, update_vocab=True, 
-              parse_mode="BINARY_WITHOUT_PARENTHESIS"):
+              parse_mode="BINARY_WITHOUT_PARENTHESIS", cache_dir=None,
+              max_seq_len=None, max_seq_len_policy='truncate'):
+    if cache_dir is not None:
+        corpus, stats = load_corpus(dataset, vocab, max_egs, update_vocab, parse_mode,
+                                    cache_dir, max_seq_len=max_seq_len,
+                                    max_seq_len_policy=max_seq_len_policy)
+        x, y = corpus.to_lists()
+        return x, y, stats
     stats = Counter()
     x, y = [], []
+    for s1, s2, l in _limited_examples(dataset, vocab, max_egs, update_vocab, parse_mode,
+                                       stats, max_seq_len, max_seq_len_policy):
+        x.append((s1, s2))
+        y.append(l)
+    if update_vocab:
+        vocab.add_counts(np.fromiter(itertools.chain.from_iterable(
+            itertools.chain.from_iterable(x)), dtype='int32'))
+    return x, y, stats
+
+# as load_data but returns a compact Corpus (see corpus.py) instead of lists. if
+# cache_dir is set the corpus is cached there (keyed by everything that could change
+# the result) and a cached corpus is opened memory mapped. if n_workers > 1 tokenising
+# is done by a pool of processes (see parallel_load.py); the result is identical to
+# the serial load. (max_egs runs are small so they are always loaded serially)
+# if update_vocab the corpus' tokens are counted in the vocab (see Vocab.add_counts).
+# max_seq_len & max_seq_len_policy as for load_data.
+def load_corpus(dataset, vocab, max_egs=None, update_vocab=True,
+                parse_mode="BINARY_WITHOUT_PARENTHESIS", cache_dir=None, n_workers=1,
+                max_seq_len=None, max_seq_len_policy='truncate'):
+    if cache_dir is not None:
+        cache = os.path.join(cache_dir, _cache_key(dataset, vocab, max_egs, update_vocab,
+                                                   parse_mode, max_seq_len,
+                                                   max_seq_len_policy))
+        if os.path.exists(cache):
+            corpus, stats = _load_cached_corpus(cache, vocab)
+            if update_vocab:
+                vocab.add_counts(corpus.tokens)
+            return corpus, stats
+    seq_before_load = vocab.seq
+    if n_workers > 1 and max_egs in [None, -1]:
+        corpus, stats = parallel_load.load_corpus(dataset, vocab, update_vocab,
+                                                  parse_mode, n_workers)
+        if max_seq_len is not None:
+            builder = CorpusBuilder()
+            for s1, s2, l in _limit_seq_len(((s1, s2, l) for (s1, s2), l in corpus),
+                                            max_seq_len, max_seq_len_policy, stats):
+                builder.append(s1, s2, l)
+            corpus = builder.build()
+    else:
+        stats = Counter()
+        builder = CorpusBuilder()
+        for s1, s2, l in _limited_examples(dataset, vocab, max_egs, update_vocab,
+                                           parse_mode, stats, max_seq_len,
+                                           max_seq_len_policy):
+            builder.append(s1, s2, l)
+        corpus = builder.build()
+    if cache_dir is not None:
+        _save_cached_corpus(cache, corpus, stats, vocab.tokens_since(seq_before_load))
+    if update_vocab:
+        vocab.add_counts(corpus.tokens)
+    return corpus, stats
+
+# single pass over dataset adding all tokens to vocab, and counting them, without keeping
+# any examples. (ids are the same as they would be from load_data / load_corpus)
+def build_vocab(dataset, vocab, max_egs=None, parse_mode="BINARY_WITHOUT_PARENTHESIS"):
+    stats = Counter()
+    ids = array.array('i')
+    for s1, s2, _l in _examples(dataset, vocab, max_egs, True, parse_mode, stats):
+        ids.extend(s1)
+        ids.extend(s2)
+        if len(ids) >= 1000000:
+            vocab.add_counts(np.frombuffer(ids, dtype='int32'))
+            ids = array.array('i')
+    vocab.add_counts(np.frombuffer(ids, dtype='int32'))
+    return stats
+
+# stream ((s1_ids, s2_ids), label) egs from dataset without loading it all. vocab is
+# not updated, so should already be complete (see build_vocab). if cache_dir has a
+# cached corpus for the dataset (see cache_for_streaming) it's streamed (memory mapped)
+# instead of the jsonl.
+def stream_examples(dataset, vocab, max_egs=None,
+                    parse_mode="BINARY_WITHOUT_PARENTHESIS", cache_dir=None,
+                    max_seq_len=None, max_seq_len_policy='truncate'):
+    if cache_dir is not None:
+        cache = os.path.join(cache_dir, _cache_key(dataset, vocab, max_egs, False,
+                                                   parse_mode, max_seq_len,
+                                                   max_seq_len_policy))
+        if os.path.exists(cache):
+            for eg in Corpus.load(cache, mmap=True):
+                yield eg
+            return
+    for s1, s2, l in _limited_examples(dataset, vocab, max_egs, False, parse_mode,
+                                       Counter(), max_seq_len, max_seq_len_policy):
+        yield (s1, s2), l
+
+# write the cached corpus that stream_examples, with the same args, reads; ie the
+# dataset loaded with the (complete) vocab and without updating it. a no-op if it's
+# already cached. returns the load stats.
+def cache_for_streaming(dataset, vocab, cache_dir, max_egs=None,
+                        parse_mode="BINARY_WITHOUT_PARENTHESIS", n_workers=1,
+                        max_seq_len=None, max_seq_len_policy='truncate'):
+    _corpus, stats = load_corpus(dataset, vocab, max_egs, False, parse_mode, cache_dir,
+                                 n_workers, max_seq_len, max_seq_len_policy)
+    return stats
+
+# yield egs from iterable in a random order using a buffer of buffer_size egs. memory
+# is bounded by buffer_size but egs can only move so far from their original position.
+def shuffled(egs, buffer_size):
+    buffer = []
+    for eg in egs:
+        if len(buffer) < buffer_size:
+            buffer.append(eg)
+            continue
+        i = random.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = eg
+    random.shuffle(buffer)
+    for eg in buffer:
+        yield eg
+
+# as Corpus.bucketed_batches but for a stream of ((s1, s2), label) egs. buckets of
+# batch_size * bucket_factor egs are read, sorted by length, sliced into batches and
+# the batches of the bucket yielded in a random order.
+def bucketed_stream_batches(egs, batch_size, bucket_factor=20):
+    def eg_length(eg):
+        (s1, s2), _y = eg
+        return max(len(s1), len(s2))
+    bucket_size = batch_size * bucket_factor
+    egs = iter(egs)
+    while True:
+        bucket = list(itertools.islice(egs, bucket_size))
+        if not bucket:
+            return
+        bucket.sort(key=eg_length)
+        batches = [bucket[i : i + batch_size] for i in xrange(0, len(bucket), batch_size)]
+        random.shuffle(batches)
+        for batch in batches:
+            yield batch
+
+# as bucketed_stream_batches but batches are sized by a budget of max_tokens padded
+# tokens, as for Corpus.token_budget_batches. buckets are read until they have about
+# max_tokens * bucket_factor (unpadded) tokens.
+def token_budget_stream_batches(egs, max_tokens, bucket_factor=20):
+    def eg_length(eg):
+        (s1, s2), _y = eg
+        return max(len(s1), len(s2))
+    egs = iter(egs)
+    while True:
+        bucket, n_tokens = [], 0
+        for (s1, s2), y in egs:
+            bucket.append(((s1, s2), y))
+            n_tokens += len(s1) + len(s2)
+            if n_tokens >= max_tokens * bucket_factor:
+                break
+        if not bucket:
+            return
+        bucket.sort(key=eg_length)
+        slices = token_budget_slices([len(s1) for (s1, _s2), _y in bucket],
+                                     [len(s2) for (_s1, s2), _y in bucket], max_tokens)
+        batches = [bucket[start:end] for start, end in slices]
+        random.shuffle(batches)
+        for batch in batches:
+            yield batch
+
+# yield lists of n consecutive items from iterable; the last list may be shorter.
+def grouped(iterable, n):
+    iterable = iter(iterable)
+    while True:
+        group = list(itertools.islice(iterable, n))
+        if not group:
+            return
+        yield group
+
+# yield (s1_ids, s2_ids, label) for labelled egs in dataset
+def _examples(dataset, vocab, max_egs, update_vocab, parse_mode, stats):
+    n_egs = 0
     for line in open(dataset, "r"):
         eg = json.loads(line)
         l = label_for(eg)
@@ -40,14 +236,101 @@ def load_data(dataset, vocab, max_egs=None, update_vocab=True,
             s2 = vocab.ids_for_tokens(s2, update_vocab)
             stats['n_tokens'] += len(s2)
             stats['n_unk'] += len(s2) - len(filter(None, s2))
-            x.append((s1, s2))
-            y.append(l)
-        if len(x) == max_egs:
+            yield s1, s2, l
+            n_egs += 1
+        if n_egs == max_egs:
             break
-    return x, y, stats
+
+# as _examples but with sentences longer than max_seq_len (if set) handled as per
+# max_seq_len_policy; see load_data
+def _limited_examples(dataset, vocab, max_egs, update_vocab, parse_mode, stats,
+                      max_seq_len, max_seq_len_policy):
+    examples = _examples(dataset, vocab, max_egs, update_vocab, parse_mode, stats)
+    if max_seq_len is None:
+        return examples
+    return _limit_seq_len(examples, max_seq_len, max_seq_len_policy, stats)
+
+def _limit_seq_len(examples, max_seq_len, policy, stats):
+    if policy not in MAX_SEQ_LEN_POLICIES:
+        raise Exception("unknown max seq len policy [%s]" % policy)
+    assert max_seq_len > 0
+    def windows(s):
+        return [s[i : i + max_seq_len] for i in xrange(0, max(len(s), 1), max_seq_len)]
+    for s1, s2, l in examples:
+        if len(s1) <= max_seq_len and len(s2) <= max_seq_len:
+            yield s1, s2, l
+        elif policy == 'truncate':
+            stats['n_truncated'] += 1
+            stats['n_tokens_dropped'] += max(len(s1) - max_seq_len, 0) + \
+                max(len(s2) - max_seq_len, 0)
+            yield s1[:max_seq_len], s2[:max_seq_len], l
+        elif policy == 'skip':
+            stats['n_skipped_too_long'] += 1
+            stats['n_tokens_dropped'] += len(s1) + len(s2)
+        else:
+            stats['n_split'] += 1
+            s1_windows, s2_windows = windows(s1), windows(s2)
+            n = max(len(s1_windows), len(s2_windows))
+            for i in xrange(n):
+                yield s1_windows[i * len(s1_windows) / n], \
+                    s2_windows[i * len(s2_windows) / n], l
+
+# fraction of tokens read that were dropped by max_seq_len; see load_data
+def tokens_dropped_frac(stats):
+    return float(stats['n_tokens_dropped']) / max(stats['n_tokens'], 1)
+
+def _cache_key(dataset, vocab, max_egs, update_vocab, parse_mode, max_seq_len=None,
+               max_seq_len_policy=None):
+    key = [os.path.abspath(dataset), os.path.getmtime(dataset), os.path.getsize(dataset),
+           max_egs, update_vocab, parse_mode, vocab.signature()]
+    if max_seq_len is not None:
+        # (only added when set so existing caches stay valid)
+        key.extend([max_seq_len, max_seq_len_policy])
+    h = hashlib.sha1()
+    h.update(json.dumps(key))
+    return "%s.%s" % (os.path.basename(dataset), h.hexdigest())
+
+# cache is a saved Corpus (a directory of .npy files) along with meta.json recording
+# stats and the tokens the load added to the vocab.
+def _save_cached_corpus(cache, corpus, stats, new_vocab_tokens):
+    # write to tmp dir and rename so concurrent runs never see a partial cache
+    tmp_cache = "%s.tmp.%s" % (cache, os.getpid())
+    corpus.save(tmp_cache)
+    with open(os.path.join(tmp_cache, "meta.json"), "w") as f:
+        json.dump({"stats": stats, "new_vocab_tokens": new_vocab_tokens}, f)
+    try:
+        os.rename(tmp_cache, cache)
+    except OSError:
+        shutil.rmtree(tmp_cache)  # another run beat us to it
+
+def _load_cached_corpus(cache, vocab):
+    with open(os.path.join(cache, "meta.json"), "r") as f:
+        meta = json.load(f)
+    # replay vocab additions so ids match those in the cache
+    for token in meta['new_vocab_tokens']:
+        vocab.id_for_token(token, update=True)
+    return Corpus.load(cache, mmap=True), Counter(meta['stats'])
+
+# pad a list of id sequences into a time major (time, batch) int32 matrix along with a
+# float32 mask of the same shape (1.0 => token, 0.0 => padding). sequences are right
+# padded with 0 (UNK); the mask stops padding from affecting rnn states.
+def pad_batch(seqs):
+    max_len = max(len(s) for s in seqs)
+    idxs = np.zeros((max_len, len(seqs)), dtype='int32')
+    mask = np.zeros((max_len, len(seqs)), dtype='float32')
+    for i, s in enumerate(seqs):
+        idxs[:len(s), i] = s
+        mask[:len(s), i] = 1.0
+    return idxs, mask
+
+# all shared variables made via shared() / zeros_in_the_shape_of(), in order of
+# creation. this covers all params & optimiser state; see checkpoint.py
+SHARED_VARIABLES = []
 
 def shared(values, name):
-    return theano.shared(np.asarray(values, dtype='float32'), name=name, borrow=True)
+    s = theano.shared(np.asarray(values, dtype='float32'), name=name, borrow=True)
+    SHARED_VARIABLES.append(s)
+    return s
 
 def sharedMatrix(n_rows, n_cols, name, scale=0.05, orthogonal_init=True):
     if orthogonal_init and n_rows < n_cols:
@@ -64,6 +347,13 @@ def eye(size, scale=1):
 def zeros(shape):
     return np.zeros(shape, dtype='float32')
 
+# confusion matrix (rows actual, cols predicted) from arrays of labels
+def confusion_matrix(actual, predicted, n_labels):
+    actual = np.asarray(actual, dtype='int64')
+    predicted = np.asarray(predicted, dtype='int64')
+    counts = np.bincount(actual * n_labels + predicted, minlength=n_labels * n_labels)
+    return counts.reshape((n_labels, n_labels))
+
 def accuracy(confusion):
     # ratio of on diagonal vs not on diagonal
     return np.sum(confusion * np.identity(len(confusion))) / np.sum(confusion)
@@ -77,6 +367,22 @@ def dts():
 def coin_flip():
     return random.random() > 0.5
 
+# l2 sums of layers' params_for_l2_penalty. dense params (shared variables) are summed
+# whole. the others are embedding rows looked up for a time major padded batch (masked,
+# and for tied embeddings several such lookups concatenated along time) so are
+# (time * batch_size, dim) and are summed per example. returns (dense_l2, per_eg_l2)
+# where per_eg_l2, (batch_size,), is the l2 sum of each example's own embedding rows.
+def l2_sums(layers, batch_size):
+    dense, per_eg = [], []
+    for p in itertools.chain(*[l.params_for_l2_penalty() for l in layers]):
+        if isinstance(p, theano.compile.SharedVariable):
+            dense.append((p**2).sum())
+        else:
+            per_eg.append((p**2).sum(axis=1).reshape((-1, batch_size)).sum(axis=0))
+    dense_l2 = T.sum(dense) if dense else np.float32(0)
+    per_eg_l2 = T.sum(per_eg, axis=0) if per_eg else T.zeros((batch_size,), 'float32')
+    return dense_l2, per_eg_l2
+
 def norms(layers):
     norms = defaultdict(dict)
     for l in layers:
@@ -102,5 +408,11 @@ def clipped(gradients, rescale=5.0):
     else:
         return _clip(gradients, rescale)
 
+# x[..., start:end] for a tensor of any ndim
+def last_axis_slice(x, start, end):
+    return x[(slice(None),) * (x.ndim - 1) + (slice(start, end),)]
+
 def zeros_in_the_shape_of(p):
-    return theano.shared(np.zeros(p.get_value().shape, dtype=p.get_value().dtype))
+    s = theano.shared(np.zeros(p.get_value().shape, dtype=p.get_value().dtype))
+    SHARED_VARIABLES.append(s)
+    return s
@@ -1,36 +1,152 @@
+import hashlib
+import itertools
+import numpy as np
+
+# token <-> id mapping. id 0 is reserved for UNK, which is what tokens not in the vocab map
+# to when not updating; other tokens get ids 1, 2, ... in order of first occurrence.
+# tokens are kept in a list by id (the UNK slot is None) with a dict for token -> id
+# lookups, and token frequencies (see add_counts) in an int64 array by id.
+#
+# a vocab file is either tsv (token \t id) or, if it ends in .npz, binary (see save).
+# a closed vocab's tsv has a first line of CLOSED_MARKER (which, having no tab, can't be
+# a token line).
+# a vocab read from a file is fixed; looking up a missing token with update=True is an
+# error unless the vocab is closed (eg after pruning) in which case it's UNK.
 class Vocab(object):
+    UNK_ID = 0
+    CLOSED_MARKER = "<closed>"
 
     def __init__(self, vocab_file=None):
+        self.tokens = [None]  # id -> token
         self.token_id = {}
-        self.id_token = {}
-        self.UNK_ID = 0
-        self.seq = 1
+        self._counts = np.zeros(1, dtype='int64')
+        self.closed = False
         self.vocab_file = vocab_file
-        if vocab_file:
+        if vocab_file is None:
+            pass
+        elif vocab_file.endswith(".npz"):
+            self._load_binary(vocab_file)
+        else:
+            id_tokens = []
             for line in open(vocab_file, "r"):
+                if line.rstrip("\n") == self.CLOSED_MARKER:
+                    self.closed = True
+                    continue
                 token, idx = line.strip().split("\t")
-                idx = int(idx)
+                id_tokens.append((int(idx), token))
+            for idx, token in sorted(id_tokens):
                 assert token not in self.token_id, "dup entry for token [%s]" % token
-                assert idx not in self.id_token, "dup entry for idx [%s]" % idx
                 assert idx != 0, "expecting to reserve 0 id for UNK"
-                self.token_id[token] = idx
-                self.id_token[idx] = token
+                assert idx == len(self.tokens), "expecting ids 1..n; missing or dup %s" % idx
+                self._add(token)
 
     def size(self):
-        return len(self.token_id) + 1  # +1 for UNK
+        return len(self.tokens)  # includes UNK
+
+    # next id to be assigned
+    @property
+    def seq(self):
+        return len(self.tokens)
+
+    def _add(self, token):
+        self.token_id[token] = len(self.tokens)
+        self.tokens.append(token)
+        return len(self.tokens) - 1
 
     def id_for_token(self, token, update=True):
-        if token in self.token_id:
-            return self.token_id[token]
-        elif not update:
+        idx = self.token_id.get(token)
+        if idx is not None:
+            return idx
+        elif not update or self.closed:
             return self.UNK_ID
         elif self.vocab_file is not None:
             raise Exception("cstrd with vocab_file=[%s] but missing entry [%s]" % (self.vocab_file, token))
         else:
-            self.token_id[token] = self.seq
-            self.id_token[self.seq] = token
-            self.seq += 1
-            return self.seq - 1
+            return self._add(token)
 
     def ids_for_tokens(self, tokens, update=True):
-        return [self.id_for_token(t, update) for t in tokens]
+        # a single pass of dict lookups; tokens are only added (in order) if any are missing
+        ids = map(self.token_id.get, tokens, itertools.repeat(self.UNK_ID, len(tokens)))
+        if update and not self.closed and self.UNK_ID in ids:
+            ids = [idx or self.id_for_token(token) for idx, token in zip(ids, tokens)]
+        return ids
+
+    # ids for a list of token lists as one flat int32 array with (CSR style) offsets,
+    # as for Corpus; ids for token_lists[i] are ids[offsets[i]:offsets[i+1]]
+    def ids_for_token_lists(self, token_lists, update=True):
+        ids = self.ids_for_tokens(list(itertools.chain.from_iterable(token_lists)), update)
+        offsets = np.zeros(len(token_lists) + 1, dtype='int64')
+        np.cumsum([len(tokens) for tokens in token_lists], out=offsets[1:])
+        return np.asarray(ids, dtype='int32'), offsets
+
+    def tokens_since(self, seq):
+        # tokens added (in id order) since self.seq was seq
+        return self.tokens[seq:]
+
+    # (id, token) for all but UNK, in id order
+    def items(self):
+        return list(enumerate(self.tokens[1:], 1))
+
+    # count an occurrence of each of ids (eg all token ids of a training set)
+    def add_counts(self, ids):
+        counts = np.bincount(np.asarray(ids, dtype='int64').ravel(), minlength=self.size())
+        self._counts = np.concatenate([self._counts, np.zeros(len(counts) - len(self._counts),
+                                                              dtype='int64')])
+        self._counts += counts
+
+    # count per id (UNK's count is of tokens that mapped to UNK)
+    def counts(self):
+        return np.concatenate([self._counts, np.zeros(self.size() - len(self._counts),
+                                                      dtype='int64')])
+
+    # a new, closed, vocab of the (at most max_size) most frequent tokens with a count of
+    # at least min_count. ids are by decreasing count (ties in id order). tokens dropped
+    # are counted against UNK.
+    def pruned(self, min_count=1, max_size=None):
+        counts = self.counts()
+        keep = np.nonzero(counts[1:] >= min_count)[0] + 1
+        keep = keep[np.argsort(-counts[keep], kind='mergesort')][:max_size]
+        vocab = Vocab()
+        for idx in keep:
+            vocab._add(self.tokens[idx])
+        vocab._counts = np.concatenate([[counts.sum() - counts[keep].sum()], counts[keep]])
+        vocab.closed = True
+        return vocab
+
+    # write as binary (path ends in .npz) or tsv. binary is the tokens, utf-8 encoded and
+    # newline separated, as one uint8 array along with counts; loading it is a single
+    # decode & split rather than a parse per line.
+    def save(self, path):
+        tokens = [t.encode('utf-8') if isinstance(t, unicode) else t for t in self.tokens[1:]]
+        if path.endswith(".npz"):
+            assert not any("\n" in t for t in tokens), "can't save tokens containing newlines"
+            with open(path, "wb") as f:
+                np.savez(f, tokens=np.frombuffer("\n".join(tokens), dtype='uint8'),
+                         counts=self.counts(), closed=np.array(self.closed))
+        else:
+            with open(path, "w") as f:
+                if self.closed:
+                    print >>f, self.CLOSED_MARKER
+                for idx, token in enumerate(tokens, 1):
+                    print >>f, "%s\t%d" % (token, idx)
+
+    def _load_binary(self, path):
+        arrays = np.load(path)
+        data = arrays["tokens"].tostring().decode('utf-8')
+        tokens = data.split("\n") if data else []
+        self.tokens = [None] + tokens
+        self.token_id = dict(itertools.izip(tokens, itertools.count(1)))
+        assert len(self.token_id) == len(tokens), "dup entries in %s" % path
+        self._counts = arrays["counts"]
+        self.closed = bool(arrays["closed"])
+
+    def signature(self):
+        # digest of token -> id mapping; changes whenever the vocab does
+        h = hashlib.sha1()
+        for idx, token in self.items():
+            if isinstance(token, unicode):
+                token = token.encode('utf-8')
+            h.update("%s\t%s\n" % (token, idx))
+        if self.closed:
+            h.update("closed")  # loads differ; missing tokens become UNK
+        return h.hexdigest()